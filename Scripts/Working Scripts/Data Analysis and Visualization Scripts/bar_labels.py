@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module adds the value labels on top of the bars of a bar chart, shared
+by every script that draws one.
+
+add_value_labels used to be copied into every script and created one
+rotated Annotation per bar. Here the positions and the strings of all the
+labels are computed in one vectorized pass from the arrays of the bar
+container, and the labels are drawn as one TextCollection per sign (labels
+of negative bars hang below them).
+
+Charts with more bars than max_labels, for example neighbourhood-level
+bars, are thinned: the labels of the tallest bars are placed first and a
+label that would overlap one already placed is left out. value_table
+returns every value of a chart as a table, for the outputs that need all of
+them next to a thinned chart.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+from matplotlib.container import BarContainer
+
+from text_collection import add_texts  # Many texts drawn as a single artist
+
+# Above this number of bars, the labels are thinned to the ones that fit
+max_labels = 60
+
+
+# %% --- Helper functions and definitions ---
+
+# Helper function: The bar containers of an axis
+def bar_containers(ax):
+    return [container for container in ax.containers if isinstance(container, BarContainer)]
+
+
+def bar_arrays(bars):
+    """Return the centers, tops and values of the bars of a container.
+
+    Arguments:
+        bars (matplotlib.container.BarContainer): As returned by ax.bar.
+
+    Returns:
+        tuple of numpy.ndarray: (centers, tops, values), values keep the
+        dtype the bars were drawn from.
+    """
+
+    # x, y, width and height of every bar in one array, the height of a
+    # negative bar is negative so its top is its lower end
+    extents = np.array([rect.get_bbox().bounds for rect in bars.patches]).reshape(-1, 4)
+
+    centers = extents[:, 0] + extents[:, 2] / 2
+    tops = extents[:, 1] + extents[:, 3]
+
+    return centers, tops, np.asarray(bars.datavalues)
+
+
+# Helper function: Add labels to the top of a bar chart.
+def add_value_labels(ax, bars=None, spacing=5, fontsize=15, label_format="{:}", thin_above=None):
+    """Add labels to the end of each bar in a bar chart.
+
+    Arguments:
+        ax (matplotlib.axes.Axes): The matplotlib object containing the axes
+            of the plot to annotate.
+        bars (matplotlib.container.BarContainer): The bars to label, every
+            bar container of the axis if None.
+        spacing (int): The distance between the labels and the bars.
+        fontsize (float): The font size of the labels.
+        label_format (str): Format of the values.
+        thin_above (int): Thin the labels out when there are more bars,
+            max_labels if None.
+
+    Returns:
+        list of text_collection.TextCollection: The labels, one collection
+        per sign of the values.
+    """
+
+    containers = [bars] if bars is not None else bar_containers(ax)
+
+    if not containers:
+        return []
+
+    centers, tops, values = [np.concatenate(arrays) for arrays in zip(*map(bar_arrays, containers))]
+
+    thin = len(values) > (thin_above or max_labels)
+
+    # Tallest bars first, so thinning keeps the labels of the largest values
+    order = np.argsort(-np.abs(values), kind="stable") if thin else np.arange(len(values))
+
+    labels = np.array([label_format.format(value) for value in values], dtype=object)
+
+    collections = []
+
+    # Labels of positive bars sit above them, the ones of negative bars below
+    for negative, space, alignment in [(False, spacing, "bottom"), (True, -spacing, "top")]:
+        selected = order[(values[order] < 0) == negative]
+
+        if not len(selected):
+            continue
+
+        collections.append(add_texts(ax, centers[selected], tops[selected], labels[selected],
+                                     offset=(0, space),
+                                     horizontalalignment="center",
+                                     verticalalignment=alignment,
+                                     rotation=90,
+                                     fontsize=fontsize,
+                                     avoid_collisions=thin))
+
+    return collections
+
+
+def value_table(ax, names=None, label_format="{:}"):
+    """Return the values of every bar of an axis as a table.
+
+    Arguments:
+        ax (matplotlib.axes.Axes): The bar chart.
+        names (list of str): The name of every bar, in the order of the bars.
+        label_format (str): Format of the values in the label column.
+
+    Returns:
+        pandas.DataFrame: position, name, value and label columns.
+    """
+
+    containers = bar_containers(ax)
+
+    if not containers:
+        return pd.DataFrame(columns=["position", "name", "value", "label"])
+
+    centers, tops, values = [np.concatenate(arrays) for arrays in zip(*map(bar_arrays, containers))]
+
+    return pd.DataFrame({"position": centers,
+                         "name": names if names is not None else [""] * len(values),
+                         "value": values,
+                         "label": [label_format.format(value) for value in values]})
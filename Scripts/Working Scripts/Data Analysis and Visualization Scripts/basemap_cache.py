@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module keeps the basemap tiles of the map figures on disk so that the
+maps can be rendered without network access.
+
+ctx.add_basemap fetches its tiles over the network on every render, which
+hangs on the air-gapped render hosts. Instead, the tiles are downloaded once
+by the prewarm command on a connected machine:
+
+    python basemap_cache.py prewarm --zooms 11
+
+and the map figures are rendered with add_basemap from this module, which
+only reads tiles from the local tile store. A missing tile raises
+TileCacheMiss instead of reaching for the network.
+
+Every map of a run shows the same Istanbul extent at the same zoom, so the
+stitched and warped basemap is composed once and kept both in memory and as
+a memory-mapped .npy file under Data/Cache/basemaps, the following map axes
+only draw it with imshow at its fixed extent.
+
+The tile store is laid out as <tile directory>/<provider>/<z>/<x>/<y>.png,
+so a directory of fake tiles with the same layout can stand in for it. The
+store is Data/Cache/tiles by default and can be moved with the
+BASEMAP_TILE_DIRECTORY environment variable.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import hashlib
+import io
+import json
+import os
+
+import contextily as ctx  # Used in conjuction with matplotlib/geopandas to set a basemap
+import mercantile  # For the XYZ tile grid
+import numpy as np
+from matplotlib import patheffects  # For the halo of the attribution text
+from PIL import Image  # For reading the tiles
+from pyproj import Transformer  # For moving axis limits between CRSs
+
+import data_loader  # Shared, cached reader of the input datasets
+
+# %% --- Tile store settings ---
+
+# Where the tiles are kept
+tile_directory = os.environ.get("BASEMAP_TILE_DIRECTORY",
+                                os.path.join(data_loader.cache_directory, "tiles"))
+
+# The basemap every map figure of the project uses
+default_source = ctx.providers.Esri.WorldGrayCanvas
+
+# The zoom levels the map figures are rendered at
+default_zooms = [11]
+
+# Where the composed basemaps are kept between runs
+composed_directory = os.path.join(data_loader.cache_directory, "basemaps")
+
+# Basemaps already composed in this process, keyed by composition key
+_composed_basemaps = {}
+
+
+# %% --- Helper functions and definitions ---
+
+class TileCacheMiss(FileNotFoundError):
+    """Raised when a tile needed by a map isn't in the local tile store."""
+
+
+# Helper function: Locate a tile in the store
+def tile_path(source, tile, directory=None):
+    """Return the path of a tile in the tile store.
+
+    Arguments:
+        source (xyzservices.TileProvider): The provider of the tile.
+        tile (mercantile.Tile): The x, y and zoom of the tile.
+        directory (str): The tile store, the default store if None.
+    """
+
+    return os.path.join(directory or tile_directory, source.name,
+                        str(tile.z), str(tile.x), "{}.png".format(tile.y))
+
+
+# Helper function: List the tiles covering a lon/lat box
+def tiles_for_bounds(west, south, east, north, zooms):
+    """Return the tiles covering a lon/lat bounding box at the given zooms."""
+
+    return list(mercantile.tiles(west, south, east, north, zooms))
+
+
+# Helper function: Istanbul's bounding box in lon/lat
+def istanbul_bounds(margin=0.1):
+    """Return the lon/lat bounding box of the Istanbul districts.
+
+    Arguments:
+        margin (float): Padding added on every side, as a share of the box
+            size, so that the axis margins of the maps are covered too.
+    """
+
+    west, south, east, north = data_loader.load_districts().to_crs("EPSG:4326").total_bounds
+    pad_x = (east - west) * margin
+    pad_y = (north - south) * margin
+
+    return west - pad_x, south - pad_y, east + pad_x, north + pad_y
+
+
+# Helper function: Make sure the tiles of a box are in the store
+def check_tiles(tiles, source, directory=None):
+    """Raise TileCacheMiss if any of the tiles isn't in the tile store."""
+
+    missing = [tile_path(source, tile, directory) for tile in tiles
+               if not os.path.exists(tile_path(source, tile, directory))]
+
+    if missing:
+        raise TileCacheMiss("{} of {} basemap tiles are not in the tile store, first missing: {}\n"
+                            "Run 'python basemap_cache.py prewarm' on a connected machine "
+                            "and copy the tile store to this host.".format(len(missing), len(tiles), missing[0]))
+
+
+# Helper function: Read and stitch the tiles of a box
+def read_tiles(tiles, source, directory=None):
+    """Stitch tiles from the tile store into a single image.
+
+    Arguments:
+        tiles (list of mercantile.Tile): Tiles of a single zoom level.
+        source (xyzservices.TileProvider): The provider of the tiles.
+        directory (str): The tile store, the default store if None.
+
+    Returns:
+        (numpy.ndarray, tuple): The RGBA image and its extent
+            (left, right, bottom, top) in EPSG:3857.
+    """
+
+    check_tiles(tiles, source, directory)
+
+    xs = [tile.x for tile in tiles]
+    ys = [tile.y for tile in tiles]
+    x_min, y_min = min(xs), min(ys)
+
+    mosaic = None
+
+    for tile in tiles:
+        with Image.open(tile_path(source, tile, directory)) as tile_image:
+            pixels = np.asarray(tile_image.convert("RGBA"))
+
+        size = pixels.shape[0]
+
+        # Allocate the mosaic once the tile size is known
+        if mosaic is None:
+            mosaic = np.zeros(((max(ys) - y_min + 1) * size, (max(xs) - x_min + 1) * size, 4), dtype=np.uint8)
+
+        # Tile rows grow southwards, like image rows
+        row = (tile.y - y_min) * size
+        column = (tile.x - x_min) * size
+        mosaic[row:row + size, column:column + size] = pixels
+
+    top_left = mercantile.xy_bounds(x_min, y_min, tiles[0].z)
+    bottom_right = mercantile.xy_bounds(max(xs), max(ys), tiles[0].z)
+    extent = (top_left.left, bottom_right.right, bottom_right.bottom, top_left.top)
+
+    return mosaic, extent
+
+
+# %% --- Basemap from the tile store ---
+
+# Helper function: Identify a composition
+def composition_key(source, tiles, crs, directory=None):
+    """Return a key that changes whenever the composed basemap would.
+
+    The size and modification time of every tile are part of the key, so a
+    tile replaced in the store, by prewarm or by copying a newer store, is
+    composed again instead of being served from a stale .npy file.
+
+    Arguments:
+        source (xyzservices.TileProvider): The provider of the tiles.
+        tiles (list of mercantile.Tile): Tiles of a single zoom level.
+        crs (str): The CRS the mosaic is warped to.
+        directory (str): The tile store, the default store if None.
+
+    Raises:
+        TileCacheMiss: If any of the tiles isn't in the tile store.
+    """
+
+    check_tiles(tiles, source, directory)
+
+    xs = [tile.x for tile in tiles]
+    ys = [tile.y for tile in tiles]
+    tile_stats = [os.stat(tile_path(source, tile, directory)) for tile in sorted(tiles)]
+    description = json.dumps([source.name, tiles[0].z, min(xs), max(xs), min(ys), max(ys),
+                              str(crs).upper(), os.path.abspath(directory or tile_directory),
+                              [[stat.st_size, stat.st_mtime_ns] for stat in tile_stats]])
+
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:20]
+
+
+def composed_basemap(source, tiles, crs, directory=None):
+    """Return the stitched and warped basemap of a set of tiles.
+
+    The composition is done once, then served from memory within a run and
+    from a memory-mapped .npy file in later runs, as long as the tiles in the
+    store are the same (see composition_key).
+
+    Arguments:
+        source (xyzservices.TileProvider): The provider of the tiles.
+        tiles (list of mercantile.Tile): Tiles of a single zoom level.
+        crs (str): The CRS the mosaic is warped to.
+        directory (str): The tile store, the default store if None.
+
+    Returns:
+        (numpy.ndarray, tuple): The image and its extent (left, right,
+            bottom, top) in the given CRS.
+    """
+
+    key = composition_key(source, tiles, crs, directory)
+
+    if key in _composed_basemaps:
+        return _composed_basemaps[key]
+
+    image_path = os.path.join(composed_directory, key + ".npy")
+    extent_path = os.path.join(composed_directory, key + ".json")
+
+    if os.path.exists(image_path) and os.path.exists(extent_path):
+        image = np.load(image_path, mmap_mode="r")
+        with open(extent_path, "r", encoding="utf-8") as extent_file:
+            extent = tuple(json.load(extent_file))
+    else:
+        image, extent = read_tiles(tiles, source, directory)
+
+        # Bring the web mercator mosaic to the CRS of the axis
+        image, extent = ctx.warp_tiles(image, extent, t_crs=crs)
+        extent = tuple(float(bound) for bound in extent)
+
+        os.makedirs(composed_directory, exist_ok=True)
+        np.save(image_path + ".tmp.npy", image)
+        os.replace(image_path + ".tmp.npy", image_path)
+        with open(extent_path + ".tmp", "w", encoding="utf-8") as extent_file:
+            json.dump(extent, extent_file)
+        os.replace(extent_path + ".tmp", extent_path)
+
+    _composed_basemaps[key] = (image, extent)
+
+    return image, extent
+
+
+def add_basemap(ax, zoom=11, crs="EPSG:4326", source=None, directory=None,
+                interpolation="bilinear", attribution=True):
+    """Add a basemap read from the local tile store to a map axis.
+
+    This mirrors ctx.add_basemap, the tiles covering the current axis limits
+    are stitched, warped to the axis CRS and drawn with imshow. The axis
+    limits are kept as they were. Axes covering the same tiles share one
+    composed image.
+
+    Arguments:
+        ax (matplotlib.axes.Axes): The map axis, with its data already plotted.
+        zoom (int): The zoom level of the tiles.
+        crs (str): The CRS of the axis data.
+        source (xyzservices.TileProvider): The basemap, Esri.WorldGrayCanvas
+            if None.
+        directory (str): The tile store, the default store if None.
+        interpolation (str): Passed to imshow.
+        attribution (bool): Whether to write the provider's attribution.
+    """
+
+    source = source or default_source
+
+    x_min, x_max, y_min, y_max = ax.axis()
+
+    # Tiles are enumerated from lon/lat, the axis can be in any CRS
+    to_lonlat = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+    west, south = to_lonlat.transform(x_min, y_min)
+    east, north = to_lonlat.transform(x_max, y_max)
+
+    image, extent = composed_basemap(source, tiles_for_bounds(west, south, east, north, [zoom]), crs, directory)
+
+    ax.imshow(image, extent=extent, interpolation=interpolation)
+    ax.axis((x_min, x_max, y_min, y_max))
+
+    if attribution and source.get("attribution"):
+        add_attribution(ax, source.get("attribution"))
+
+
+# Helper function: Credit the basemap provider
+def add_attribution(ax, text, font_size=8):
+    """Write the attribution of the basemap in the lower left of the axis.
+
+    Looks like ctx.add_attribution, which can't be used here: it draws the
+    whole figure to measure the axis and attaches a lambda to the text, and
+    a figure holding a lambda can't be pickled for figure_export.
+
+    Arguments:
+        ax (matplotlib.axes.Axes): The map axis.
+        text (str): The attribution of the provider.
+        font_size (int): The size of the text.
+    """
+
+    return ax.text(0.005, 0.005, text,
+                   transform=ax.transAxes,
+                   size=font_size,
+                   path_effects=[patheffects.withStroke(linewidth=2, foreground="w")])
+
+
+# %% --- Fill the tile store ---
+
+def prewarm(zooms=None, source=None, bounds=None, directory=None, timeout=30):
+    """Download the tiles of a bounding box into the tile store.
+
+    Tiles that are already in the store are skipped, so the command can be
+    run again to resume an interrupted download.
+
+    Arguments:
+        zooms (list of int): The zoom levels to download, [11] if None.
+        source (xyzservices.TileProvider): The basemap, Esri.WorldGrayCanvas
+            if None.
+        bounds (tuple): (west, south, east, north) in lon/lat, the bounding
+            box of the Istanbul districts if None.
+        directory (str): The tile store, the default store if None.
+        timeout (float): Seconds to wait for a tile before giving up.
+
+    Returns:
+        (int, int): Number of downloaded and of already stored tiles.
+    """
+
+    import requests  # Only the prewarm command touches the network
+
+    source = source or default_source
+    west, south, east, north = bounds or istanbul_bounds()
+
+    downloaded = 0
+    stored = 0
+
+    for tile in tiles_for_bounds(west, south, east, north, zooms or default_zooms):
+        path = tile_path(source, tile, directory)
+
+        if os.path.exists(path):
+            stored += 1
+            continue
+
+        response = requests.get(source.build_url(x=tile.x, y=tile.y, z=tile.z),
+                                headers={"user-agent": "contextily-" + ctx.__version__},
+                                timeout=timeout)
+        response.raise_for_status()
+
+        # Store the tile as PNG whatever the provider serves
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with Image.open(io.BytesIO(response.content)) as tile_image:
+            tile_image.save(path + ".tmp", format="PNG")
+        os.replace(path + ".tmp", path)
+
+        downloaded += 1
+
+    return downloaded, stored
+
+
+def missing_tiles(zooms=None, source=None, bounds=None, directory=None):
+    """Return the paths of the tiles a render would need but the store lacks."""
+
+    source = source or default_source
+    west, south, east, north = bounds or istanbul_bounds()
+
+    return [tile_path(source, tile, directory)
+            for tile in tiles_for_bounds(west, south, east, north, zooms or default_zooms)
+            if not os.path.exists(tile_path(source, tile, directory))]
+
+
+# %% --- Command line ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the offline basemap tile store.")
+    parser.add_argument("command", choices=["prewarm", "check"],
+                        help="prewarm downloads the Istanbul tiles, check lists the missing ones.")
+    parser.add_argument("--zooms", type=int, nargs="+", default=default_zooms, help="Zoom levels.")
+    parser.add_argument("--tile-directory", default=None, help="The tile store.")
+    arguments = parser.parse_args()
+
+    if arguments.command == "prewarm":
+        new_tiles, existing_tiles = prewarm(arguments.zooms, directory=arguments.tile_directory)
+        print("Downloaded {} tiles, {} were already stored.".format(new_tiles, existing_tiles))
+    else:
+        absent = missing_tiles(arguments.zooms, directory=arguments.tile_directory)
+        for absent_path in absent:
+            print(absent_path)
+        print("{} tiles missing.".format(len(absent)))
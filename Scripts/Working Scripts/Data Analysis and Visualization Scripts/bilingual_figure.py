@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module lets a script draw a figure once and export it in both English
+and Turkish.
+
+The choropleth, the bars, the colormaps and the colorbars of the English and
+the Turkish versions of a figure are identical, only their text differs. A
+BilingualFigure holds the figure with its data artists already drawn, a
+string table with one entry per locale, and the text setters bound to the
+keys of that table. Exporting a locale applies its strings to the bound
+texts and hands a snapshot of the figure to figure_export, so the data is
+drawn once for both languages and the two versions can't drift apart.
+
+Typical use:
+
+    figure_strings = {"en": {"xlabel": "District"},
+                      "tr": {"xlabel": "İlçe"}}
+
+    spec = BilingualFigure(fig, figure_strings)
+    spec.bind("xlabel", lambda text: ax.set_xlabel(text, fontdict=font_axislabels))
+
+    spec.export("en", complete_output_directory + "/yayilim_eng", [("svg", 1200), ("png", 300)])
+    spec.export("tr", complete_output_directory + "/yayilim_tr", [("svg", 1200), ("png", 300)])
+
+    figure_export.flush()  # Write the queued outputs in parallel
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import matplotlib.pyplot as plt  # For plotting
+
+import figure_export  # Parallel export of the finished figures
+
+
+# %% --- Bilingual figure ---
+
+class BilingualFigure:
+    """A figure drawn once whose text is swapped per locale before export.
+
+    Arguments:
+        fig (matplotlib.figure.Figure): The figure, with its data drawn.
+        strings (dict): Locale -> {key -> text}. A value can also be a list,
+            for example the district names of the map labels.
+        tight_layout (bool): Whether to call tight_layout after relabelling,
+            for figures that don't use constrained layout.
+    """
+
+    def __init__(self, fig, strings, tight_layout=False):
+        self.fig = fig
+        self.strings = strings
+        self.tight_layout = tight_layout
+        self.locale = None
+        self._bindings = []
+
+    def bind(self, key, setter):
+        """Bind a text setter to a key of the string table.
+
+        Arguments:
+            key (str): The key in the string table of every locale.
+            setter (callable): Called with the localized value of the key.
+        """
+
+        # Every locale has to provide the key, a missing translation should
+        # fail here rather than leave the other language's text in a figure
+        for locale, table in self.strings.items():
+            if key not in table:
+                raise KeyError("Locale '{}' has no string for '{}'.".format(locale, key))
+
+        self._bindings.append((key, setter))
+
+        # Keep the new text in line with the locale already applied
+        if self.locale is not None:
+            setter(self.strings[self.locale][key])
+
+    def apply(self, locale):
+        """Set every bound text to the strings of a locale."""
+
+        table = self.strings[locale]
+
+        for key, setter in self._bindings:
+            setter(table[key])
+
+        # Texts of another length need the layout to be computed again
+        if self.tight_layout:
+            self.fig.tight_layout()
+
+        self.locale = locale
+
+    def export(self, locale, export_path_stem, formats):
+        """Relabel the figure for a locale and queue it in several formats.
+
+        The outputs are written by figure_export.flush.
+
+        Arguments:
+            locale (str): The locale to export, a key of the string table.
+            export_path_stem (str): The output path without its extension.
+            formats (list of (str, int)): The file formats and their dpi.
+
+        Returns:
+            list of str: The paths that will be written.
+        """
+
+        self.apply(locale)
+
+        return figure_export.submit(self.fig, export_path_stem, formats)
+
+    def close(self):
+        plt.close(self.fig)
+
+
+# Helper function: Setter that relabels a list of text artists
+def text_setter(texts):
+    """Return a setter that writes a list of strings into a list of texts.
+
+    Arguments:
+        texts (list of matplotlib.text.Text): Text artists, such as the
+            annotations of a map, in the order of the strings.
+    """
+
+    def set_texts(values):
+        for text, value in zip(texts, values):
+            text.set_text(value)
+
+    return set_texts
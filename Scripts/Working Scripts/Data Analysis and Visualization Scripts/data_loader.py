@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module is the single place where the analysis and visualization scripts
+read their input datasets:
+
+    - park_location_cleaned.csv (parks and green areas of Istanbul)
+    - district_income.xlsx (population, income and green space per district)
+    - istanbul_districts.shp (district polygons)
+
+Parsing the Excel sheet with openpyxl and the shapefile with fiona is slow,
+so every source is parsed only once and stored as an uncompressed Feather
+file under Data/Cache. The cache is keyed on the modification time and the
+SHA-256 hash of the source, later runs memory-map the Feather columns
+instead of parsing the source again.
+
+Within a single process the loaded frames are also kept in memory, so the
+scripts that run in the same interpreter share one read of every source.
+
+Run this file directly to (re)build the cache ahead of a batch:
+
+    python data_loader.py [--rebuild]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import geopandas as gpd  # A module built on top of pandas for geospatial analysis
+import pandas as pd  # For general data processing tasks
+from pyarrow import feather  # For memory-mapped reads of the cache
+
+# %% --- Paths of the datasets ---
+
+# The repository's Data folder, resolved from this file so that the loader
+# works regardless of the current working directory
+data_directory = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                               "..", "..", "..", "Data"))
+
+# Folder that holds the binary copies of the sources
+cache_directory = os.path.join(data_directory, "Cache")
+
+# Istanbul parks and green areas services data
+parks_fp = os.path.join(data_directory, "Non-GIS data", "cleaned", "park_location_cleaned.csv")
+
+# Istanbul districts extra data
+districts_extra_fp = os.path.join(data_directory, "Non-GIS data", "external", "district_income.xlsx")
+
+# Istanbul geospatial districts data
+istanbul_districts_fp = os.path.join(data_directory, "GIS data", "Processed", "istanbul_districts.shp")
+
+# Satellite image of Istanbul and the district outlines traced on its grid
+satellite_image_fp = os.path.join(data_directory, "Non-GIS data", "external", "satellite-map-of-istanbul.jpg")
+districts_image_fp = os.path.join(data_directory, "Non-GIS data", "external", "districts_cleaned.jpg")
+
+# Frames already loaded in this process, keyed by dataset name, parameters
+# and cache folder
+_loaded_frames = {}
+
+
+# %% --- Helper functions and definitions ---
+
+# Helper function: Hash a file in chunks
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the hex SHA-256 digest of a file.
+
+    Arguments:
+        path (str): The file to hash.
+        chunk_size (int): Number of bytes read at a time.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Helper function: Fingerprint a set of source files
+def source_fingerprint(paths):
+    """Return the mtime, size and hash of the given source files.
+
+    A shapefile is made of several sidecar files (.shp, .dbf, .shx, ...),
+    so a dataset can depend on more than one path.
+
+    Arguments:
+        paths (list of str): The files the dataset is built from.
+    """
+
+    fingerprint = {}
+
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint[os.path.basename(path)] = {"mtime_ns": stat.st_mtime_ns,
+                                               "size": stat.st_size,
+                                               "sha256": None}
+
+    return fingerprint
+
+
+# Helper function: Check whether a cached copy is still valid
+def is_cache_valid(manifest_path, paths, parameters=None):
+    """Return True if the cache described by the manifest matches the sources.
+
+    Unchanged modification times and sizes are trusted as is. When a
+    timestamp moved (a fresh checkout, a copy, a touch) the source is hashed
+    and the cache is kept if the content is the same, the manifest is then
+    updated with the new timestamps so that the hash isn't computed again.
+
+    Arguments:
+        manifest_path (str): The JSON manifest written next to the cache.
+        paths (list of str): The files the dataset is built from.
+        parameters (dict): The settings the dataset was derived with.
+    """
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return False
+
+    current = source_fingerprint(paths)
+
+    # A source was added or removed from the dataset
+    if set(current) != set(manifest.get("sources", {})):
+        return False
+
+    # The dataset was derived with other settings
+    if manifest.get("parameters") != parameters:
+        return False
+
+    touched = False
+
+    for name, stamp in current.items():
+        cached = manifest["sources"][name]
+
+        # Fast path: the file wasn't touched since the cache was written
+        if stamp["mtime_ns"] == cached["mtime_ns"] and stamp["size"] == cached["size"]:
+            continue
+
+        # Slow path: the file was touched, compare the content
+        if stamp["size"] != cached["size"] or file_sha256(paths_by_name(paths)[name]) != cached["sha256"]:
+            return False
+
+        cached["mtime_ns"] = stamp["mtime_ns"]
+        touched = True
+
+    if touched:
+        write_manifest(manifest_path, manifest)
+
+    return True
+
+
+# Helper function: Map base names to full paths
+def paths_by_name(paths):
+    return {os.path.basename(path): path for path in paths}
+
+
+# Helper function: Write a manifest atomically
+def write_manifest(manifest_path, manifest):
+    temporary_path = manifest_path + ".tmp"
+
+    with open(temporary_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    os.replace(temporary_path, manifest_path)
+
+
+# Helper function: Read a dataset from its cache or from its sources
+def load_cached(name, paths, read_source, geo=False, rebuild=False, directory=None, parameters=None):
+    """Return a dataset, parsing its sources only if the cache is stale.
+
+    Arguments:
+        name (str): The name of the dataset, used for the cache file names.
+        paths (list of str): The files the dataset is built from.
+        read_source (callable): Parses the sources into a (Geo)DataFrame.
+        geo (bool): Whether the dataset is a GeoDataFrame.
+        rebuild (bool): Ignore the cache and parse the sources again.
+        directory (str): Where the cache is written, Data/Cache if None.
+        parameters (dict): Settings a derived dataset is built with, the
+            cache is rebuilt when they change. Must be JSON serializable.
+    """
+
+    directory = directory or cache_directory
+
+    # Serve the frame already read by another script in this process, with
+    # the same settings and from the same cache
+    memo_key = (name, json.dumps(parameters, sort_keys=True), os.path.abspath(directory))
+
+    if memo_key in _loaded_frames and not rebuild:
+        return _loaded_frames[memo_key].copy()
+
+    cache_path = os.path.join(directory, name + ".feather")
+    manifest_path = os.path.join(directory, name + ".json")
+
+    if not rebuild and os.path.exists(cache_path) and is_cache_valid(manifest_path, paths, parameters):
+        # Memory-map the columns instead of copying the file into memory
+        if geo:
+            frame = gpd.read_feather(cache_path, memory_map=True)
+        else:
+            frame = feather.read_table(cache_path, memory_map=True).to_pandas()
+    else:
+        frame = read_source()
+
+        # Fingerprint the sources before writing, a change during the write
+        # then makes the cache stale instead of silently wrong
+        manifest = {"dataset": name, "sources": source_fingerprint(paths), "parameters": parameters}
+        for source_name, path in paths_by_name(paths).items():
+            manifest["sources"][source_name]["sha256"] = file_sha256(path)
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Feather files are written uncompressed so they can be memory-mapped
+        temporary_path = cache_path + ".tmp"
+        frame.reset_index(drop=True).to_feather(temporary_path, compression="uncompressed")
+        os.replace(temporary_path, cache_path)
+        write_manifest(manifest_path, manifest)
+
+    _loaded_frames[memo_key] = frame
+
+    return frame.copy()
+
+
+# Helper function: List the sidecar files of a shapefile
+def shapefile_parts(shp_path):
+    stem = os.path.splitext(shp_path)[0]
+    parts = [stem + suffix for suffix in (".shp", ".shx", ".dbf", ".prj", ".cpg")]
+
+    return [part for part in parts if os.path.exists(part)]
+
+
+# %% --- Dataset loaders ---
+
+def load_parks(rebuild=False):
+    """Return the Istanbul parks and green areas services data."""
+
+    return load_cached("park_location_cleaned",
+                       [parks_fp],
+                       lambda: pd.read_csv(parks_fp),
+                       rebuild=rebuild)
+
+
+def load_districts_extra(rebuild=False):
+    """Return the population, income and green space data of the districts."""
+
+    return load_cached("district_income",
+                       [districts_extra_fp],
+                       lambda: pd.read_excel(districts_extra_fp),
+                       rebuild=rebuild)
+
+
+def load_districts(rebuild=False):
+    """Return the Istanbul geospatial districts data as a GeoDataFrame."""
+
+    return load_cached("istanbul_districts",
+                       shapefile_parts(istanbul_districts_fp),
+                       lambda: gpd.read_file(istanbul_districts_fp),
+                       geo=True,
+                       rebuild=rebuild)
+
+
+# Every dataset the scripts share, in the order they are warmed
+dataset_loaders = {"park_location_cleaned": load_parks,
+                   "district_income": load_districts_extra,
+                   "istanbul_districts": load_districts}
+
+# %% --- Build the cache from the command line ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the binary cache of the input datasets.")
+    parser.add_argument("--rebuild", action="store_true", help="Parse every source again.")
+    arguments = parser.parse_args()
+
+    for dataset_name, loader in dataset_loaders.items():
+        start = time.perf_counter()
+        loaded = loader(rebuild=arguments.rebuild)
+        print("{:<24} {:>6} rows {:>9.1f} ms".format(dataset_name, len(loaded),
+                                                     (time.perf_counter() - start) * 1000))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module writes the debug images of the satellite analysis, the region
+(roi_<n>.png) and dominant color patch (dom_patch<n>.png) of every district,
+off the hot path of the analysis.
+
+The analysis used to run cv2.imwrite twice per contour inside the loop,
+118 files on every run, even when nobody looked at them. They are now
+written only when the "debug" section of satellite_config.json sets a level
+above 0, in one of three formats:
+
+    png:            the separate PNGs as before, encoded and written by a
+                    background thread fed through a bounded queue
+    contact_sheet:  one image with every artifact in a grid of cells
+    npz:            one compressed NumPy archive, one array per artifact
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+# %% --- Settings ---
+
+# Images waiting for the writer thread before submit blocks
+queue_size = 32
+
+# Size of a cell of the contact sheet, in pixels
+cell_size = 96
+
+
+# %% --- Helper functions and definitions ---
+
+class ArtifactWriter:
+    """Collect debug images and write them in the chosen format.
+
+    With the png format every image is handed to a background thread
+    through a bounded queue, so the producer only waits when the writer
+    falls queue_size images behind. The other formats keep the images
+    until close, where they are written at once. Use it as a context
+    manager, close waits for the last image to be written.
+    """
+
+    formats = ("png", "contact_sheet", "npz")
+
+    def __init__(self, directory, artifact_format="png", max_queued=queue_size):
+        if artifact_format not in self.formats:
+            raise ValueError("Unknown debug artifact format {!r}, expected one of {}."
+                             .format(artifact_format, ", ".join(self.formats)))
+
+        self.directory = directory
+        self.artifact_format = artifact_format
+        self.images = {}
+        self.errors = []
+
+        if artifact_format == "png":
+            self.queue = queue.Queue(maxsize=max_queued)
+            self.thread = threading.Thread(target=self._write_queued, name="debug-artifacts")
+            self.thread.start()
+
+    def _write_queued(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            name, image = item
+            if not cv2.imwrite(os.path.join(self.directory, name + ".png"), image):
+                self.errors.append(name)
+
+    def submit(self, name, image):
+        """Add an image, named without its extension."""
+
+        if self.artifact_format == "png":
+            self.queue.put((name, image))
+        else:
+            self.images[name] = image
+
+    def close(self):
+        """Write what is left and stop the writer thread."""
+
+        if self.artifact_format == "png":
+            self.queue.put(None)
+            self.thread.join()
+        elif self.artifact_format == "contact_sheet":
+            cv2.imwrite(os.path.join(self.directory, "contact_sheet.png"), contact_sheet(self.images))
+        else:
+            np.savez_compressed(os.path.join(self.directory, "artifacts.npz"), **self.images)
+
+        if self.errors:
+            raise OSError("Could not write {} debug artifacts to {}, such as {}."
+                          .format(len(self.errors), self.directory, self.errors[0]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def contact_sheet(images, size=cell_size):
+    """Tile images into one, each scaled to fit a square cell.
+
+    Arguments:
+        images (dict): BGR images by name, laid out in their order.
+        size (int): Side of a cell in pixels.
+
+    Returns:
+        numpy.ndarray: The BGR contact sheet, black where a cell isn't full.
+    """
+
+    names = list(images)
+    columns = max(int(np.ceil(np.sqrt(len(names)))), 1)
+    rows = max(int(np.ceil(len(names) / columns)), 1)
+    sheet = np.zeros((rows * size, columns * size, 3), dtype=np.uint8)
+
+    for position, name in enumerate(names):
+        image = images[name]
+        scale = size / max(image.shape[:2])
+        height, width = max(int(image.shape[0] * scale), 1), max(int(image.shape[1] * scale), 1)
+
+        row, column = divmod(position, columns)
+        sheet[row * size:row * size + height, column * size:column * size + width] = \
+            cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    return sheet
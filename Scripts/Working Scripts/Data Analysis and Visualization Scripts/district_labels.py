@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module places the district name labels of the map figures.
+
+Every map used to compute representative points for a hand-picked list of
+districts and to add one annotation per row with iterrows. Here the label
+anchors of all 39 districts are computed once with a vectorized
+point_on_surface and cached next to the other datasets, keyed on the
+district shapefile, so they are rebuilt only when the geometry changes.
+
+The labels of a map are added as one TextCollection with collision
+avoidance: the districts are ranked by area and a name is left out when it
+would overlap the name of a larger district. Which names fit is decided
+when the figure is drawn, for its final size, dpi and language, instead of
+by a fixed list of names.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import pandas as pd  # For general data processing tasks
+import shapely  # For the vectorized geometry operations
+
+import data_loader  # Shared, cached reader of the input datasets
+from text_collection import add_texts  # Many texts drawn as a single artist
+
+
+# %% --- Helper functions and definitions ---
+
+def load_label_anchors(rebuild=False):
+    """Return the label anchor of every district, largest district first.
+
+    Arguments:
+        rebuild (bool): Compute the anchors again even if the cache is valid.
+
+    Returns:
+        pandas.DataFrame: district_e, district_t, x, y and area columns.
+    """
+
+    def build():
+        districts = data_loader.load_districts()
+
+        # A point inside every polygon, unlike the centroid of a concave one
+        anchors = shapely.point_on_surface(districts.geometry.values)
+
+        return pd.DataFrame({"district_e": districts.loc[:, "district_e"].values,
+                             "district_t": districts.loc[:, "district_t"].values,
+                             "x": shapely.get_x(anchors),
+                             "y": shapely.get_y(anchors),
+                             "area": shapely.area(districts.geometry.values)})
+
+    anchors = data_loader.load_cached("istanbul_districts_label_anchors",
+                                      data_loader.shapefile_parts(data_loader.istanbul_districts_fp),
+                                      build,
+                                      rebuild=rebuild)
+
+    # Larger districts get their label first when names collide
+    return anchors.sort_values(by="area", ascending=False, kind="stable").reset_index(drop=True)
+
+
+# Helper function: Add the district names to a map
+def add_district_labels(ax, anchors=None, column="district_e", avoid_collisions=True, **kwargs):
+    """Label the districts of a map with one TextCollection.
+
+    Arguments:
+        ax (matplotlib.axes.Axes): The map axis, in the CRS of the shapefile.
+        anchors (pandas.DataFrame): The anchors, load_label_anchors if None.
+        column (str): The column holding the names to draw.
+        avoid_collisions (bool): Leave out the names of smaller districts
+            that would overlap the names of larger ones.
+        **kwargs: Passed to TextCollection (fontsize, offset, ...).
+
+    Returns:
+        text_collection.TextCollection: The labels, relabel them with
+        set_texts.
+    """
+
+    if anchors is None:
+        anchors = load_label_anchors()
+
+    return add_texts(ax,
+                     anchors.loc[:, "x"].values,
+                     anchors.loc[:, "y"].values,
+                     anchors.loc[:, column],
+                     avoid_collisions=avoid_collisions,
+                     **kwargs)
+
+
+# %% --- Build the anchors from the command line ---
+
+if __name__ == "__main__":
+    print(load_label_anchors(rebuild=True).to_string())
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module finds the dominant colors of a set of pixels, such as the region
+of a district cut out of the satellite image.
+
+The satellite analysis used cv2.kmeans with 10 attempts of up to 200
+iterations to find a single cluster. With one cluster the answer is exactly
+the mean of the pixels, so dominant_colors returns the mean directly. For
+more than one color it runs a vectorized mini-batch k-means in NumPy:
+k-means++ seeding on a sample, center updates from small random batches
+with per-center learning rates, and one final chunked assignment of every
+pixel, refined by a couple of full passes, to count the cluster sizes.
+
+Run this file directly to benchmark it against cv2.kmeans on the district
+pixels of the Istanbul mosaic, masked as the satellite analysis masks them:
+
+    python dominant_color.py [--colors 1 3] [--repeat 3]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+# %% --- Settings ---
+
+# Pixels per mini-batch and number of batches of the k > 1 path
+batch_size = 1024
+batch_count = 100
+
+# Full passes over all the pixels that polish the mini-batch centers
+refine_iterations = 2
+
+# Pixels assigned to the centers at once when counting the clusters
+assignment_chunk = 1 << 16
+
+
+# %% --- Helper functions and definitions ---
+
+# Helper function: Squared distances of every pixel to every center
+def squared_distances(pixels, centers):
+    return (np.einsum("ij,ij->i", pixels, pixels)[:, None]
+            - 2 * pixels @ centers.T
+            + np.einsum("ij,ij->i", centers, centers)[None, :])
+
+
+def nearest_centers(pixels, centers):
+    """Return the index of the nearest center of every pixel, in chunks."""
+
+    labels = np.empty(len(pixels), dtype=np.intp)
+
+    for start in range(0, len(pixels), assignment_chunk):
+        stop = start + assignment_chunk
+        labels[start:stop] = squared_distances(pixels[start:stop], centers).argmin(axis=1)
+
+    return labels
+
+
+def kmeans_plus_plus(pixels, n_colors, rng):
+    """Pick n_colors initial centers among the pixels with k-means++."""
+
+    centers = [pixels[rng.integers(len(pixels))]]
+    distances = squared_distances(pixels, np.array(centers)).ravel()
+
+    for _ in range(1, n_colors):
+        total = distances.sum()
+
+        # All the pixels already coincide with a center
+        if total <= 0:
+            centers.append(pixels[rng.integers(len(pixels))])
+            continue
+
+        centers.append(pixels[rng.choice(len(pixels), p=distances / total)])
+        distances = np.minimum(distances, squared_distances(pixels, centers[-1][None, :]).ravel())
+
+    return np.array(centers)
+
+
+def mini_batch_kmeans(pixels, n_colors, seed=0):
+    """Cluster the pixels into n_colors colors with mini-batch k-means.
+
+    Returns:
+        tuple of numpy.ndarray: (centers, labels).
+    """
+
+    rng = np.random.default_rng(seed)
+
+    sample = pixels[rng.choice(len(pixels), size=min(len(pixels), batch_size * 4), replace=False)]
+    centers = kmeans_plus_plus(sample, n_colors, rng)
+    seen = np.zeros(n_colors)
+
+    for _ in range(batch_count):
+        batch = pixels[rng.integers(len(pixels), size=min(len(pixels), batch_size))]
+        batch_labels = squared_distances(batch, centers).argmin(axis=1)
+
+        # Every center moves to the mean of its pixels so far, weighted by
+        # how many pixels it has already absorbed
+        counts = np.bincount(batch_labels, minlength=n_colors)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, batch_labels, batch)
+
+        updated = counts > 0
+        seen[updated] += counts[updated]
+        rates = counts[updated] / seen[updated]
+        centers[updated] += rates[:, None] * (sums[updated] / counts[updated][:, None] - centers[updated])
+
+    labels = nearest_centers(pixels, centers)
+
+    # Lloyd steps over every pixel, the channel sums come from bincount
+    for _ in range(refine_iterations):
+        counts = np.bincount(labels, minlength=n_colors)
+        updated = counts > 0
+        sums = np.stack([np.bincount(labels, weights=pixels[:, channel], minlength=n_colors)
+                         for channel in range(pixels.shape[1])], axis=1)
+        centers[updated] = sums[updated] / counts[updated][:, None]
+        labels = nearest_centers(pixels, centers)
+
+    return centers, labels
+
+
+def dominant_colors(pixels, n_colors=1, seed=0):
+    """Return the dominant colors of some pixels, most frequent first.
+
+    Arguments:
+        pixels (numpy.ndarray): N x 3 array of colors.
+        n_colors (int): Number of colors to find.
+        seed (int): Seed of the mini-batch sampling, for n_colors > 1.
+
+    Returns:
+        tuple of numpy.ndarray: (palette, counts), n_colors x 3 float32
+        colors and the number of pixels of each, by decreasing count.
+    """
+
+    pixels = np.asarray(pixels).reshape(-1, 3)
+
+    # One cluster: its center is exactly the mean of the pixels, computed
+    # without copying them to float
+    if n_colors == 1:
+        return pixels.mean(axis=0, dtype=np.float64)[None, :].astype(np.float32), np.array([len(pixels)])
+
+    pixels = pixels.astype(np.float32)
+    centers, labels = mini_batch_kmeans(pixels, n_colors, seed=seed)
+    counts = np.bincount(labels, minlength=n_colors)
+    order = np.argsort(counts, kind="stable")[::-1]
+
+    return centers[order].astype(np.float32), counts[order]
+
+
+# Helper function: The call the satellite analysis used to make
+def opencv_dominant_colors(pixels, n_colors=1):
+    """Return the dominant colors found by cv2.kmeans, most frequent first."""
+
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, .1)
+
+    _, labels, palette = cv2.kmeans(np.float32(pixels), n_colors, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    counts = np.bincount(labels.ravel(), minlength=n_colors)
+    order = np.argsort(counts, kind="stable")[::-1]
+
+    return palette[order], counts[order]
+
+
+# %% --- Benchmark ---
+
+# Helper function: Sum of squared distances of the pixels to their nearest color
+def inertia(pixels, palette):
+    pixels = np.float32(pixels)
+    return float(squared_distances(pixels, palette).min(axis=1).clip(0).sum())
+
+
+def benchmark(regions, n_colors, repeat=3):
+    """Time dominant_colors against cv2.kmeans on a list of pixel arrays.
+
+    Returns:
+        dict: Best total seconds of both, the ratio of their total inertia
+        (below 1 when dominant_colors fits the pixels better) and the
+        largest difference between the most dominant colors they found.
+    """
+
+    def best_run(function):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            palettes = [function(pixels, n_colors)[0] for pixels in regions]
+            times.append(time.perf_counter() - start)
+        return min(times), palettes
+
+    opencv_seconds, opencv_palettes = best_run(opencv_dominant_colors)
+    numpy_seconds, numpy_palettes = best_run(dominant_colors)
+
+    opencv_inertia = sum(inertia(pixels, palette) for pixels, palette in zip(regions, opencv_palettes))
+    numpy_inertia = sum(inertia(pixels, palette) for pixels, palette in zip(regions, numpy_palettes))
+
+    return {"opencv": opencv_seconds,
+            "numpy": numpy_seconds,
+            "inertia_ratio": numpy_inertia / opencv_inertia,
+            "max_difference": float(max(np.abs(expected[0] - found[0]).max()
+                                        for expected, found in zip(opencv_palettes, numpy_palettes)))}
+
+
+if __name__ == "__main__":
+    import data_loader  # Paths of the satellite image and the districts
+    import georeference  # District contours on the pixel grid of the image
+    import satellite_analysis  # Label image of the district contours
+
+    parser = argparse.ArgumentParser(description="Benchmark the dominant color engine against cv2.kmeans.")
+    parser.add_argument("--colors", type=int, nargs="+", default=[1, 3], help="Numbers of colors to find.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per timing, the best one is kept.")
+    arguments = parser.parse_args()
+
+    # The district pixels of the Istanbul mosaic, as the satellite analysis
+    # masks them: shapefile contours on the georeferenced image and only the
+    # pixels of its label inside every bounding box
+    mosaic = cv2.imread(data_loader.satellite_image_fp)
+    transform = georeference.load_geotransform(data_loader.satellite_image_fp)
+    contours, _ = georeference.district_contours(data_loader.load_districts(), transform)
+    contours, _ = satellite_analysis.select_contours(contours, 10)
+    labels = satellite_analysis.label_image(contours, mosaic.shape)
+
+    district_regions = []
+    for number, contour in enumerate(contours):
+        x, y, w, h = cv2.boundingRect(contour)
+        pixels = mosaic[y:y + h, x:x + w][labels[y:y + h, x:x + w] == number + 1]
+        if len(pixels):
+            district_regions.append(pixels)
+
+    print("{} regions, {} pixels".format(len(district_regions), sum(map(len, district_regions))))
+    print("{:>6} {:>12} {:>12} {:>8} {:>14} {:>15}".format("colors", "cv2.kmeans", "numpy", "speedup",
+                                                           "inertia ratio", "max difference"))
+
+    for colors in arguments.colors:
+        result = benchmark(district_regions, colors, repeat=arguments.repeat)
+        print("{:>6} {:>11.4f}s {:>11.4f}s {:>7.1f}x {:>14.3f} {:>15.3f}".format(colors, result["opencv"],
+                                                                             result["numpy"],
+                                                                             result["opencv"] / result["numpy"],
+                                                                             result["inertia_ratio"],
+                                                                             result["max_difference"]))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module writes the finished figures of the scripts to disk in parallel.
+
+Serializing a choropleth with the full district geometry to SVG at a high
+dpi is the slowest single step of the batch, and the SVG and PNG outputs of
+every figure used to be written one after another. Here a finished figure
+is pickled as it is at the time of submit (a snapshot, so a figure that is
+relabelled afterwards for another language isn't affected) and the
+snapshots are handed to a ProcessPoolExecutor that writes every requested
+format at the same time. Before writing, the district choropleths of the
+snapshot are switched to the level of detail of the output format (see
+geometry_lod), so PNGs get the lighter geometry and SVGs the finer one.
+
+Scripts submit their figures and call flush at their end. The batch driver
+holds the queue instead, so the outputs of all the scripts are written by
+one pool once every stage has run.
+
+The number of worker processes is the CPU count by default and can be set
+with the FIGURE_EXPORT_WORKERS environment variable or the workers
+argument of flush. It never exceeds the CPU count, nor the available memory
+divided by worker_memory, since every worker holds a whole figure and its
+high dpi SVG. Jobs whose worker died, for example killed when memory ran
+out, are written again one by one in this process.
+
+Only the worker processes switch to the Agg backend. Written in this
+process, a snapshot is saved without touching the backend or the other
+open figures of an interactive session.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import matplotlib
+
+import geometry_lod  # Level of detail of the district geometry per format
+
+# %% --- Export queue ---
+
+# Number of worker processes, None means one per CPU
+workers = int(os.environ["FIGURE_EXPORT_WORKERS"]) if os.environ.get("FIGURE_EXPORT_WORKERS") else None
+
+# Memory a worker needs for a full-size figure and its SVG, in bytes
+worker_memory = 2 * 2 ** 30
+
+# Export jobs waiting to be written: (figure snapshot, path, format, dpi)
+_pending_jobs = []
+
+# Whether flush should leave the queue to the batch driver
+_held = False
+
+
+# %% --- Helper functions and definitions ---
+
+# Helper function: Set up a worker process
+def init_worker():
+    """Switch a worker process to the Agg backend, workers only render to files."""
+
+    matplotlib.use("Agg")
+
+
+# Helper function: Write one output of a figure, in a worker or in this process
+def write_job(job):
+    """Unpickle a figure snapshot and save it in one format.
+
+    Arguments:
+        job (tuple): (figure snapshot, export path, file format, dpi).
+
+    Returns:
+        str: The path that was written.
+    """
+
+    import matplotlib.pyplot as plt
+
+    snapshot, export_path, file_format, dpi = job
+
+    fig = pickle.loads(snapshot)
+    geometry_lod.apply_level(fig, geometry_lod.level_for_format(file_format))
+    fig.savefig(export_path, format=file_format, dpi=dpi, bbox_inches="tight")
+
+    # Only the snapshot, the figures of the caller stay open
+    plt.close(fig)
+
+    return export_path
+
+
+def submit(fig, export_path_stem, formats):
+    """Queue the outputs of a figure as it is now.
+
+    Arguments:
+        fig (matplotlib.figure.Figure): The finished figure.
+        export_path_stem (str): The output path without its extension.
+        formats (list of (str, int)): The file formats and their dpi.
+
+    Returns:
+        list of str: The paths that will be written.
+    """
+
+    snapshot = pickle.dumps(fig)
+
+    export_paths = []
+
+    for file_format, dpi in formats:
+        export_path = export_path_stem + "." + file_format
+        _pending_jobs.append((snapshot, export_path, file_format, dpi))
+        export_paths.append(export_path)
+
+    return export_paths
+
+
+# Helper function: Memory available to new processes
+def available_memory():
+    """Return the available memory in bytes, None if it can't be read."""
+
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def worker_count(max_workers, n_jobs):
+    """Return the number of worker processes for a number of jobs.
+
+    Arguments:
+        max_workers (int): The requested number, one per CPU if None.
+        n_jobs (int): Number of jobs to write.
+    """
+
+    cpus = os.cpu_count() or 1
+    count = min(max_workers or cpus, cpus, n_jobs)
+
+    memory = available_memory()
+    if memory is not None:
+        count = min(count, max(int(memory // worker_memory), 1))
+
+    return count
+
+
+def write_jobs(jobs, max_workers=None):
+    """Write export jobs, in parallel when there's more than one.
+
+    Arguments:
+        jobs (list of tuple): The jobs, as queued by submit.
+        max_workers (int): Number of worker processes, one per CPU if None,
+            capped by the CPU count and the available memory.
+
+    Returns:
+        list of str: The written paths, in the order of the jobs.
+    """
+
+    max_workers = worker_count(max_workers, len(jobs))
+
+    if max_workers <= 1:
+        return [write_job(job) for job in jobs]
+
+    # Slowest jobs first: high dpi SVGs take far longer than PNGs
+    order = sorted(range(len(jobs)), key=lambda index: (jobs[index][2] != "svg", -jobs[index][3]))
+
+    export_paths = [None] * len(jobs)
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+        futures = [(index, executor.submit(write_job, jobs[index])) for index in order]
+
+        # Every job is collected on its own, a dead worker only loses its jobs
+        for index, future in futures:
+            try:
+                export_paths[index] = future.result()
+            except BrokenProcessPool:
+                failed.append(index)
+
+    # Write again in this process what the broken pool couldn't
+    for index in failed:
+        export_paths[index] = write_job(jobs[index])
+
+    return export_paths
+
+
+def flush(max_workers=None):
+    """Write every queued output, unless the batch driver holds the queue.
+
+    Arguments:
+        max_workers (int): Number of worker processes, the module setting if None.
+
+    Returns:
+        list of str: The paths that were written.
+    """
+
+    if _held:
+        return []
+
+    jobs = list(_pending_jobs)
+    del _pending_jobs[:]
+
+    if not jobs:
+        return []
+
+    return write_jobs(jobs, max_workers or workers)
+
+
+def hold():
+    """Keep the queued outputs until release, for a batch of scripts."""
+
+    global _held
+    _held = True
+
+
+def release(max_workers=None):
+    """Stop holding the queue and write everything that was queued."""
+
+    global _held
+    _held = False
+
+    return flush(max_workers)
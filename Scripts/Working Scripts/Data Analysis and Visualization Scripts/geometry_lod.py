@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module builds simplified levels of detail of istanbul_districts.shp and
+picks the level each output needs.
+
+The processed shapefile holds ~78k vertices for 39 districts. At figure
+scale most of them are sub-pixel, yet all of them are drawn and serialized
+into every SVG. Here the district boundaries are simplified at a few
+tolerances while keeping their topology: the boundaries are split into the
+arcs between district junctions, every arc is simplified once, and the
+districts are rebuilt from the simplified arcs. Neighbouring districts
+therefore keep sharing the very same edge, no gaps or overlaps appear
+between them.
+
+The levels are cached as Feather files next to the processed shapefile and
+are rebuilt when the shapefile or a tolerance changes:
+
+    screen: PNG outputs
+    print:  SVG and other vector outputs
+    kepler: the Kepler.gl HTML map
+
+plot_districts draws a choropleth like GeoDataFrame.plot and remembers the
+paths of every level, figure_export then swaps in the level matching the
+format of each output before it is written.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import os
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+import shapely  # For the vectorized geometry operations
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+
+import data_loader  # Shared, cached reader of the input datasets
+
+# %% --- Levels of detail ---
+
+# Simplification tolerance of every level, in the units of the shapefile's
+# CRS (degrees). 0.0002° is about 17 m, less than a pixel of the 300 dpi PNGs.
+lod_tolerances = {"print": 0.00005,
+                  "screen": 0.0002,
+                  "kepler": 0.0001}
+
+# The level used for every output format
+format_levels = {"svg": "print",
+                 "pdf": "print",
+                 "eps": "print",
+                 "png": "screen",
+                 "jpg": "screen",
+                 "html": "kepler"}
+
+# The levels are cached next to the processed shapefile
+lod_directory = os.path.dirname(data_loader.istanbul_districts_fp)
+
+
+# %% --- Helper functions and definitions ---
+
+def level_for_format(file_format):
+    """Return the level of detail for an output format, print if unknown."""
+
+    return format_levels.get(file_format.lower(), "print")
+
+
+def simplify_coverage(geometries, tolerance):
+    """Simplify polygons that tile an area without breaking their shared edges.
+
+    Arguments:
+        geometries (numpy.ndarray of shapely geometries): Polygons or
+            MultiPolygons that share their boundaries.
+        tolerance (float): The simplification tolerance.
+
+    Returns:
+        numpy.ndarray: The simplified geometries, in the input order.
+    """
+
+    # Node the boundaries, then merge them into the arcs between junctions
+    linework = shapely.union_all(shapely.boundary(geometries))
+    arcs = shapely.get_parts(shapely.line_merge(linework))
+
+    # An arc keeps its end points, so the junctions stay where they were
+    simplified_arcs = shapely.simplify(arcs, tolerance, preserve_topology=True)
+
+    # Rebuild the faces enclosed by the simplified arcs
+    faces = shapely.get_parts(shapely.polygonize(simplified_arcs))
+
+    # A face belongs to the district its interior point falls in
+    tree = shapely.STRtree(geometries)
+    face_index, owner_index = tree.query(shapely.point_on_surface(faces), predicate="within")
+    owners = np.full(len(faces), -1)
+    owners[face_index] = owner_index
+
+    simplified = np.array([shapely.union_all(faces[owners == index]) for index in range(len(geometries))],
+                          dtype=object)
+
+    empty = np.flatnonzero(shapely.is_empty(simplified))
+    if len(empty):
+        raise ValueError("Simplifying at {} left {} geometries empty, first one at position {}."
+                         .format(tolerance, len(empty), empty[0]))
+
+    return simplified
+
+
+def load_lod(level, rebuild=False):
+    """Return the districts at a level of detail as a GeoDataFrame.
+
+    Arguments:
+        level (str): One of lod_tolerances.
+        rebuild (bool): Simplify again even if the cache is valid.
+    """
+
+    tolerance = lod_tolerances[level]
+
+    def build():
+        districts = data_loader.load_districts()
+        districts["geometry"] = simplify_coverage(districts.geometry.values, tolerance)
+        return districts
+
+    return data_loader.load_cached("istanbul_districts_lod_" + level,
+                                   data_loader.shapefile_parts(data_loader.istanbul_districts_fp),
+                                   build,
+                                   geo=True,
+                                   rebuild=rebuild,
+                                   directory=lod_directory,
+                                   parameters={"tolerance": tolerance})
+
+
+def lod_geometries(districts, level):
+    """Return the geometries of a level, aligned to the rows of a frame.
+
+    Arguments:
+        districts (geopandas.GeoDataFrame): Districts with a district_e
+            column, for example the shapefile merged with some statistics.
+        level (str): One of lod_tolerances.
+    """
+
+    simplified = load_lod(level).set_index("district_e").geometry
+
+    return simplified.reindex(districts.loc[:, "district_e"]).values
+
+
+# Helper function: Matplotlib paths of the polygons of a level
+def polygon_paths(geometries, values):
+    """Return one path per polygon part and its value, like geopandas does.
+
+    Arguments:
+        geometries (array of shapely geometries): Polygons or MultiPolygons.
+        values (array): The value of every geometry.
+    """
+
+    parts, part_index = shapely.get_parts(geometries, return_index=True)
+
+    paths = [Path.make_compound_path(Path(np.asarray(part.exterior.coords)[:, :2]),
+                                     *[Path(np.asarray(ring.coords)[:, :2]) for ring in part.interiors])
+             for part in parts]
+
+    return paths, np.take(np.asarray(values), part_index, axis=0)
+
+
+# %% --- Plotting ---
+
+def plot_districts(districts, ax, column, level="print", **kwargs):
+    """Draw a choropleth of the districts that can switch its level of detail.
+
+    Arguments:
+        districts (geopandas.GeoDataFrame): Districts with a district_e column.
+        ax (matplotlib.axes.Axes): The map axis.
+        column (str): The column that is mapped to colors.
+        level (str): The level drawn until an export asks for another one.
+        **kwargs: Passed to GeoDataFrame.plot (edgecolor, alpha, cmap, ...).
+
+    Returns:
+        matplotlib.collections.PatchCollection: The choropleth.
+    """
+
+    # Like GeoDataFrame.plot, districts without a value aren't drawn
+    values = districts.loc[:, column].values
+    plotted = ~pd.isna(values)
+
+    levels = {name: polygon_paths(lod_geometries(districts, name)[plotted], values[plotted])
+              for name in lod_tolerances}
+
+    districts.set_geometry(lod_geometries(districts, level)).plot(ax=ax, column=column, **kwargs)
+
+    collection = ax.collections[-1]
+
+    # Kept on the collection so that it survives pickling for figure_export
+    collection.lod_levels = levels
+
+    return collection
+
+
+def apply_level(fig, level):
+    """Switch every level-aware choropleth of a figure to a level of detail."""
+
+    for ax in fig.axes:
+        for collection in ax.collections:
+            if level in getattr(collection, "lod_levels", {}):
+                paths, values = collection.lod_levels[level]
+                collection.set_paths([PathPatch(path) for path in paths])
+                collection.set_array(values)
+
+
+# %% --- Build the levels from the command line ---
+
+if __name__ == "__main__":
+    for level_name in lod_tolerances:
+        level_districts = load_lod(level_name, rebuild=True)
+        print("{:<8} {:>8} vertices".format(level_name,
+                                            shapely.get_num_coordinates(level_districts.geometry.values).sum()))
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module places the district polygons of istanbul_districts.shp on the
+pixel grid of the satellite image, so the satellite analysis can use the
+districts themselves instead of outlines edge-detected from a JPEG of the
+district map.
+
+The position of the image on the earth is an affine geotransform stored
+next to it as a world file (satellite-map-of-istanbul.jgw), which GDAL and
+therefore rasterio read on their own. The satellite image came without one,
+so it was estimated once by fitting: the outline of the province is moved
+and scaled (x and y scale, x and y offset) until it lies on the coastlines
+and white border lines of the image, measured with the distance transform
+of those features (chamfer matching). A coarse grid over the scales and
+offsets finds the neighbourhood of the fit, Nelder-Mead refines it. Run
+this file directly to fit and write the world file again:
+
+    python georeference.py [--image path/to/satellite.jpg]
+
+district_contours turns every polygon of the shapefile into an OpenCV
+contour on the image grid, tagged with the district_e of its district. A
+district made of several polygons, such as the islands of Adalar, gets one
+contour per polygon. Holes of the polygons are not drawn, the districts
+have none.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import itertools
+import os
+import warnings
+
+import cv2
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.errors import NotGeoreferencedWarning
+from scipy import ndimage, optimize
+
+import data_loader  # Shared, cached reader of the input datasets
+
+# %% --- Settings ---
+
+# The satellite image of the analysis
+satellite_image_fp = data_loader.satellite_image_fp
+
+# Distance in pixels beyond which an outline point counts as unmatched
+max_match_distance = 15
+
+# Spacing of the outline points of the fit, in degrees
+outline_spacing = 0.005
+
+# Scales (pixels per degree) and offsets (pixels) searched by the coarse grid
+# of the fit, and the number of its best cells refined
+scale_range = (300, 700)
+grid_steps = 9
+offset_step = 20
+refined_starts = 4
+
+# Coordinates the offsets of the fit are measured from
+reference_point = (28.0, 41.5)
+
+
+# %% --- World files ---
+
+def world_file_path(image_path):
+    """Return the world file of an image, .jgw for .jpg, .tfw for .tif..."""
+
+    root, extension = os.path.splitext(image_path)
+
+    return root + "." + extension[1] + extension[-1] + "w"
+
+
+def write_world_file(image_path, transform):
+    """Write the world file of an image.
+
+    Arguments:
+        image_path (str): The image.
+        transform (affine.Affine): From the corner of pixel (0, 0), like
+            rasterio's transforms. World files hold the center of that pixel.
+    """
+
+    center = transform * (0.5, 0.5)
+
+    with open(world_file_path(image_path), "w") as world_file:
+        world_file.write("\n".join("{:.12f}".format(value) for value in (transform.a, transform.d,
+                                                                         transform.b, transform.e,
+                                                                         center[0], center[1])) + "\n")
+
+
+def load_geotransform(image_path=satellite_image_fp):
+    """Return the geotransform of an image, read by rasterio from its world file.
+
+    Raises:
+        ValueError: If the image has no world file.
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+
+        with rasterio.open(image_path) as dataset:
+            transform = dataset.transform
+
+    if transform.is_identity:
+        raise ValueError("{} has no world file, run georeference.py to fit one.".format(image_path))
+
+    return transform
+
+
+# %% --- Fitting the geotransform ---
+
+def image_features(image):
+    """Return a mask of the coastlines and white border lines of a BGR map image."""
+
+    hue = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)[..., 0]
+
+    # The sea is blue-green, holes and specks smaller than the kernel are closed
+    kernel = np.ones((5, 5), np.uint8)
+    sea = ((hue >= 75) & (hue <= 110)).astype(np.uint8)
+    sea = cv2.morphologyEx(cv2.morphologyEx(sea, cv2.MORPH_OPEN, kernel), cv2.MORPH_CLOSE, kernel)
+
+    coast = cv2.morphologyEx(sea, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8)) > 0
+    white = image.min(axis=-1) > 200
+
+    return coast | white
+
+
+def fit_geotransform(image, districts):
+    """Estimate the geotransform that lays the districts onto a map image.
+
+    Arguments:
+        image (numpy.ndarray): The BGR map image.
+        districts (geopandas.GeoDataFrame): The districts, in the coordinates
+            of the geotransform.
+
+    Returns:
+        tuple: (affine.Affine, float), the transform from the corner of pixel
+        (0, 0) and the mean distance in pixels from the province outline to
+        the nearest image feature.
+    """
+
+    distances = ndimage.distance_transform_edt(~image_features(image))
+
+    outline = shapely.union_all(districts.geometry.values).boundary
+    points = shapely.get_coordinates(shapely.segmentize(outline, outline_spacing)) - reference_point
+
+    # Mean distance of the outline points for x scale, y scale, x offset, y offset
+    def mean_distance(parameters, outline_points=points):
+        x_scale, y_scale, x_offset, y_offset = parameters
+        columns = np.clip(outline_points[:, 0] * x_scale + x_offset, 0, image.shape[1] - 1)
+        rows = np.clip(-outline_points[:, 1] * y_scale + y_offset, 0, image.shape[0] - 1)
+        matched = ndimage.map_coordinates(distances, [rows, columns], order=1)
+        return np.minimum(matched, max_match_distance).mean()
+
+    # Coarse grid over every scale and offset with a tenth of the points...
+    grid = itertools.product(np.linspace(*scale_range, grid_steps), np.linspace(*scale_range, grid_steps),
+                             np.arange(-image.shape[1] / 2, image.shape[1], offset_step),
+                             np.arange(-image.shape[0] / 2, image.shape[0], offset_step))
+    coarse = sorted(grid, key=lambda parameters: mean_distance(parameters, points[::10]))
+
+    # ...then Nelder-Mead from the best cells
+    fits = [optimize.minimize(mean_distance, start, method="Nelder-Mead",
+                              options={"xatol": 0.01, "fatol": 1e-4, "maxiter": 4000})
+            for start in coarse[:refined_starts]]
+    best = min(fits, key=lambda fit: fit.fun)
+
+    x_scale, y_scale, x_offset, y_offset = best.x
+
+    # Pixel center (column, row) = ((x - x0) * x_scale + x_offset, -(y - y0) * y_scale + y_offset)
+    transform = (Affine.translation(*reference_point)
+                 * Affine.scale(1 / x_scale, -1 / y_scale)
+                 * Affine.translation(-x_offset - 0.5, -y_offset - 0.5))
+
+    return transform, float(best.fun)
+
+
+# %% --- District contours ---
+
+def district_contours(districts, transform, column="district_e"):
+    """Return the contours of the districts on the pixel grid of an image.
+
+    Arguments:
+        districts (geopandas.GeoDataFrame): The districts.
+        transform (affine.Affine): The geotransform of the image.
+        column (str): The column naming the districts.
+
+    Returns:
+        tuple: (contours, names), an int32 OpenCV contour for every polygon
+        of every district and the district of each.
+    """
+
+    # From world coordinates to pixel centers
+    inverse = ~transform
+    contours, names = [], []
+
+    for name, geometry in zip(districts[column], districts.geometry):
+        for polygon in shapely.get_parts(geometry):
+            x, y = shapely.get_coordinates(polygon.exterior).T
+            columns, rows = inverse * (x, y)
+            contours.append(np.stack([columns - 0.5, rows - 0.5], axis=-1).round().astype(np.int32)[:, None, :])
+            names.append(name)
+
+    return contours, names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the geotransform of the satellite image to the districts.")
+    parser.add_argument("--image", default=satellite_image_fp, help="The map image to georeference.")
+    arguments = parser.parse_args()
+
+    fitted, residual = fit_geotransform(cv2.imread(arguments.image), data_loader.load_districts())
+    write_world_file(arguments.image, fitted)
+
+    print("Wrote {}, outline {:.2f} pixels from the image features on average."
+          .format(world_file_path(arguments.image), residual))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module turns the gray average of a color into the 0-9 green rate of
+the satellite analysis, darker meaning greener.
+
+The classification used to be a ten-branch if/elif chain run for every
+contour. Here it is a set of bin edges and the rate of every bin, read from
+the "green_rate" section of satellite_config.json, so other classifications
+can be tried without touching the analysis:
+
+    "green_rate": {"edges": [0, 25, ..., 225, 256],
+                   "rates": [9, 8, ..., 1, 0]}
+
+A value v falls in bin i when edges[i] <= v < edges[i + 1], values outside
+of the edges get the rate -1. classify works on whole arrays at once, such
+as the gray averages of every district, and green_rate_map classifies every
+pixel of an image through a 256-entry lookup table.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import numpy as np
+from matplotlib import colormaps
+
+import satellite_config  # Settings of the satellite analysis
+
+# %% --- Settings ---
+
+# Rate of the values outside of every bin
+unclassified = -1
+
+
+# %% --- Helper functions and definitions ---
+
+def load_classification(path=None):
+    """Return the bin edges and rates of the green rate classification.
+
+    Arguments:
+        path (str): The configuration file, satellite_config.json if None.
+
+    Returns:
+        tuple of numpy.ndarray: (edges, rates), len(edges) == len(rates) + 1.
+    """
+
+    classification = satellite_config.load_config("green_rate", path)
+
+    edges = np.asarray(classification["edges"], dtype=float)
+    rates = np.asarray(classification["rates"], dtype=int)
+
+    if len(edges) != len(rates) + 1 or np.any(np.diff(edges) <= 0):
+        raise ValueError("The green rate needs increasing edges and one rate per bin, got {} edges and {} rates."
+                         .format(len(edges), len(rates)))
+
+    return edges, rates
+
+
+def classify(values, edges=None, rates=None):
+    """Return the green rate of every value of an array.
+
+    Arguments:
+        values (array-like): Gray averages, of any shape.
+        edges, rates (numpy.ndarray): The classification,
+            load_classification() if None.
+
+    Returns:
+        numpy.ndarray: The rates, unclassified for values outside the edges
+        or NaN.
+    """
+
+    if edges is None or rates is None:
+        edges, rates = load_classification()
+
+    # Bin 0 and len(edges) are below and above the edges
+    bins = np.digitize(values, edges)
+    padded_rates = np.concatenate([[unclassified], rates, [unclassified]])
+
+    return padded_rates[bins]
+
+
+def lookup_table(edges=None, rates=None):
+    """Return the green rate of every 8-bit gray value as a 256-entry table."""
+
+    return classify(np.arange(256), edges, rates).astype(np.int8)
+
+
+def green_rate_map(image, edges=None, rates=None):
+    """Return the green rate of every pixel of a BGR image.
+
+    The gray value of a pixel is the average of its three channels, like the
+    gray average of a district's dominant color.
+    """
+
+    gray = (image.sum(axis=-1, dtype=np.uint16) // 3).astype(np.uint8)
+
+    return lookup_table(edges, rates)[gray]
+
+
+def colorize(rate_map, cmap="BuGn", max_rate=9):
+    """Return a BGR image of a green rate map, unclassified pixels in black."""
+
+    colors = (colormaps[cmap](np.linspace(0, 1, max_rate + 1))[:, [2, 1, 0]] * 255).astype(np.uint8)
+    colors = np.vstack([colors, np.zeros((1, 3), dtype=np.uint8)])
+
+    # Unclassified (-1) indexes the last, black row
+    return colors[np.where(rate_map < 0, max_rate + 1, np.clip(rate_map, 0, max_rate))]
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module bins the parks and green areas into a grid of hexagons or
+squares in meters, at several resolutions, for city-wide density maps that
+stay readable and quick to draw however many points there are.
+
+The coordinates are projected to the metric CRS of park_access (UTM zone
+35N) and every point is given its cell at once with array arithmetic:
+
+    square  (column, row) of the squares of side size
+    hex     axial (q, r) of pointy-top hexagons whose corners are size
+            meters from their center, found by cube rounding
+
+The counts of the occupied cells are cached by data_loader like the other
+datasets, one table per shape and resolution, keyed on the CSV. A density
+layer is drawn with one artist whatever the number of points: a
+PolyCollection of the occupied cells, with their corners brought to the
+CRS of the axis, or an imshow of the square grid on an axis in meters.
+
+Run this file directly to time the binning and the drawing of random points
+around the parks:
+
+    python grid_binning.py [--points 1000000] [--output density.png]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+from matplotlib.collections import PolyCollection
+from pyproj import Transformer  # For the cell corners in the CRS of the axis
+
+import data_loader  # Shared, cached reader of the input datasets
+import park_access  # Metric CRS of the grid
+
+# %% --- Settings ---
+
+# Cell shapes and the resolutions the parks are binned at, in meters
+cell_shapes = ("hex", "square")
+resolutions = (250, 500, 1000, 2000)
+
+# Hexagon size of the density map of the yayilim report, in meters
+map_resolution = 1000
+
+# Corners of a pointy-top hexagon of size 1, around its center
+hex_corners = np.column_stack([np.cos(np.radians(30 + 60 * np.arange(6))),
+                               np.sin(np.radians(30 + 60 * np.arange(6)))])
+
+# Corners of a square cell of side 1, from its lower left corner
+square_corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=float)
+
+
+# %% --- Binning ---
+
+def square_cells(x, y, size):
+    """Return the (column, row) of the squares of side size holding the points."""
+
+    return np.floor(np.asarray(x) / size).astype(np.int64), np.floor(np.asarray(y) / size).astype(np.int64)
+
+
+def hex_cells(x, y, size):
+    """Return the axial (q, r) of the pointy-top hexagons holding the points.
+
+    Arguments:
+        x, y (array-like): The points, in meters.
+        size (float): Distance from the center of a hexagon to its corners.
+    """
+
+    x, y = np.asarray(x) / size, np.asarray(y) / size
+
+    # Fractional cube coordinates, rounded to the nearest hexagon
+    q = np.sqrt(3) / 3 * x - y / 3
+    r = 2 / 3 * y
+    s = -q - r
+
+    rounded_q, rounded_r, rounded_s = np.round(q), np.round(r), np.round(s)
+    q_error, r_error, s_error = np.abs(rounded_q - q), np.abs(rounded_r - r), np.abs(rounded_s - s)
+
+    # The coordinate that moved the most is the one that breaks q + r + s = 0
+    fix_q = (q_error > r_error) & (q_error > s_error)
+    fix_r = ~fix_q & (r_error > s_error)
+    rounded_q[fix_q] = -rounded_r[fix_q] - rounded_s[fix_q]
+    rounded_r[fix_r] = -rounded_q[fix_r] - rounded_s[fix_r]
+
+    return rounded_q.astype(np.int64), rounded_r.astype(np.int64)
+
+
+def cell_centers(first, second, size, shape="hex"):
+    """Return the centers in meters of cells, the (q, r) or (column, row) of cell_counts."""
+
+    first, second = np.asarray(first, dtype=float), np.asarray(second, dtype=float)
+
+    if shape == "hex":
+        return size * np.sqrt(3) * (first + second / 2), size * 1.5 * second
+
+    return (first + 0.5) * size, (second + 0.5) * size
+
+
+def cell_counts(x, y, size, shape="hex"):
+    """Return the number of points of every occupied cell.
+
+    Arguments:
+        x, y (array-like): The points, in meters.
+        size (float): Resolution of the grid, see square_cells and hex_cells.
+        shape (str): "hex" or "square".
+
+    Returns:
+        pandas.DataFrame: The two cell coordinates, q and r or column and
+        row, and count, sorted by cell.
+    """
+
+    if shape not in cell_shapes:
+        raise ValueError("Unknown cell shape {!r}, expected one of {}.".format(shape, ", ".join(cell_shapes)))
+
+    first, second = hex_cells(x, y, size) if shape == "hex" else square_cells(x, y, size)
+    names = ("q", "r") if shape == "hex" else ("column", "row")
+
+    if len(first) == 0:
+        return pd.DataFrame({names[0]: [], names[1]: [], "count": []}, dtype=np.int64)
+
+    # One int64 key per cell, counted by a single unique
+    first_min, second_min = first.min(), second.min()
+    span = second.max() - second_min + 1
+    keys, counts = np.unique((first - first_min) * span + (second - second_min), return_counts=True)
+
+    return pd.DataFrame({names[0]: keys // span + first_min, names[1]: keys % span + second_min, "count": counts})
+
+
+def load_park_cells(size, shape="hex", rebuild=False):
+    """Return the cell_counts of the parks and green areas, from the cache if it's fresh."""
+
+    def count_parks():
+        parks = data_loader.load_parks()
+        x, y = park_access.metric_coordinates(parks["longitude"], parks["latitude"]).T
+        return cell_counts(x, y, size, shape)
+
+    return data_loader.load_cached("park_cells_{}_{}".format(shape, size),
+                                   [data_loader.parks_fp],
+                                   count_parks,
+                                   rebuild=rebuild,
+                                   parameters={"shape": shape, "size": size, "crs": park_access.metric_crs})
+
+
+# %% --- Drawing ---
+
+def cell_polygons(cells, size, shape="hex", crs="EPSG:4326"):
+    """Return the corners of the cells in the CRS of an axis.
+
+    Arguments:
+        cells (pandas.DataFrame): As returned by cell_counts.
+        size (float): The resolution of the cells.
+        shape (str): "hex" or "square".
+        crs (str): The CRS of the axis.
+
+    Returns:
+        numpy.ndarray: (n, 6, 2) for hexagons and (n, 4, 2) for squares.
+    """
+
+    first, second = cells.iloc[:, 0].to_numpy(), cells.iloc[:, 1].to_numpy()
+
+    if shape == "hex":
+        x, y = cell_centers(first, second, size, shape)
+        corners = np.stack([x, y], axis=-1)[:, None, :] + size * hex_corners
+    else:
+        corners = (np.stack([first, second], axis=-1)[:, None, :] + square_corners) * size
+
+    if crs != park_access.metric_crs:
+        to_axis = Transformer.from_crs(park_access.metric_crs, crs, always_xy=True)
+        corners = np.stack(to_axis.transform(corners[..., 0], corners[..., 1]), axis=-1)
+
+    return corners
+
+
+def add_density_layer(ax, cells, size, shape="hex", crs="EPSG:4326", cmap="YlGn", zorder=2, **kwargs):
+    """Draw the counts of the cells on an axis as one artist.
+
+    On an axis in the metric CRS the squares are drawn with imshow, every
+    other layer is a PolyCollection of the occupied cells. Extra keyword
+    arguments go to the artist.
+
+    Returns:
+        The PolyCollection or AxesImage, for a colorbar.
+    """
+
+    if shape == "square" and crs == park_access.metric_crs:
+        columns, rows = cells["column"].to_numpy(), cells["row"].to_numpy()
+        grid = np.full((rows.max() - rows.min() + 1, columns.max() - columns.min() + 1), np.nan)
+        grid[rows - rows.min(), columns - columns.min()] = cells["count"].to_numpy()
+
+        extent = (columns.min() * size, (columns.max() + 1) * size, rows.min() * size, (rows.max() + 1) * size)
+        return ax.imshow(grid, extent=extent, origin="lower", cmap=cmap, zorder=zorder, interpolation="nearest",
+                         **kwargs)
+
+    collection = PolyCollection(cell_polygons(cells, size, shape, crs), array=cells["count"].to_numpy(),
+                                cmap=cmap, zorder=zorder, **kwargs)
+    ax.add_collection(collection)
+    ax.autoscale_view()
+
+    return collection
+
+
+# %% --- Benchmark ---
+
+if __name__ == "__main__":
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    parser = argparse.ArgumentParser(description="Time the binning and drawing of random points around the parks.")
+    parser.add_argument("--points", type=int, default=1000000, help="Number of random points.")
+    parser.add_argument("--output", help="Write the hexagon density maps of every resolution to this image.")
+    arguments = parser.parse_args()
+
+    park_locations = data_loader.load_parks().loc[:, ["longitude", "latitude"]].to_numpy()
+    generator = np.random.default_rng(0)
+    sampled = park_locations[generator.integers(len(park_locations), size=arguments.points)]
+    sampled = sampled + generator.normal(scale=0.01, size=sampled.shape)
+    sampled_x, sampled_y = park_access.metric_coordinates(sampled[:, 0], sampled[:, 1]).T
+
+    # Time of drawing an artist on its own figure
+    def draw_seconds(draw):
+        figure, axis = plt.subplots(figsize=(6, 5))
+        draw(axis)
+        started = time.perf_counter()
+        figure.canvas.draw()
+        plt.close(figure)
+        return time.perf_counter() - started
+
+    print("{:>7} {:>6} {:>8} {:>10} {:>10}".format("shape", "size", "cells", "binning", "drawing"))
+
+    for cell_shape in cell_shapes:
+        for resolution in resolutions:
+            start = time.perf_counter()
+            counted = cell_counts(sampled_x, sampled_y, resolution, cell_shape)
+            binned = time.perf_counter() - start
+
+            drawn = draw_seconds(lambda axis: add_density_layer(axis, counted, resolution, cell_shape))
+            print("{:>7} {:>6} {:>8} {:>9.3f}s {:>9.3f}s".format(cell_shape, resolution, len(counted), binned, drawn))
+
+    print("{:>7} {:>6} {:>8} {:>10} {:>9.3f}s".format("points", "", arguments.points, "",
+                                                      draw_seconds(lambda axis: axis.scatter(sampled[:, 0],
+                                                                                             sampled[:, 1], s=1))))
+
+    if arguments.output:
+        fig, axes = plt.subplots(1, len(resolutions), figsize=(6 * len(resolutions), 5))
+        for resolution, ax in zip(resolutions, axes):
+            add_density_layer(ax, cell_counts(sampled_x, sampled_y, resolution), resolution)
+            ax.set_title("{} m hexagons".format(resolution))
+        fig.savefig(arguments.output, dpi=100)
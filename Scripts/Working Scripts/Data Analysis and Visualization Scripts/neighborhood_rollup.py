@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module counts the parks and green areas once per neighborhood (mahalle)
+and rolls the district and city totals up from those counts, instead of
+counting the raw rows again for every chart.
+
+The neighborhoods of the CSV are named by neighborhood_tr, and the same name
+occurs in several districts, so a neighborhood is the pair of its district
+and its name. The district is the one the coordinates of the park fall in
+(see spatial_join), the same one the district charts count by.
+
+The counts of every neighborhood and kind of park (institution_type_tr:
+Park, Koru, ...) are cached by data_loader as one table, with the districts
+and neighborhoods stored as categoricals. NeighborhoodCounts keeps them as
+one integer array, one row per neighborhood, sorted by district, so that:
+
+    district_counts   is one difference of the cumulative sum of the rows at
+                      the first row of every district
+    city_counts       is the sum of the district counts
+    drill_down        is a slice of the rows of one district
+
+The neighborhoods have no areas in the data, their density is their share
+of the parks of their district. The districts have their share of the city
+and their parks per square kilometer.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+
+import data_loader  # Shared, cached reader of the input datasets
+import park_access  # Metric CRS of the areas
+import spatial_join  # Parks assigned to districts by their coordinates
+
+# %% --- Settings ---
+
+# Column of the parks that names their kind, every kind gets a count
+kind_column = "institution_type_tr"
+
+
+# %% --- Helper functions and definitions ---
+
+def neighborhood_table(parks, districts, kind=kind_column):
+    """Return the number of parks of every neighborhood and kind.
+
+    Arguments:
+        parks (pandas.DataFrame): As returned by
+            spatial_join.load_park_districts.
+        districts (geopandas.GeoDataFrame): The districts, every one of them
+            is a category even without parks.
+        kind (str): The column naming the kind of every park.
+
+    Returns:
+        pandas.DataFrame: district_e and neighborhood categoricals, sorted,
+        and one count column per kind.
+    """
+
+    parks = parks.dropna(subset=["geo_district_e"])
+
+    # Only the neighborhoods that have parks, sorted by district and name
+    table = pd.crosstab([parks["geo_district_e"].to_numpy(), parks["neighborhood_tr"].to_numpy()],
+                        parks[kind].to_numpy(), rownames=["district_e", "neighborhood"], colnames=[None])
+    table = table.sort_index().reset_index()
+
+    return table.astype({"district_e": pd.CategoricalDtype(sorted(districts["district_e"])),
+                         "neighborhood": "category"})
+
+
+class NeighborhoodCounts:
+    """Park counts of the neighborhoods, rolled up to the districts and the city.
+
+    Arguments:
+        table (pandas.DataFrame): As returned by neighborhood_table.
+        district_areas (pandas.Series): Area of every district in km2, by
+            district_e, for the parks_per_km2 of the districts.
+    """
+
+    def __init__(self, table, district_areas=None):
+        self.districts = table["district_e"].cat.categories
+        self.kinds = pd.Index([column for column in table.columns if column not in ("district_e", "neighborhood")])
+
+        self.district_codes = table["district_e"].cat.codes.to_numpy()
+        self.neighborhoods = table["neighborhood"].to_numpy()
+        self.counts = table[self.kinds].to_numpy(dtype=np.int64)
+        self.district_areas = district_areas
+
+        # The rows of district i are starts[i]:starts[i + 1], districts without
+        # a neighborhood have an empty range
+        self.starts = np.searchsorted(self.district_codes, np.arange(len(self.districts) + 1))
+
+        self._district_counts = None
+
+    def district_counts(self):
+        """Return the counts of every district and kind, summed from the neighborhoods."""
+
+        if self._district_counts is None:
+            # Sum of rows a:b is cumulative[b] - cumulative[a], 0 for the empty ranges
+            cumulative = np.vstack([np.zeros((1, len(self.kinds)), np.int64), self.counts.cumsum(axis=0)])
+            self._district_counts = cumulative[self.starts[1:]] - cumulative[self.starts[:-1]]
+
+        return self._district_counts
+
+    def city_counts(self):
+        """Return the counts of every kind in the whole city."""
+
+        return self.district_counts().sum(axis=0)
+
+    def district_frame(self, kinds=None):
+        """Return the districts with a count column per kind, total and densities.
+
+        Arguments:
+            kinds (list of str): The kinds summed into the total, all of
+                them if None.
+        """
+
+        frame = pd.DataFrame(self.district_counts(), columns=self.kinds)
+        frame.insert(0, "district_e", self.districts)
+        frame["total"] = frame[list(kinds) if kinds is not None else self.kinds].sum(axis=1)
+        frame["share_of_city"] = frame["total"] / max(frame["total"].sum(), 1)
+
+        if self.district_areas is not None:
+            frame["parks_per_km2"] = frame["total"] / self.district_areas.reindex(self.districts).to_numpy()
+
+        return frame
+
+    def drill_down(self, district):
+        """Return the neighborhoods of a district with their counts, total and share."""
+
+        code = self.districts.get_loc(district)
+        rows = slice(self.starts[code], self.starts[code + 1])
+
+        frame = pd.DataFrame(self.counts[rows], columns=self.kinds)
+        frame.insert(0, "neighborhood", self.neighborhoods[rows])
+        frame["total"] = frame[self.kinds].sum(axis=1)
+        frame["share_of_district"] = frame["total"] / max(frame["total"].sum(), 1)
+
+        return frame.sort_values("total", ascending=False, ignore_index=True)
+
+
+def district_areas(districts):
+    """Return the area of every district in km2, by district_e."""
+
+    return pd.Series(districts.to_crs(park_access.metric_crs).area.to_numpy() / 1e6, index=districts["district_e"])
+
+
+def load_neighborhood_counts(rebuild=False):
+    """Return the NeighborhoodCounts of the parks, counted once and cached."""
+
+    districts = data_loader.load_districts()
+    table = data_loader.load_cached("park_neighborhoods",
+                                    [data_loader.parks_fp]
+                                    + data_loader.shapefile_parts(data_loader.istanbul_districts_fp),
+                                    lambda: neighborhood_table(spatial_join.load_park_districts(), districts),
+                                    rebuild=rebuild,
+                                    parameters={"kind": kind_column})
+
+    return NeighborhoodCounts(table, district_areas(districts))
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module measures the walking catchment of the parks: the share of the
+area of every district that lies within 300, 500 or 1000 meters of any park
+or green area of park_location_cleaned.csv.
+
+The districts are rasterized on a grid of cell_size meters in the metric
+CRS of park_access (UTM zone 35N), every cell labelled with its district.
+The cells holding a park are the seeds of one distance transform, which
+gives the distance from every cell of the province to its nearest park. The
+coverage of a district for a radius is then the share of its cells whose
+distance is within the radius, counted for all districts at once with
+bincount. Parks of a neighbouring district count as well, a park across the
+border is as close as one inside.
+
+The grid and the distances are computed once per process, the coverage of
+every radius is cached by data_loader like the other datasets, keyed on the
+CSV, the shapefile, the radius and the cell size. load_coverage_columns
+returns them as coverage_<radius> columns to merge into the districts for
+the choropleths.
+
+Run this file directly to time the computation and print the coverage:
+
+    python park_coverage.py [--radii 300 500 1000]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+import pandas as pd  # For general data processing tasks
+from affine import Affine
+
+import data_loader  # Shared, cached reader of the input datasets
+import georeference  # District contours on the pixel grid of an image
+import park_access  # Metric CRS and projection of the parks
+import satellite_analysis  # Label image of the district contours
+
+# %% --- Settings ---
+
+# Walking distances of the catchments, in meters
+catchment_radii = (300, 500, 1000)
+
+# Side of the cells of the grid, in meters. Distances are exact to about
+# half a cell.
+cell_size = 25
+
+# Grids and distances computed in this process, keyed by cell size
+_catchment_grids = {}
+
+
+# %% --- Helper functions and definitions ---
+
+def district_grid(districts, size=cell_size):
+    """Rasterize the districts on a metric grid.
+
+    Arguments:
+        districts (geopandas.GeoDataFrame): The districts.
+        size (float): Side of the cells in meters.
+
+    Returns:
+        tuple: (labels, names, transform), an int32 image with n + 1 in the
+        cells of the n-th polygon and 0 outside every district, the district
+        of every polygon and the transform from the grid to park_access's
+        metric CRS.
+    """
+
+    metric_districts = districts.to_crs(park_access.metric_crs)
+    min_x, min_y, max_x, max_y = metric_districts.total_bounds
+
+    transform = Affine(size, 0, min_x, 0, -size, max_y)
+    shape = (int(np.ceil((max_y - min_y) / size)), int(np.ceil((max_x - min_x) / size)))
+
+    contours, names = georeference.district_contours(metric_districts, transform)
+
+    return satellite_analysis.label_image(contours, shape), names, transform
+
+
+def park_distances(longitudes, latitudes, transform, shape):
+    """Return the distance in meters from every cell of a grid to its nearest park.
+
+    Arguments:
+        longitudes, latitudes (array-like): The parks.
+        transform (affine.Affine): From the grid to park_access's metric CRS.
+        shape (tuple): Height and width of the grid.
+
+    Returns:
+        numpy.ndarray: float32 distances, of the given shape.
+    """
+
+    x, y = park_access.metric_coordinates(longitudes, latitudes).T
+    columns, rows = ~transform * (x, y)
+    columns, rows = np.floor(columns).astype(np.int64), np.floor(rows).astype(np.int64)
+
+    # Parks off the grid can't be seeds
+    on_grid = (rows >= 0) & (rows < shape[0]) & (columns >= 0) & (columns < shape[1])
+
+    # The distance transform measures the distance to the nearest zero cell
+    seeds = np.full(shape, 255, dtype=np.uint8)
+    seeds[rows[on_grid], columns[on_grid]] = 0
+
+    return cv2.distanceTransform(seeds, cv2.DIST_L2, cv2.DIST_MASK_PRECISE) * np.float32(transform.a)
+
+
+def catchment_grid(size=cell_size):
+    """Return the labels, names and park distances of the grid, once per process."""
+
+    if size not in _catchment_grids:
+        labels, names, transform = district_grid(data_loader.load_districts(), size)
+        parks = data_loader.load_parks()
+        _catchment_grids[size] = labels, names, park_distances(parks["longitude"], parks["latitude"], transform,
+                                                               labels.shape)
+
+    return _catchment_grids[size]
+
+
+def district_coverage(labels, names, distances, radius):
+    """Return the share of the cells of every district within radius of a park.
+
+    Arguments:
+        labels, names: As returned by district_grid.
+        distances (numpy.ndarray): As returned by park_distances.
+        radius (float): The walking distance, in meters.
+
+    Returns:
+        pandas.DataFrame: district_e and coverage, between 0 and 1.
+    """
+
+    flat_labels = labels.ravel()
+    cells = np.bincount(flat_labels, minlength=len(names) + 1)[1:]
+    covered = np.bincount(flat_labels[(distances <= radius).ravel()], minlength=len(names) + 1)[1:]
+
+    # Districts of several polygons add their cells up
+    counts = pd.DataFrame({"district_e": names, "cells": cells, "covered": covered}).groupby("district_e").sum()
+
+    return (counts["covered"] / counts["cells"]).rename("coverage").reset_index()
+
+
+def load_coverage(radius, size=cell_size, rebuild=False):
+    """Return the coverage of every district for a radius, from the cache if it's fresh."""
+
+    return data_loader.load_cached("park_coverage_{}_{}".format(radius, size),
+                                   [data_loader.parks_fp]
+                                   + data_loader.shapefile_parts(data_loader.istanbul_districts_fp),
+                                   lambda: district_coverage(*catchment_grid(size), radius),
+                                   rebuild=rebuild,
+                                   parameters={"radius": radius, "cell_size": size})
+
+
+def load_coverage_columns(radii=catchment_radii, size=cell_size, rebuild=False):
+    """Return district_e and a coverage_<radius> column for every radius."""
+
+    columns = pd.DataFrame({"district_e": data_loader.load_districts()["district_e"]})
+
+    for radius in radii:
+        coverage = load_coverage(radius, size, rebuild).rename(columns={"coverage": "coverage_{}".format(radius)})
+        columns = columns.merge(coverage, on="district_e", how="left")
+
+    return columns
+
+
+# %% --- Compute from the command line ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the walking catchment coverage of the districts.")
+    parser.add_argument("--radii", type=int, nargs="+", default=list(catchment_radii),
+                        help="Walking distances in meters.")
+    parser.add_argument("--cell-size", type=int, default=cell_size, help="Side of the grid cells in meters.")
+    arguments = parser.parse_args()
+
+    start = time.perf_counter()
+    coverage_columns = load_coverage_columns(arguments.radii, arguments.cell_size, rebuild=True)
+    computed = time.perf_counter()
+    load_coverage_columns(arguments.radii, arguments.cell_size)
+    cached = time.perf_counter()
+
+    print(coverage_columns.sort_values(coverage_columns.columns[-1], ascending=False)
+          .to_string(index=False, float_format="{:.1%}".format))
+    print("computed in {:.2f}s, from the cache in {:.3f}s".format(computed - start, cached - computed))
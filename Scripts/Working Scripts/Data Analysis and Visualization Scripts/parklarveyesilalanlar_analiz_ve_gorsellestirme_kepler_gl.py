@@ -1,8 +1,11 @@
 import keplergl
 import pandas as pd
 
+import data_loader  # Shared, cached reader of the input datasets
+import geometry_lod  # Simplified district geometry per output
+
 # read csv
-df = pd.read_csv('../../../Data/Non-GIS Data/cleaned/park_location_cleaned.csv')
+df = data_loader.load_parks()
 
 # lat and lon to numeric, errors converted to nan
 df['latitude'] = pd.to_numeric(df.latitude, errors='coerce')
@@ -15,4 +18,9 @@ kepler_map = keplergl.KeplerGl(height=1400)
 
 kepler_map.add_data(data=df, name="institution_type_tr")
 
+# District borders, simplified to the level of detail of the HTML map
+districts_lod = geometry_lod.load_lod(geometry_lod.level_for_format("html"))
+
+kepler_map.add_data(data=districts_lod.loc[:, ["district_t", "district_e", "geometry"]], name="istanbul_districts")
+
 kepler_map.save_to_html(file_name='parklarveyesilalanlar_istanbul.html', read_only=True, center_map=True)
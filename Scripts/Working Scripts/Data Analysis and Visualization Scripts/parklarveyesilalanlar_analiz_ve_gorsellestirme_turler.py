@@ -22,6 +22,10 @@ import matplotlib.pyplot as plt  # For plotting
 import matplotlib.cm as cm
 import matplotlib.colors as col
 import os
+import data_loader  # Shared, cached reader of the input datasets
+from bar_labels import add_value_labels  # Batched labels on top of the bars
+import figure_export  # Parallel export of the finished figures
+from bilingual_figure import BilingualFigure  # Draw once, export in EN and TR
 
 # from matplotlib import rc
 # rc('text', usetex=True)
@@ -66,49 +70,6 @@ except:
 
 # %% --- Helper functions and definitions ---
 
-# Helper function: Add labels to the top of a bar chart.
-def add_value_labels(ax, spacing=5):
-    """Add labels to the end of each bar in a bar chart.
-
-    Arguments:
-        ax (matplotlib.axes.Axes): The matplotlib object containing the axes
-            of the plot to annotate.
-        spacing (int): The distance between the labels and the bars.
-    """
-
-    # For each bar: Place a label
-    for rect in ax.patches:
-        # Get X and Y placement of label from rect.
-        y_value = rect.get_height()
-        x_value = rect.get_x() + rect.get_width() / 2
-
-        # Number of points between bar and label. Change to your liking.
-        space = spacing
-        # Vertical alignment for positive values
-        va = 'bottom'
-
-        # If value of bar is negative: Place label below bar
-        if y_value < 0:
-            # Invert space to place label below
-            space *= -1
-            # Vertically align label at top
-            va = 'top'
-
-        # Use Y value as label and format number with one decimal place
-        label = "{:}".format(y_value)  # Remove .1f if you don't want one decimal place
-
-        # Create annotation
-        ax.annotate(
-            label,  # Use `label` as label
-            (x_value, y_value),  # Place label at end of the bar
-            xytext=(0, space),  # Vertically shift label by `space`
-            textcoords="offset points",  # Interpret `xytext` as offset in points
-            ha='center',  # Horizontally center label
-            va=va,  # Vertically align label differently for  positive and negative values.
-            rotation=90,  # Rotate label
-            fontsize=15)
-
-
 # Helper definitions --- Set dictionaries for fonts
 
 # Set font info
@@ -158,101 +119,35 @@ emphasis_color = cm.Set2.colors[2]
 # %% --- Read in the datasets ---
 
 # Istanbul park and green areas services data
-parks_fp = "../../../Data/Non-GIS Data/cleaned/park_location_cleaned.csv"
-parks_and_green_areas = pd.read_csv(parks_fp)
+parks_and_green_areas = data_loader.load_parks()
 
 # %% --- Data Preparation ---
 
 inst_types_counts = parks_and_green_areas.loc[:, "care_type"].value_counts()
 
-# %% --- Visualization - English ---
+# %% --- Visualization ---
 
-# --- Figure Preparation ---
-
-fig = plt.figure(figsize=(25.60, 14.40))
-
-ax = fig.add_subplot(1, 1, 1)
+# The English and the Turkish figures share every data artist, only their
+# text differs. The figure is drawn once and relabelled before each export.
 
 # --- Data Selection ---
 
 # Get labels for x - axis ticks
-labels = list(parks_and_green_areas.loc[:, "care_type"].value_counts().index)
-
-# Generate bar positions
-from numpy import arange
-
-bar_positions = arange(len(labels)) + 1
+labels = list(inst_types_counts.index)
 
 # Get bar heights from data
 bar_heights = inst_types_counts.values.astype(int)
 
-# --- Color Information ---
-
-# For parks and green areas data  when both graphs and maps are used.
-sequential_cmap = sequential_color_mapper(bar_heights)
-
-# --- Plot Figure ---
+# --- Text of the figure ---
 
-ax.bar(bar_positions, bar_heights,
-       width=0.7,
-       align="center",
-       color=categorical_color)
-
-# --- Set x and y axis ticks ---
-
-# Setting where x-ticks should be at
-ax.set_xticks(bar_positions)
-
-# Setting x-tick labels and positions
-ax.set_xticklabels(labels, rotation=90)
-
-# Setting custom y-axis tick intervals
-start, end = ax.get_ylim()
-ax.yaxis.set_ticks(np.arange(start, end, 500))
-
-# --- Spine and Grid ---
-
-# Disable right and top spine
-ax.spines['right'].set_visible(False)
-ax.spines['top'].set_visible(False)
-
-# --- Text ---
-
-ax.set_title(
-    # "In Istanbul, there are " + r'\textcolor{red}{3522}' + " healthcare institutions distributed across " + r'\textcolor{red}{33}' + " categories.",
-    "İstanbul'daki Park Dağılımı",
-    fontdict=font_title,
-    pad=20)
-
-# Add x axis label
-ax.set_xlabel("Tür",
-              fontdict=font_axislabels,
-              labelpad=18)
-
-# Add y axis label
-ax.set_ylabel("Park Sayısı",
-              fontdict=font_axislabels,
-              labelpad=18)
-
-# Set xtick font info
-
-ax.set_xticklabels(ax.get_xticklabels(),
-                   font_xticks)
-
-# Add labels to the top of the bars
-add_value_labels(ax)
-
-# --- Export Visualization ---
-
-# As SVG
-# export_path = complete_output_directory +  r"/" + (filename_final_processed + "_eng.svg")
-# plt.savefig(export_path, format = "svg", dpi = 300, bbox_inches="tight")
-
-# As png
-#export_path = complete_output_directory + r"/" + (filename_final_processed + "_eng.png")
-#plt.savefig(export_path, format="png", dpi=300, bbox_inches="tight")
-
-# %% --- Visualization - Turkish ---
+figure_strings = {"en": {"title": "There are {} parks in Istanbul distributed across {} categories.".format(
+                             bar_heights.sum(), len(labels)),
+                         "xlabel": "Park type",
+                         "ylabel": "Number of parks per type"},
+                  "tr": {"title": "İstanbul'da {} farklı kategoriye dağıtılmış {} tane park vardır.".format(
+                             len(labels), bar_heights.sum()),
+                         "xlabel": u"Park Türü",
+                         "ylabel": u"Türe Göre Park Sayısı"}}
 
 # --- Figure Preparation ---
 
@@ -262,19 +157,13 @@ fig = plt.figure(figsize=(25.60, 14.40))
 
 ax = fig.add_subplot(1, 1, 1)
 
-# --- Data Selection ---
-
-# Get labels for x - axis ticks
-labels = list(parks_and_green_areas.loc[:, "care_type"].value_counts().index)
+spec = BilingualFigure(fig, figure_strings)
 
 # Generate bar positions
 from numpy import arange
 
 bar_positions = arange(len(labels)) + 1
 
-# Get bar heights from data
-bar_heights = inst_types_counts.values.astype(int)
-
 # --- Color Information ---
 
 # For park and green areas data  when both graphs and maps are used.
@@ -307,34 +196,35 @@ ax.spines['top'].set_visible(False)
 
 # --- Text ---
 
-ax.set_title("İstanbul'da 3 farklı kategoriye dağıtılmış 3616 tane park vardır.",
-             fontdict=font_title,
-             pad=20)
+spec.bind("title", lambda text: ax.set_title(text,
+                                             fontdict=font_title,
+                                             pad=20))
 
 # Add x axis label
-ax.set_xlabel(u"Park Türü",
-              fontdict=font_axislabels,
-              labelpad=18)
+spec.bind("xlabel", lambda text: ax.set_xlabel(text,
+                                               fontdict=font_axislabels,
+                                               labelpad=18))
 
 # Add y axis label
-ax.set_ylabel(u"Türe Göre Park Sayısı",
-              fontdict=font_axislabels,
-              labelpad=18)
+spec.bind("ylabel", lambda text: ax.set_ylabel(text,
+                                               fontdict=font_axislabels,
+                                               labelpad=18))
 
 # Set xtick font info
 
 ax.set_xticklabels(ax.get_xticklabels(),
-                   font_xticks)
+                   fontdict=font_xticks)
 
 # Add labels to the top of the bars
 add_value_labels(ax)
 
 # --- Export Visualization ---
 
-# As svg
-# export_path = complete_output_directory +  r"/" + (filename_final_processed + "_tr.svg")
-# plt.savefig(export_path, format = "svg", dpi = 1200, bbox_inches="tight")
+# As png, once per language
+export_formats = [("png", 600)]
+
+spec.export("en", complete_output_directory + r"/" + (filename_final_processed + "_sadece_parklar_eng"), export_formats)
+spec.export("tr", complete_output_directory + r"/" + (filename_final_processed + "_sadece_parklar_tr"), export_formats)
 
-# As png
-export_path = complete_output_directory + r"/" + (filename_final_processed + "_sadece_parklar_tr.png")
-plt.savefig(export_path, format="png", dpi=600, bbox_inches="tight")
\ No newline at end of file
+# Write the outputs of both languages in parallel
+figure_export.flush()
@@ -15,6 +15,11 @@ The visualization will be a small multiple that has:
     total num. of parks and woods/grooves on the Y axis
     The bar chart will be redundantly encoded with the same colormap
 
+A second figure maps the walking catchment of the parks, the share of every
+district within 300, 500 and 1000 m of a park, one map per distance, and the
+median distance from the district to its nearest park. A third
+one maps the density of the parks on a grid of hexagons.
+
 --------------------------------
 """
 
@@ -27,10 +32,19 @@ import matplotlib.colors as col
 import os
 import geopandas as gpd  # A module built on top of pandas for geospatial analysis
 from pyproj import CRS  # For CRS (Coordinate Reference System) functions
-from shapely.geometry import Point, MultiPoint  # Required for point/polygon geometry
-from shapely.ops import nearest_points  # Required for nearest neighbor analysis
 import contextily as ctx  # Used in conjuction with matplotlib/geopandas to set a basemap
-from geopy import distance  # For geodesic distance calculation (radians to meters)
+import basemap_cache  # Offline basemap tiles for the map figures
+from bar_labels import add_value_labels  # Batched labels on top of the bars
+import data_loader  # Shared, cached reader of the input datasets
+import geometry_lod  # Simplified district geometry per output
+import figure_export  # Parallel export of the finished figures
+import district_labels  # Cached, collision-aware district name labels
+import grid_binning  # Parks binned into hexagons for the density map
+import park_access  # Distance from the districts to their nearest park
+import park_coverage  # Walking catchment coverage of the districts
+import neighborhood_rollup  # Park counts per neighborhood, district and city
+from bilingual_figure import BilingualFigure, text_setter  # Draw once, export in EN and TR
+from matplotlib.ticker import PercentFormatter  # Coverage shares as percentages
 
 # from matplotlib import rc
 # rc('text', usetex=True)
@@ -75,49 +89,6 @@ except:
 
 # %% --- Helper functions and definitions ---
 
-# Helper function: Add labels to the top of a bar chart.
-def add_value_labels(ax, spacing=5):
-    """Add labels to the end of each bar in a bar chart.
-
-    Arguments:
-        ax (matplotlib.axes.Axes): The matplotlib object containing the axes
-            of the plot to annotate.
-        spacing (int): The distance between the labels and the bars.
-    """
-
-    # For each bar: Place a label
-    for rect in ax.patches:
-        # Get X and Y placement of label from rect.
-        y_value = rect.get_height()
-        x_value = rect.get_x() + rect.get_width() / 2
-
-        # Number of points between bar and label. Change to your liking.
-        space = spacing
-        # Vertical alignment for positive values
-        va = 'bottom'
-
-        # If value of bar is negative: Place label below bar
-        if y_value < 0:
-            # Invert space to place label below
-            space *= -1
-            # Vertically align label at top
-            va = 'top'
-
-        # Use Y value as label and format number with one decimal place
-        label = "{:}".format(y_value)  # Remove .1f if you don't want one decimal place
-
-        # Create annotation
-        ax.annotate(
-            label,  # Use `label` as label
-            (x_value, y_value),  # Place label at end of the bar
-            xytext=(0, space),  # Vertically shift label by `space`
-            textcoords="offset points",  # Interpret `xytext` as offset in points
-            ha='center',  # Horizontally center label
-            va=va,  # Vertically align label differently for  positive and negative values.
-            rotation=90,
-            fontsize=15)  # Rotate label
-
-
 # Helper definitions --- Set dictionaries for fonts
 
 # Set font info
@@ -134,6 +105,12 @@ font_axislabels = {'family': 'sans-serif',
                    'weight': 'bold',
                    'size': 20}
 
+font_maptitles = {'family': 'sans-serif',
+                  "fontname": "Arial",
+                  'color': 'black',
+                  'weight': 'bold',
+                  'size': 16}
+
 font_xticks = {'family': 'sans-serif',
                "fontname": "Arial",
                'color': 'black',
@@ -173,31 +150,56 @@ emphasis_color = cm.Set2.colors[2]
 # %% --- Read in the datasets ---
 
 # Istanbul parks and green areas services data
-parks_fp = "../../../Data/Non-GIS Data/cleaned/park_location_cleaned.csv"
-parks_and_green_areas = pd.read_csv(parks_fp)
+park_counts = neighborhood_rollup.load_neighborhood_counts()  # Per neighborhood, by their coordinates
 
 # Istanbul geospatial districts data
-istanbul_districts_fp = "../../../Data/GIS data/Processed/istanbul_districts.shp"
-istanbul_districts = gpd.read_file(istanbul_districts_fp, )
+istanbul_districts = data_loader.load_districts()
 
 # %% --- Data Preparation ---
 
 
-# Create for English
-p_and_ga_inst_per_district_eng = parks_and_green_areas.loc[:, "district_eng"].value_counts().sort_values(
-    ascending=False).reset_index()
-p_and_ga_inst_per_district_eng.rename(columns={"index": "district_e",
-                                               "district_eng": "park_count"},
-                                      inplace=True)
+# Create for English, rolled up from the parks of the neighborhoods
+p_and_ga_inst_per_district_eng = park_counts.district_frame().sort_values(
+    "total", ascending=False, kind="stable").loc[:, ["district_e", "total"]].rename(columns={"total": "park_count"})
 
 # Merge with geodataframe
 istanbul_districts = istanbul_districts.merge(p_and_ga_inst_per_district_eng,
                                               on="district_e",
                                               how="left")
 
+# Share of every district within 300/500/1000 m of a park, as coverage_300/_500/_1000
+istanbul_districts = istanbul_districts.merge(park_coverage.load_coverage_columns(),
+                                              on="district_e",
+                                              how="left")
+
+# Mean, median and 90th percentile distance from every district to its nearest park, in meters
+istanbul_districts = istanbul_districts.merge(park_access.load_district_distances(),
+                                              on="district_e",
+                                              how="left")
+
+# Number of parks in every occupied hexagon of the grid
+park_cells = grid_binning.load_park_cells(grid_binning.map_resolution)
+
 # Now, this information can be used for both TR and eng
 
-# %% --- Visualization - English ---
+# %% --- Visualization ---
+
+# The English and the Turkish figures share every data artist, only their
+# text differs. The figure is drawn once and relabelled before each export.
+
+# --- Text of the figure ---
+
+# Label anchors of every district, the largest districts are labelled first
+label_anchors = district_labels.load_label_anchors()
+
+figure_strings = {"en": {"map_labels": list(label_anchors.loc[:, "district_e"]),
+                         "colorbar": "Number of parks and green areas",
+                         "xlabel": "District",
+                         "ylabel": "Number of parks/green areas"},
+                  "tr": {"map_labels": list(label_anchors.loc[:, "district_t"]),
+                         "colorbar": "Park/Yeşil Alan Sayısı",
+                         "xlabel": "İlçe",
+                         "ylabel": "Park/Yeşil Alan Sayısı"}}
 
 # --- Figure Preparation ---
 
@@ -205,21 +207,24 @@ fig = plt.figure(figsize=(19.20, 19.20))
 
 ax_1 = fig.add_subplot(2, 1, 1)
 
+spec = BilingualFigure(fig, figure_strings, tight_layout=True)
+
 #                            --- MAP: ---
 
 # --- Plot Figure ---
 
-istanbul_districts.plot(ax=ax_1,
-                        column="park_count",
-                        edgecolor="black",
-                        alpha=1,
-                        cmap=cm.YlOrBr)
+geometry_lod.plot_districts(istanbul_districts,
+                            ax=ax_1,
+                            column="park_count",
+                            edgecolor="black",
+                            alpha=1,
+                            cmap=cm.YlOrBr)
 # YlGnBu -> blue schema
 # --- Set Basemap ---
 
-ctx.add_basemap(ax_1, zoom=11,  # 16
-                crs='epsg:4326',
-                source=ctx.providers.Esri.WorldGrayCanvas)
+basemap_cache.add_basemap(ax_1, zoom=11,  # 16
+                          crs='epsg:4326',
+                          source=ctx.providers.Esri.WorldGrayCanvas)
 
 # --- Spine and Grid ---
 
@@ -227,26 +232,11 @@ ax_1.set_axis_off()  # Turn off axis
 
 # --- Map Labels ---
 
-# Select districts that you want labels for
-districts_to_label_list = ["Silivri", "Catalca", "Buyukcekmece", "Arnavutkoy", "Eyupsultan", "Sariyer",
-                           "Beykoz", "Sile", "Cekmekoy", "Tuzla", "Pendik", "Maltepe", "Basaksehir", "Bahcelievler",
-                           "Beyoglu"]
-
-districts_to_label_indexes = [31, 5, 16, 3, 20, 33, 13, 1, 17, 37, 30]
-
-# Create a boolean indexing mask checking for those districts
-labels_mask = istanbul_districts.loc[:, "district_e"].isin(districts_to_label_list)
+# Names that would overlap the name of a larger district are left out,
+# the text is set per locale
+map_labels = district_labels.add_district_labels(ax_1, label_anchors)
 
-# Pass in the boolean mask to create a dataframe
-districts_to_label = istanbul_districts.loc[labels_mask, ["district_e", "geometry"]]
-
-# Create a representative point within each district polygon to place the label
-districts_to_label["representative_point"] = districts_to_label.geometry.representative_point().geometry.values
-
-# Pass over each row label the repsentative point according to that row's name
-for idx, row in districts_to_label.iterrows():
-    ax_1.annotate(s=row["district_e"], xy=(row["representative_point"].x, row["representative_point"].y),
-                  horizontalalignment='center')
+spec.bind("map_labels", map_labels.set_texts)
 
 #                           --- BAR CHART: ---
 
@@ -256,7 +246,7 @@ ax_2 = fig.add_subplot(2, 1, 2)
 # --- Data Selection ---
 
 # Get labels for x - axis ticks
-labels = list(parks_and_green_areas.loc[:, "district_eng"].value_counts().sort_values(ascending=False).index)
+labels = list(p_and_ga_inst_per_district_eng.loc[:, "district_e"])
 
 # Generate bar positions
 from numpy import arange
@@ -297,9 +287,12 @@ cbar = plt.colorbar(sequential_cmap,
                     shrink=0.25,
                     anchor=(30, 10))
 
-cbar.set_label('Number of parks and green areas',
-               size=14,
-               weight="bold")
+spec.bind("colorbar", lambda text: cbar.set_label(text,
+                                                  size=14,
+                                                  weight="bold"))
+
+# Can also set like this
+# cbar.ax.set_xticklabels(['Low', 'Medium', 'High'])  # horizontal colorbar
 
 # --- Set x and y axis ticks ---
 
@@ -322,14 +315,14 @@ ax_2.spines['top'].set_visible(False)
 # --- Text ---
 
 # Add x axis label
-ax_2.set_xlabel("District",
-                fontdict=font_axislabels,
-                labelpad=18)
+spec.bind("xlabel", lambda text: ax_2.set_xlabel(text,
+                                                 fontdict=font_axislabels,
+                                                 labelpad=18))
 
 # Add y axis label
-ax_2.set_ylabel("Number of parks/green areas",
-                fontdict=font_axislabels,
-                labelpad=18)
+spec.bind("ylabel", lambda text: ax_2.set_ylabel(text,
+                                                 fontdict=font_axislabels,
+                                                 labelpad=18))
 
 # Add labels to the top of the bars
 add_value_labels(ax_2)
@@ -337,183 +330,157 @@ add_value_labels(ax_2)
 # Set xtick font info
 
 ax_2.set_xticklabels(ax_2.get_xticklabels(),
-                     font_xticks)
-
-# --- Misc ---
+                     fontdict=font_xticks)
 
-# Remove the empty white-space around the axes
-plt.tight_layout()
+# %%
 
 # --- Export Visualization ---
 
-# As SVG
-# export_path = complete_output_directory +  r"/" + (filename_final_processed + "_eng.svg")
-# plt.savefig(export_path, format = "svg", dpi = 1200, bbox_inches="tight")
+# As svg and png, once per language
+export_formats = [("svg", 1200), ("png", 300)]
 
-# As png
-# export_path = complete_output_directory + r"/" + (filename_final_processed + "_eng.png")
-# plt.savefig(export_path, format="png", dpi=300, bbox_inches="tight")
+spec.export("en", complete_output_directory + r"/" + (filename_final_processed + "_eng"), export_formats)
+spec.export("tr", complete_output_directory + r"/" + (filename_final_processed + "_tr"), export_formats)
 
-# %% --- Visualization - Turkish ---
+# %% --- Visualization - Walking catchment coverage ---
 
+# --- Text of the figure ---
 
-# --- Figure Preparation ---
+coverage_strings = {"en": {"titles": ["Within {} m of a park".format(radius)
+                                      for radius in park_coverage.catchment_radii],
+                           "colorbar": "Share of the district area",
+                           "distance_title": "Median distance to a park",
+                           "distance_colorbar": "Meters"},
+                    "tr": {"titles": ["Bir parka {} m mesafede".format(radius)
+                                      for radius in park_coverage.catchment_radii],
+                           "colorbar": "İlçe alanındaki payı",
+                           "distance_title": "Parka medyan uzaklık",
+                           "distance_colorbar": "Metre"}}
 
-fig = plt.figure(figsize=(19.20, 19.20))
+# --- Figure Preparation ---
 
-ax_1 = fig.add_subplot(2, 1, 1)
+fig_coverage, coverage_axes = plt.subplots(1, len(park_coverage.catchment_radii) + 1, figsize=(19.20, 5.00))
 
-#                            --- MAP: ---
+coverage_spec = BilingualFigure(fig_coverage, coverage_strings)
 
 # --- Plot Figure ---
 
-istanbul_districts.plot(ax=ax_1,
-                        column="park_count",
-                        edgecolor="black",
-                        alpha=1,
-                        cmap=cm.YlOrBr)
-
-# --- Set Basemap ---
-
-ctx.add_basemap(ax_1, zoom=11,  # 16
-                crs='epsg:4326',
-                source=ctx.providers.Esri.WorldGrayCanvas)
-
-# Add labels for certain districts
-
-# --- Spine and Grid ---
-
-ax_1.set_axis_off()  # Turn off axis
-
-# --- Map Labels ---
-
-# Select districts that you want labels for
-districts_to_label_list = ["Silivri", "Catalca", "Buyukcekmece", "Arnavutkoy", "Eyupsultan", "Sariyer",
-                           "Beykoz", "Sile", "Cekmekoy", "Tuzla", "Pendik", "Maltepe", "Basaksehir", "Bahcelievler",
-                           "Beyoglu"]
+# Every map on the same 0-100% scale, so the distances can be compared
+coverage_titles = []
 
-districts_to_label_indexes = [31, 5, 16, 3, 20, 33, 13, 1, 17, 37, 30]
+for radius, ax_coverage in zip(park_coverage.catchment_radii, coverage_axes):
+    geometry_lod.plot_districts(istanbul_districts,
+                                ax=ax_coverage,
+                                column="coverage_{}".format(radius),
+                                edgecolor="black",
+                                alpha=1,
+                                cmap=cm.YlGn,
+                                vmin=0,
+                                vmax=1)
 
-# Create a boolean indexing mask checking for those districts
-labels_mask = istanbul_districts.loc[:, "district_e"].isin(districts_to_label_list)
+    basemap_cache.add_basemap(ax_coverage, zoom=11,
+                              crs='epsg:4326',
+                              source=ctx.providers.Esri.WorldGrayCanvas,
+                              attribution=radius == park_coverage.catchment_radii[0])
 
-# Pass in the boolean mask to create a dataframe
-districts_to_label = istanbul_districts.loc[labels_mask, ["district_t", "geometry"]]
+    ax_coverage.set_axis_off()  # Turn off axis
 
-# Create a representative point within each district polygon to place the label
-districts_to_label["representative_point"] = districts_to_label.geometry.representative_point().geometry.values
+    coverage_titles.append(ax_coverage.set_title("", fontdict=font_maptitles))
 
-# Pass over each row label the repsentative point according to that row's name
-for idx, row in districts_to_label.iterrows():
-    ax_1.annotate(s=row["district_t"], xy=(row["representative_point"].x, row["representative_point"].y),
-                  horizontalalignment='center')
+coverage_spec.bind("titles", text_setter(coverage_titles))
 
-#                           --- BAR CHART: ---
+# Median distance from the points of a 250 m grid over every district to their nearest park
+ax_distance = coverage_axes[-1]
 
-# --- Figure Preparation ---
-ax_2 = fig.add_subplot(2, 1, 2)
+geometry_lod.plot_districts(istanbul_districts,
+                            ax=ax_distance,
+                            column="median_distance",
+                            edgecolor="black",
+                            alpha=1,
+                            cmap=cm.YlOrBr)
 
-# --- Data Selection ---
+basemap_cache.add_basemap(ax_distance, zoom=11,
+                          crs='epsg:4326',
+                          source=ctx.providers.Esri.WorldGrayCanvas,
+                          attribution=False)
 
-# Get labels for x - axis ticks
-labels = list(parks_and_green_areas.loc[:, "district_eng"].value_counts().sort_values(ascending=False).index)
+ax_distance.set_axis_off()  # Turn off axis
 
-# Generate bar positions
-from numpy import arange
-
-bar_positions = arange(len(labels)) + 1
-
-# Get bar heights from data
-bar_heights = p_and_ga_inst_per_district_eng.loc[:, "park_count"].values.astype(int)
+coverage_spec.bind("distance_title", lambda text: ax_distance.set_title(text, fontdict=font_maptitles))
 
-# --- Color Information ---
+# --- Add color legend ---
 
-# For park and green areas data  when both graphs and maps are used.
-sequential_cmap = cm.ScalarMappable(col.Normalize(0, max(bar_heights)), cm.YlOrBr)
+coverage_cbar = fig_coverage.colorbar(cm.ScalarMappable(col.Normalize(0, 1), cm.YlGn),
+                                      ax=list(coverage_axes[:-1]),
+                                      orientation="horizontal",
+                                      shrink=0.4,
+                                      format=PercentFormatter(1))
 
-# --- Plot Figure ---
+coverage_spec.bind("colorbar", lambda text: coverage_cbar.set_label(text,
+                                                                    size=14,
+                                                                    weight="bold"))
 
-ax_2.bar(bar_positions, bar_heights,
-         width=0.7,
-         align="center",
-         color=sequential_cmap.to_rgba(bar_heights))
-
-# --- Add color legend ---
-
-# Import required toolkit
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+distance_cbar = fig_coverage.colorbar(ax_distance.collections[0],
+                                      ax=ax_distance,
+                                      orientation="horizontal")
 
-# Create an inset_axes instance with different parameters
-axins1 = inset_axes(ax_2,
-                    width="50%",  # width = 50% of parent_bbox width
-                    height="5%",  # height : 5%
-                    loc='upper right')
+coverage_spec.bind("distance_colorbar", lambda text: distance_cbar.set_label(text,
+                                                                             size=14,
+                                                                             weight="bold"))
 
-# Create a colormap
-cbar = plt.colorbar(sequential_cmap,
-                    cax=axins1,
-                    # ticks = [] Cna also set ticks like this
-                    orientation="horizontal",
-                    shrink=0.25,
-                    anchor=(30, 10))
+# --- Export Visualization ---
 
-cbar.set_label('Park/Yeşil Alan Sayısı',
-               size=14,
-               weight="bold")
+coverage_spec.export("en", complete_output_directory + r"/" + (filename_final_processed + "_coverage_eng"),
+                     export_formats)
+coverage_spec.export("tr", complete_output_directory + r"/" + (filename_final_processed + "_coverage_tr"),
+                     export_formats)
 
-# Can also set like this
-# cbar.ax.set_xticklabels(['Low', 'Medium', 'High'])  # horizontal colorbar
+# %% --- Visualization - Park density ---
 
-# --- Set x and y axis ticks ---
+# --- Text of the figure ---
 
-# Setting where x-ticks should be at
-ax_2.set_xticks(bar_positions)
+density_strings = {"en": {"title": "Parks and green areas per {} m hexagon".format(grid_binning.map_resolution),
+                          "colorbar": "Number of parks and green areas"},
+                   "tr": {"title": "{} m altıgen başına park/yeşil alan".format(grid_binning.map_resolution),
+                          "colorbar": "Park/Yeşil Alan Sayısı"}}
 
-# Setting x-tick labels and positions
-ax_2.set_xticklabels(labels, rotation=90)
+# --- Figure Preparation ---
 
-# Setting custom y-axis tick intervals
-start, end = ax_2.get_ylim()
-ax_2.yaxis.set_ticks(np.arange(start, end, 50))
+fig_density, ax_density = plt.subplots(figsize=(19.20, 9.60))
 
-# --- Spine and Grid ---
+density_spec = BilingualFigure(fig_density, density_strings)
 
-# Disable right and top spine
-ax_2.spines['right'].set_visible(False)
-ax_2.spines['top'].set_visible(False)
+# --- Plot Figure ---
 
-# --- Text ---
+# One artist for all the hexagons, however many parks there are
+density_layer = grid_binning.add_density_layer(ax_density, park_cells, grid_binning.map_resolution,
+                                               crs="EPSG:4326", cmap=cm.YlGn, edgecolor="none")
 
-# Add x axis label
-ax_2.set_xlabel("İlçe",
-                fontdict=font_axislabels,
-                labelpad=18)
+# District outlines above the hexagons
+istanbul_districts.boundary.plot(ax=ax_density, color="black", linewidth=0.5, zorder=3)
 
-# Add y axis label
-ax_2.set_ylabel("Park/Yeşil Alan Sayısı",
-                fontdict=font_axislabels,
-                labelpad=18)
+basemap_cache.add_basemap(ax_density, zoom=11,
+                          crs='epsg:4326',
+                          source=ctx.providers.Esri.WorldGrayCanvas)
 
-# Set xtick font info
+ax_density.set_axis_off()  # Turn off axis
 
-ax_2.set_xticklabels(ax_2.get_xticklabels(),
-                     font_xticks)
+density_spec.bind("title", lambda text: ax_density.set_title(text, fontdict=font_axislabels))
 
-# Add labels to the top of the bars
-add_value_labels(ax_2)
+# --- Add color legend ---
 
-# --- Misc ---
-# Remove the empty white-space around the axes
-plt.tight_layout()
+density_cbar = fig_density.colorbar(density_layer, ax=ax_density, shrink=0.6)
 
-# %%
+density_spec.bind("colorbar", lambda text: density_cbar.set_label(text,
+                                                                  size=14,
+                                                                  weight="bold"))
 
 # --- Export Visualization ---
 
-# As svg
-export_path = complete_output_directory + r"/" + (filename_final_processed + "_tr.svg")
-plt.savefig(export_path, format="svg", dpi=1200, bbox_inches="tight")
+density_spec.export("en", complete_output_directory + r"/" + (filename_final_processed + "_density_eng"),
+                    export_formats)
+density_spec.export("tr", complete_output_directory + r"/" + (filename_final_processed + "_density_tr"),
+                    export_formats)
 
-# As png
-export_path = complete_output_directory + r"/" + (filename_final_processed + "_tr.png")
-plt.savefig(export_path, format="png", dpi=300, bbox_inches="tight")
+# Write the outputs of both languages in parallel
+figure_export.flush()
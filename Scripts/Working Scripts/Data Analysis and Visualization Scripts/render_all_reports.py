@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This script renders every report of the project in a single process.
+
+Running the analysis scripts one by one makes each of them pay the import
+cost of geopandas, pyproj, contextily, scipy, cv2 and matplotlib and read
+the same datasets again. Here the packages are imported once, the shared
+district/park frames are built once through data_loader, and then every
+registered stage runs in the same interpreter.
+
+Usage:
+
+    python render_all_reports.py              # Run every stage
+    python render_all_reports.py nufus gelir  # Run only some stages
+    python render_all_reports.py --list       # List the registered stages
+    python render_all_reports.py --workers 4  # Export with 4 processes
+
+The figures of every stage are queued and written by one process pool in
+the final export stage. The time spent in every stage is printed at the end
+of the run.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import os
+import runpy
+import sys
+import time
+import traceback
+
+# Figures are only exported, never shown
+import matplotlib
+
+matplotlib.use("Agg")
+
+# %% --- Stage registry ---
+
+# Folder of the analysis scripts, the scripts read their inputs relative to it
+scripts_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Registered stages in the order they run, name -> function
+stages = {}
+
+
+def register_stage(name):
+    """Register the decorated function as a stage of the batch.
+
+    Arguments:
+        name (str): The name used to select the stage from the command line.
+    """
+
+    def decorator(function):
+        stages[name] = function
+        return function
+
+    return decorator
+
+
+# Helper function: Run an analysis script inside this process
+def run_script(script_name):
+    """Run one of the analysis scripts as if it was started on its own.
+
+    The script shares this interpreter's imported modules and the frames
+    that data_loader already holds in memory.
+
+    Arguments:
+        script_name (str): The file name of the script in this folder.
+    """
+
+    import matplotlib.pyplot as plt
+
+    try:
+        return runpy.run_path(os.path.join(scripts_directory, script_name), run_name="__main__")
+    finally:
+        # Free the figures of the stage before the next one starts
+        plt.close("all")
+
+
+# %% --- Stages ---
+
+@register_stage("imports")
+def import_packages():
+    """Import the heavy packages once for every stage."""
+
+    import contextily  # noqa: F401
+    import cv2  # noqa: F401
+    import geopandas  # noqa: F401
+    import matplotlib.pyplot  # noqa: F401
+    import pyproj  # noqa: F401
+    import scipy.stats  # noqa: F401
+
+
+@register_stage("load")
+def load_shared_frames():
+    """Build the district and park frames shared by the other stages."""
+
+    import data_loader
+    import grid_binning
+    import neighborhood_rollup
+    import park_access
+    import park_coverage
+
+    for loader in data_loader.dataset_loaders.values():
+        loader()
+
+    neighborhood_rollup.load_neighborhood_counts()
+    park_coverage.load_coverage_columns()
+    grid_binning.load_park_cells(grid_binning.map_resolution)
+    park_access.load_district_distances()
+
+
+@register_stage("export")
+def export_figures():
+    """Write the queued figures of every stage in parallel."""
+
+    import figure_export
+
+    figure_export.release()
+
+
+@register_stage("nufus")
+def render_nufus():
+    """Active green space against population."""
+
+    return run_script("parklarveyesilalanlar_analiz_ve_gorsellestirme_nufus.py")
+
+
+@register_stage("gelir")
+def render_gelir():
+    """Active green space against yearly household income."""
+
+    return run_script("parklarveyesilalanlar_analiz_ve_gorsellestirme_gelir.py")
+
+
+@register_stage("yayilim")
+def render_yayilim():
+    """Spatial distribution of the parks and green areas."""
+
+    return run_script("parklarveyesilalanlar_analiz_ve_gorsellestirme_yayilim.py")
+
+
+@register_stage("turler")
+def render_turler():
+    """Types of the parks and green areas."""
+
+    return run_script("parklarveyesilalanlar_analiz_ve_gorsellestirme_turler.py")
+
+
+@register_stage("satellite")
+def render_satellite():
+    """Green area index from the satellite image."""
+
+    return run_script("uydu_goruntu_yesil_alan_analizi.py")
+
+
+# Stages that every run needs, whichever reports are selected
+setup_stages = ["imports", "load"]
+
+# Stages that run after the reports
+final_stages = ["export"]
+
+
+# %% --- Run the batch ---
+
+def run_stages(selected):
+    """Run the selected stages and return their timings.
+
+    A failing stage is reported and the batch goes on with the next one.
+
+    Arguments:
+        selected (list of str): The names of the stages to run, in order.
+
+    Returns:
+        list of (str, float, bool): Name, seconds and success of every stage.
+    """
+
+    import figure_export
+
+    # The scripts read their inputs relative to their own folder
+    previous_directory = os.getcwd()
+    os.chdir(scripts_directory)
+
+    # The scripts only queue their figures, the export stage writes them all
+    figure_export.hold()
+
+    timings = []
+
+    try:
+        for name in selected:
+            start = time.perf_counter()
+            succeeded = True
+
+            try:
+                stages[name]()
+            except Exception:
+                succeeded = False
+                print("Stage '{}' failed:".format(name), file=sys.stderr)
+                traceback.print_exc()
+
+            timings.append((name, time.perf_counter() - start, succeeded))
+    finally:
+        os.chdir(previous_directory)
+
+    return timings
+
+
+def print_timings(timings):
+    total = sum(seconds for _, seconds, _ in timings)
+
+    print("")
+    print("{:<12} {:>10} {:>7}".format("stage", "seconds", "share"))
+
+    for name, seconds, succeeded in timings:
+        share = seconds / total * 100 if total else 0
+        print("{:<12} {:>10.2f} {:>6.1f}%{}".format(name, seconds, share, "" if succeeded else "  FAILED"))
+
+    print("{:<12} {:>10.2f}".format("total", total))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render every report in a single process.")
+    parser.add_argument("stages", nargs="*", help="The stages to run, all of them by default.")
+    parser.add_argument("--list", action="store_true", help="List the registered stages and exit.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of processes writing the figures, one per CPU by default.")
+    arguments = parser.parse_args()
+
+    if arguments.list:
+        for stage_name, stage in stages.items():
+            print("{:<12} {}".format(stage_name, stage.__doc__))
+        sys.exit(0)
+
+    unknown = [name for name in arguments.stages if name not in stages]
+    if unknown:
+        parser.error("unknown stage(s): " + ", ".join(unknown))
+
+    if arguments.workers is not None:
+        import figure_export
+
+        figure_export.workers = arguments.workers
+
+    # Setup stages always run first and the final stages last, each only once
+    fixed_stages = setup_stages + final_stages
+    report_stages = arguments.stages or [name for name in stages if name not in fixed_stages]
+    selected_stages = setup_stages + [name for name in report_stages if name not in fixed_stages] + final_stages
+
+    stage_timings = run_stages(selected_stages)
+    print_timings(stage_timings)
+
+    sys.exit(0 if all(succeeded for _, _, succeeded in stage_timings) else 1)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module caches the per-district results of the satellite analysis by
+content, so a run only recomputes the districts whose inputs changed.
+
+The key of a district is the SHA-256 hash of everything its result depends
+on: the pixels of its bounding box, the mask of its own pixels in that box
+(which also reflects the contours nested in it), its contour and the
+parameters of the analysis. A re-run on the same image and contours finds
+every district in the cache, a new image of which only some parts changed
+recomputes only the districts that cover them. Nothing keys on the position
+of the district in the contour list.
+
+Every result is a small .npz file of its arrays under
+Data/Cache/satellite_results, in a sub-folder named after the first two
+characters of the key. Bump cache_version when the analysis changes in a
+way the parameters don't show, older entries are then never read again.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import data_loader  # Shared, cached reader of the input datasets
+
+# %% --- Settings ---
+
+# Folder of the cached results
+cache_directory = os.path.join(data_loader.cache_directory, "satellite_results")
+
+# Part of every key, bump it to invalidate every cached result
+cache_version = 1
+
+
+# %% --- Helper functions and definitions ---
+
+def result_key(pixels, mask, contour, parameters):
+    """Return the content hash of the inputs of one district.
+
+    Arguments:
+        pixels (numpy.ndarray): The bounding box of the district in the image.
+        mask (numpy.ndarray): Boolean mask of its pixels in the bounding box.
+        contour (numpy.ndarray): Its contour.
+        parameters (dict): The settings of the analysis, JSON serializable.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": cache_version, "parameters": parameters}, sort_keys=True).encode())
+
+    for array in (pixels, mask, contour):
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.dtype.str, array.shape)).encode())
+        digest.update(array.data)
+
+    return digest.hexdigest()
+
+
+# Helper function: Path of the cached result of a key
+def result_path(key, directory=None):
+    return os.path.join(directory or cache_directory, key[:2], key + ".npz")
+
+
+def load_result(key, directory=None):
+    """Return the cached arrays of a key, None if it isn't cached."""
+
+    try:
+        with np.load(result_path(key, directory)) as cached:
+            return {name: cached[name] for name in cached.files}
+    except (OSError, ValueError):
+        return None
+
+
+def store_result(key, arrays, directory=None):
+    """Cache the arrays of a key, atomically."""
+
+    path = result_path(key, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # np.savez adds .npz to names without it
+    temporary_path = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(temporary_path, **arrays)
+    os.replace(temporary_path, path)
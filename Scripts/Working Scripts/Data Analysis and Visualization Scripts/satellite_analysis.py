@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module holds the per-district analysis of the satellite image used by
+uydu_goruntu_yesil_alan_analizi.py.
+
+The district contours are either traced from an image of the district map
+or taken from the shapefile through the geotransform of the satellite image
+(see georeference), in which case every result also names its district.
+Every district contour is filled once into an integer label image of the
+size of the satellite image, pixel value n + 1 for the n-th contour and 0
+outside of the districts. The pixel statistics of all the districts (pixel
+count, mean and median color, color histograms and the fraction of green
+pixels) then come from bincount passes over the whole image, counting only
+the pixels inside each district rather than its bounding box, which also
+holds neighbouring districts and the sea.
+
+The dominant color of every district is computed from its own pixels (see
+dominant_color, their mean for a single color). Its debug patches are only
+written when a stash folder is given, off the worker processes (see
+debug_artifacts). The contours
+are handed to a pool of worker processes in chunks, the results come back
+in contour order. The gray averages of all the dominant colors are then
+classified into green rates at once (see green_rate) and drawn onto the
+overlay image in the main process. The satellite and label images are passed
+to every worker once, when the worker starts, not with every contour.
+
+Given a cache folder, analyze_contours hashes the inputs of every district
+and only sends the districts it hasn't seen before to the workers (see
+result_cache).
+
+The number of worker processes is the CPU count by default and can be set
+with the SATELLITE_ANALYSIS_WORKERS environment variable or the max_workers
+argument of analyze_contours.
+
+analyze_vegetation is the vegetation index mode: instead of a color per
+district it measures the mean ExG or VARI index and the fraction of green
+pixels of every district, one bincount pass per block of rows through the
+same label image (see vegetation_index). Run this file directly to compare
+both on the mosaic, upscaled to mimic larger ones:
+
+    python satellite_analysis.py [--scales 1 4] [--block-rows 512]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import itertools
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import debug_artifacts  # Optional, background writing of the debug patches
+import dominant_color  # Mean for one color, mini-batch k-means for more
+import green_rate  # Configurable gray average to green rate classification
+import result_cache  # Per-district results cached by the content of their inputs
+import tiled_raster  # Windowed reading of mosaics too large for memory
+import vegetation_index  # Per-pixel ExG / VARI aggregated per district
+
+# %% --- Settings ---
+
+# Number of worker processes, None means one per CPU
+workers = int(os.environ["SATELLITE_ANALYSIS_WORKERS"]) if os.environ.get("SATELLITE_ANALYSIS_WORKERS") else None
+
+# Contours handed to a worker at once
+chunk_size = 4
+
+# Images the districts of a worker are cut from, set when the worker starts
+_worker_image = None
+_worker_labels = None
+
+
+# %% --- Labelled raster ---
+
+def select_contours(contours, min_contour_area, names=None):
+    """Return the contours larger than min_contour_area and their names, None without names."""
+
+    keep = [number for number, c in enumerate(contours) if cv2.contourArea(c) > min_contour_area]
+
+    return [contours[number] for number in keep], [names[number] if names else None for number in keep]
+
+
+# Helper function: Centroid of a contour in whole pixels
+def contour_center(c):
+    M = cv2.moments(c)
+    return int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"])
+
+
+def label_image(contours, shape):
+    """Fill every contour into one integer label image.
+
+    Arguments:
+        contours (list of numpy.ndarray): The district contours.
+        shape (tuple): Height and width of the image.
+
+    Returns:
+        numpy.ndarray: int32 image, n + 1 inside the n-th contour, 0 outside.
+    """
+
+    labels = np.zeros(shape[:2], dtype=np.int32)
+
+    # Larger contours first, so a contour nested in another keeps its pixels
+    for number in sorted(range(len(contours)), key=lambda index: -cv2.contourArea(contours[index])):
+        cv2.drawContours(labels, contours, number, number + 1, thickness=cv2.FILLED)
+
+    return labels
+
+
+def green_pixels(image):
+    """Return a mask of the pixels whose green channel dominates (BGR image)."""
+
+    blue, green, red = image[..., 0], image[..., 1], image[..., 2]
+
+    return (green > red) & (green > blue)
+
+
+# Helper function: Median of every row of a histogram
+def histogram_medians(histograms):
+    cumulative = histograms.cumsum(axis=-1)
+    half = cumulative[..., -1:] / 2
+
+    return (cumulative < half).sum(axis=-1)
+
+
+def district_statistics(image, labels, n_districts):
+    """Return the pixel statistics of every district of a label image.
+
+    Arguments:
+        image (numpy.ndarray): The BGR satellite image.
+        labels (numpy.ndarray): The label image of label_image.
+        n_districts (int): Number of districts, labels 1..n_districts.
+
+    Returns:
+        dict of numpy.ndarray, one row per district: pixel_count, mean and
+        median (BGR), histogram (district x channel x 256) and
+        green_fraction.
+    """
+
+    flat_labels = labels.ravel().astype(np.intp)
+    size = n_districts + 1
+
+    pixel_count = np.bincount(flat_labels, minlength=size)
+
+    # One histogram per district and channel: the bins of district n are
+    # n * 256 .. n * 256 + 255
+    histogram = np.stack([np.bincount(flat_labels * 256 + image[..., channel].ravel(), minlength=size * 256)
+                          .reshape(size, 256)
+                          for channel in range(3)], axis=1)
+
+    sums = (histogram * np.arange(256)).sum(axis=-1)
+    green_count = np.bincount(flat_labels, weights=green_pixels(image).ravel(), minlength=size)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / pixel_count[:, None]
+        green_fraction = green_count / pixel_count
+
+    # Label 0 is outside of every district
+    return {"pixel_count": pixel_count[1:],
+            "mean": mean[1:],
+            "median": histogram_medians(histogram)[1:],
+            "histogram": histogram[1:],
+            "green_fraction": green_fraction[1:]}
+
+
+# %% --- Per-district analysis ---
+
+def init_worker(image, labels):
+    """Keep the satellite and label images in a worker for all its contours."""
+
+    global _worker_image, _worker_labels
+    _worker_image = image
+    _worker_labels = labels
+
+    # Parallelism comes from the pool, one OpenCV thread per worker
+    cv2.setNumThreads(1)
+
+
+def analyze_contour(task):
+    """Compute the dominant color of one district.
+
+    Only the pixels of the district count, not its whole bounding box.
+
+    Arguments:
+        task (tuple): (number, contour, n_colors).
+
+    Returns:
+        dict: number, center (cX, cY), dominant color (BGR), gray_avg,
+        palette and counts of the contour.
+    """
+
+    number, c, n_colors = task
+    image_clone = _worker_image
+
+    cX, cY = contour_center(c)
+    x, y, w, h = cv2.boundingRect(c)
+    ROI = image_clone[y:y + h, x:x + w]
+    pixels = ROI[_worker_labels[y:y + h, x:x + w] == number + 1]
+
+    # Most frequent color first
+    if len(pixels):
+        palette, counts = dominant_color.dominant_colors(pixels, n_colors)
+    else:
+        # Every pixel of the contour belongs to a contour nested in it
+        palette, counts = np.full((1, 3), np.nan, dtype=np.float32), np.array([0])
+
+    return contour_result(number, (cX, cY), palette, counts)
+
+
+# Helper function: The result of a contour from its center and dominant colors
+def contour_result(number, center, palette, counts):
+    dominant = palette[0]
+    gray_avg = (dominant[0] + dominant[1] + dominant[2]) / 3
+
+    return {"number": number,
+            "center": (int(center[0]), int(center[1])),
+            "dominant": dominant,
+            "gray_avg": gray_avg,
+            "palette": palette,
+            "counts": counts}
+
+
+# Helper function: Bands of the dominant colors, as tall as their share of the pixels
+def dominant_patch(shape, palette, counts):
+    freqs = np.cumsum(np.hstack([[0], counts / float(counts.sum())]))
+    rows = np.int_(shape[0] * freqs)
+    dom_patch = np.zeros(shape=shape, dtype=np.uint8)
+    for i in range(len(rows) - 1):
+        dom_patch[rows[i]:rows[i + 1], :, :] += np.uint8(palette[i])
+    return dom_patch
+
+
+def analyze_contours(image, contours, min_contour_area=10, n_colors=1, classification=None, stash_directory=None,
+                     debug_format="png", max_workers=None, names=None, cache_directory=None):
+    """Analyse every district contour of the satellite image.
+
+    Arguments:
+        image (numpy.ndarray): The BGR satellite image.
+        contours (list of numpy.ndarray): The district contours.
+        min_contour_area (float): Smaller contours are skipped.
+        n_colors (int): Number of colors to find in every district, the
+            first one is the dominant color.
+        classification (tuple): The (edges, rates) of the green rate,
+            green_rate.load_classification() if None.
+        stash_directory (str): Where the debug patches are written, None to
+            skip them.
+        debug_format (str): How they are written, one of
+            debug_artifacts.ArtifactWriter.formats.
+        max_workers (int): Number of worker processes, the module setting if
+            None.
+        names (list of str): The district of every contour, such as those of
+            georeference.district_contours, None if unknown.
+        cache_directory (str): Where the results are cached by the content
+            of their inputs (see result_cache), None to always compute them.
+
+    Returns:
+        list of dict: The result of analyze_contour for every contour that
+        isn't skipped, in contour order, with its green_rate, its district_e
+        and the district_statistics of the contour under the same names.
+    """
+
+    global _worker_image, _worker_labels
+
+    selected, selected_names = select_contours(contours, min_contour_area, names)
+
+    labels = label_image(selected, image.shape)
+    statistics = district_statistics(image, labels, len(selected))
+
+    # Districts whose pixels, mask, contour and parameters were analysed before
+    parameters = {"n_colors": n_colors,
+                  "batch_size": dominant_color.batch_size,
+                  "batch_count": dominant_color.batch_count,
+                  "refine_iterations": dominant_color.refine_iterations}
+    keys, cached = {}, []
+
+    if cache_directory is not None:
+        for number, c in enumerate(selected):
+            x, y, w, h = cv2.boundingRect(c)
+            keys[number] = result_cache.result_key(image[y:y + h, x:x + w], labels[y:y + h, x:x + w] == number + 1,
+                                                   c, parameters)
+            arrays = result_cache.load_result(keys[number], cache_directory)
+            if arrays is not None:
+                cached.append(contour_result(number, arrays["center"], arrays["palette"], arrays["counts"]))
+
+    cached_numbers = {result["number"] for result in cached}
+    tasks = [(number, c, n_colors) for number, c in enumerate(selected) if number not in cached_numbers]
+
+    max_workers = min(max_workers or workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+    writer = debug_artifacts.ArtifactWriter(stash_directory, debug_format) if stash_directory is not None else None
+
+    # New results are cached and the debug patches of every result handed
+    # to the writer as the results come in, after the cached ones
+    def collect(analyzed):
+        results = []
+        for result in itertools.chain(cached, analyzed):
+            results.append(result)
+            if result["number"] in keys and result["number"] not in cached_numbers:
+                result_cache.store_result(keys[result["number"]], {"center": np.array(result["center"]),
+                                                                    "palette": result["palette"],
+                                                                    "counts": result["counts"]},
+                                          cache_directory)
+            if writer is not None and result["counts"].sum():
+                x, y, w, h = cv2.boundingRect(selected[result["number"]])
+                ROI = image[y:y + h, x:x + w]
+                writer.submit("dom_patch" + str(result["number"]),
+                              dominant_patch(ROI.shape, result["palette"], result["counts"]))
+                writer.submit("roi_" + str(result["number"]), ROI)
+        return sorted(results, key=lambda result: result["number"])
+
+    try:
+        if max_workers <= 1:
+            _worker_image, _worker_labels = image, labels
+            results = collect(map(analyze_contour, tasks))
+        else:
+            # map keeps the contour order whatever order the chunks finish in
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                     initargs=(image, labels)) as executor:
+                results = collect(executor.map(analyze_contour, tasks, chunksize=chunk_size))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    edges, rates = classification or green_rate.load_classification()
+    green_rates = green_rate.classify([result["gray_avg"] for result in results], edges, rates)
+
+    for result, rate in zip(results, green_rates):
+        result["green_rate"] = int(rate)
+        result["district_e"] = selected_names[result["number"]]
+        result.update({name: values[result["number"]] for name, values in statistics.items()})
+
+    return results
+
+
+# %% --- Vegetation index mode ---
+
+def analyze_vegetation(image, contours, min_contour_area=10, index="exg", threshold=0.1, block_rows=512,
+                       tile_size=None, overlap=0, names=None):
+    """Measure the vegetation index of every district contour.
+
+    The index of every pixel is computed by vegetation_index in blocks of
+    rows and aggregated through the label image, no per-district loop. Given
+    the path of the mosaic instead of the image, the mosaic is read and
+    aggregated one window at a time (see tiled_raster) and never held whole.
+
+    Arguments:
+        image (numpy.ndarray or str): The BGR satellite image, or the path of
+            the mosaic.
+        contours (list of numpy.ndarray): The district contours.
+        min_contour_area (float): Smaller contours are skipped.
+        index (str): The vegetation index, "exg" or "vari".
+        threshold (float): Pixels with a larger index are green.
+        block_rows (int): Rows of the image processed at once.
+        tile_size (int): Side of the windows the mosaic is read in, the
+            tiled_raster setting if None.
+        overlap (int): Pixels read around every window.
+        names (list of str): The district of every contour, None if unknown.
+
+    Returns:
+        list of dict: number, center, district_e, pixel_count, index_mean,
+        green_fraction and mean color of every contour that isn't skipped, in
+        contour order.
+    """
+
+    selected, selected_names = select_contours(contours, min_contour_area, names)
+
+    if isinstance(image, str):
+        statistics = tiled_raster.accumulate_tiles(
+            image, selected, lambda pixels: vegetation_index.index_values(pixels, index, threshold),
+            size=tile_size or tiled_raster.tile_size, overlap=overlap)
+    else:
+        labels = label_image(selected, image.shape)
+        statistics = vegetation_index.district_index_statistics(image, labels, len(selected), index=index,
+                                                                threshold=threshold, block_rows=block_rows)
+
+    return [dict({"number": number, "center": contour_center(c), "district_e": selected_names[number]},
+                 **{name: values[number] for name, values in statistics.items()})
+            for number, c in enumerate(selected)]
+
+
+def draw_green_rates(image, contours, results, font=cv2.FONT_HERSHEY_SIMPLEX, key="green_rate", text_format="{}"):
+    """Write the green rate of every district and draw the contours on an image.
+
+    Arguments:
+        image (numpy.ndarray): The image to draw on, modified in place.
+        contours (list of numpy.ndarray): The district contours.
+        results (list of dict): As returned by analyze_contours or
+            analyze_vegetation.
+        key (str): The result written at the center of every district.
+        text_format (str): Format of the written value.
+    """
+
+    for result in results:
+        cv2.putText(image, text_format.format(result[key]), result["center"], font, .3, (0), 1)
+
+    cv2.drawContours(image, contours, -1, (0, 0, 255), 0)
+
+    return image
+
+
+# %% --- Benchmark ---
+
+# Helper function: Best seconds and peak traced memory of a call
+def measure(function, repeat=3):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(seconds), peak
+
+
+if __name__ == "__main__":
+    import data_loader  # Paths of the satellite image and the district outlines
+
+    parser = argparse.ArgumentParser(description="Benchmark the vegetation index mode against the contour loop.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4],
+                        help="Upscaling factors of the mosaic, to mimic larger mosaics.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per timing, the best one is kept.")
+    parser.add_argument("--block-rows", type=int, default=512, help="Rows of the image processed at once.")
+    arguments = parser.parse_args()
+
+    mosaic = cv2.imread(data_loader.satellite_image_fp)
+    outlines = cv2.imread(data_loader.districts_image_fp, 0)
+    district_contours, _ = cv2.findContours(outlines, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+
+    print("{:>5} {:>12} {:>12} {:>12} {:>14} {:>14}".format("scale", "pixels", "contours", "vegetation",
+                                                            "contours peak", "vegetation peak"))
+
+    for scale in arguments.scales:
+        scaled_mosaic = cv2.resize(mosaic, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        scaled_contours = [c * scale for c in district_contours]
+
+        contour_seconds, contour_peak = measure(
+            lambda: analyze_contours(scaled_mosaic, scaled_contours, min_contour_area=10 * scale ** 2,
+                                     max_workers=1), arguments.repeat)
+        index_seconds, index_peak = measure(
+            lambda: analyze_vegetation(scaled_mosaic, scaled_contours, min_contour_area=10 * scale ** 2,
+                                       block_rows=arguments.block_rows), arguments.repeat)
+
+        print("{:>5} {:>12} {:>11.3f}s {:>11.3f}s {:>12.1f}MB {:>13.1f}MB".format(
+            scale, scaled_mosaic.shape[0] * scaled_mosaic.shape[1], contour_seconds, index_seconds,
+            contour_peak / 2 ** 20, index_peak / 2 ** 20))
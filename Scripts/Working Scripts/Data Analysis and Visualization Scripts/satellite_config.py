@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module reads satellite_config.json, the settings of the satellite
+analysis. Every part of the analysis reads its own section:
+
+    green_rate:        bin edges and rates of the green rate (green_rate)
+    analysis:          which per-district analysis the script runs, where its
+                       district contours come from (only "shapefile", the
+                       metrics need the district of every contour), whether
+                       the latest stored metrics are plotted instead
+                       (satellite_metrics) and whether district results are
+                       cached (result_cache)
+    debug:             level and format of the debug images (debug_artifacts)
+    vegetation_index:  index, threshold, block and tile sizes (vegetation_index,
+                       tiled_raster)
+    time_series:       folder of the dated mosaics of the time_series mode,
+                       relative to the Data folder (satellite_timeseries)
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import json
+import os
+
+# %% --- Settings ---
+
+# The configuration of the satellite analysis, next to this file
+config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "satellite_config.json")
+
+# Sources of the district contours the analysis accepts
+district_sources = ("shapefile",)
+
+
+# %% --- Helper functions and definitions ---
+
+def load_config(section=None, path=None):
+    """Return the satellite configuration, or one of its sections.
+
+    Arguments:
+        section (str): The section to return, the whole configuration if None.
+        path (str): The configuration file, satellite_config.json if None.
+    """
+
+    with open(path or config_path, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+
+    check_config(config, path or config_path)
+
+    return config[section] if section else config
+
+
+def check_config(config, path):
+    """Raise ValueError for settings the analysis can't run with, before any image is read.
+
+    The outlines traced from the district map image ("image") don't know
+    their district, and the per-district metrics can't be computed without
+    it.
+    """
+
+    district_source = config.get("analysis", {}).get("districts", "shapefile")
+
+    if district_source not in district_sources:
+        raise ValueError("analysis.districts is {!r} in {}, the satellite analysis only supports {}."
+                         .format(district_source, path, ", ".join(repr(source) for source in district_sources)))
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module keeps the per-district results of the satellite analysis as a
+table, one row per district keyed by district_e:
+
+    pixel_count                          area of the district on the image
+    centroid_x, centroid_y               centroid in pixels
+    longitude, latitude                  the same through the geotransform
+    mean_blue, mean_green, mean_red      mean color of the district
+    gray_avg, green_rate                 gray average and green rate of its
+                                         dominant color (dominant_color mode)
+    index_mean                           mean vegetation index
+                                         (vegetation_index mode)
+    green_fraction                       fraction of green pixels
+
+The results of the analysis come per contour. A district made of several
+contours (see georeference.district_contours) gets the mean of its contours
+weighted by their pixel counts.
+
+Every run of the analysis is written as its own Feather file under
+Data/Non-GIS data/processed/satellite_metrics, named after the time of the
+run to the microsecond, with a JSON manifest of the settings it ran with. The metrics of a
+series of dated mosaics (see satellite_timeseries) are kept the same way,
+under the district_series prefix. The plotting half of the satellite script
+reads the latest run, so the figures can be drawn again without analysing
+the image, and older runs stay around to compare with.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+from pyarrow import feather  # For memory-mapped reads of the runs
+
+import data_loader  # Shared, cached reader of the input datasets
+import green_rate  # Configurable gray average to green rate classification
+
+# %% --- Settings ---
+
+# Folder that holds one table per run of the analysis
+metrics_directory = os.path.join(data_loader.data_directory, "Non-GIS data", "processed", "satellite_metrics")
+
+# Columns averaged over the contours of a district, weighted by pixel count
+weighted_columns = ["centroid_x", "centroid_y", "mean_blue", "mean_green", "mean_red", "gray_avg", "index_mean",
+                    "green_fraction"]
+
+
+# %% --- Helper functions and definitions ---
+
+# Helper function: The per-contour columns of one result of the analysis
+def contour_row(result):
+    # The dominant color mode keeps the mean color as one BGR array
+    mean_color = result["mean"] if "mean" in result else [result.get("mean_" + channel, np.nan)
+                                                          for channel in ("blue", "green", "red")]
+
+    return {"district_e": result["district_e"],
+            "pixel_count": result["pixel_count"],
+            "centroid_x": result["center"][0],
+            "centroid_y": result["center"][1],
+            "mean_blue": mean_color[0],
+            "mean_green": mean_color[1],
+            "mean_red": mean_color[2],
+            "gray_avg": result.get("gray_avg", np.nan),
+            "index_mean": result.get("index_mean", np.nan),
+            "green_fraction": result["green_fraction"]}
+
+
+def district_metrics(results, transform=None, classification=None):
+    """Return the per-district metrics of the results of the analysis.
+
+    Arguments:
+        results (list of dict): As returned by analyze_contours or
+            analyze_vegetation, with the district_e of every contour.
+        transform (affine.Affine): The geotransform of the image, for the
+            longitude and latitude of the centroids.
+        classification (tuple): The (edges, rates) the green rates of the
+            districts are classified with, no green_rate column if None.
+
+    Returns:
+        pandas.DataFrame: One row per district, by district_e.
+
+    Raises:
+        ValueError: If the contours have no districts.
+    """
+
+    contours = pd.DataFrame([contour_row(result) for result in results])
+
+    if contours.empty or contours["district_e"].isna().all():
+        raise ValueError("The satellite metrics need the district of every contour, "
+                         "take the contours from the shapefile (see georeference.district_contours).")
+
+    contours = contours.dropna(subset=["district_e"])
+    weights = contours["pixel_count"].astype(float)
+    districts = contours["district_e"]
+
+    # Weighted means that skip the contours without a value
+    values = contours[weighted_columns].astype(float)
+    sums = values.mul(weights, axis=0).groupby(districts).sum(min_count=1)
+    totals = values.notna().mul(weights, axis=0).groupby(districts).sum()
+
+    table = sums / totals.replace(0, np.nan)
+    table.insert(0, "pixel_count", weights.groupby(districts).sum().astype(np.int64))
+
+    if transform is not None:
+        # Centroids are pixel centers, the transform starts at the pixel corner
+        table["longitude"], table["latitude"] = transform * (table["centroid_x"].to_numpy() + 0.5,
+                                                             table["centroid_y"].to_numpy() + 0.5)
+
+    if classification is not None:
+        table["green_rate"] = green_rate.classify(table["gray_avg"], *classification)
+
+    return table.reset_index()
+
+
+def save_metrics(table, settings=None, directory=None, prefix="district_metrics"):
+    """Write the metrics of a run next to the manifest of its settings.
+
+    Arguments:
+        table (pandas.DataFrame): As returned by district_metrics.
+        settings (dict): The settings of the run, satellite_config.json.
+        directory (str): Where the runs are kept, metrics_directory if None.
+        prefix (str): Kind of table, the name of the run is the prefix and
+            the time of the run.
+
+    Returns:
+        str: The name of the run.
+
+    Raises:
+        FileExistsError: If a run of the same name is already stored.
+    """
+
+    directory = directory or metrics_directory
+    created = datetime.datetime.now()
+    run = prefix + "_" + created.strftime("%Y%m%d-%H%M%S-%f")
+    table_path = os.path.join(directory, run + ".feather")
+
+    if os.path.exists(table_path):
+        raise FileExistsError("The satellite metrics run {} is already stored in {}.".format(run, directory))
+
+    os.makedirs(directory, exist_ok=True)
+
+    temporary_path = table_path + ".tmp"
+    table.to_feather(temporary_path, compression="uncompressed")
+    os.replace(temporary_path, table_path)
+
+    data_loader.write_manifest(os.path.join(directory, run + ".json"),
+                               {"run": run, "created": created.isoformat(timespec="microseconds"), "settings": settings})
+
+    return run
+
+
+def list_runs(directory=None, prefix="district_metrics"):
+    """Return the names of the stored runs of a kind, oldest first."""
+
+    directory = directory or metrics_directory
+
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(name[:-len(".feather")] for name in os.listdir(directory)
+                  if name.startswith(prefix + "_") and name.endswith(".feather"))
+
+
+def load_metrics(run=None, directory=None, prefix="district_metrics"):
+    """Return the metrics of a run, the latest one of its kind if run is None.
+
+    Raises:
+        FileNotFoundError: If no run is stored.
+    """
+
+    directory = directory or metrics_directory
+    runs = list_runs(directory, prefix)
+
+    if run is None:
+        if not runs:
+            raise FileNotFoundError("No satellite metrics in {}, run the satellite analysis first."
+                                    .format(directory))
+        run = runs[-1]
+
+    return feather.read_table(os.path.join(directory, run + ".feather"), memory_map=True).to_pandas()
+
+
+def load_settings(run, directory=None):
+    """Return the settings a run was made with, from its manifest."""
+
+    with open(os.path.join(directory or metrics_directory, run + ".json"), encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)["settings"]
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module runs the vegetation index analysis over a series of dated,
+co-registered mosaics of Istanbul to follow the green cover of the districts
+over time.
+
+The mosaics are the images of a folder whose names hold their date, like
+istanbul_2023-06-01.tif or istanbul_20230601.jpg, each georeferenced by its
+own geotransform (a GeoTIFF or a world file, see georeference). They are
+processed one after the other and every mosaic is read one window at a time
+(see tiled_raster), so memory never holds more than a tile of one image,
+however long the series:
+
+    district_series  the per-district metrics of every date, one row per
+                     district and date (see satellite_metrics)
+    series_matrix    one of those metrics as a district x date matrix
+    change_map       the pixels that became green or stopped being green
+                     between two dates, written window by window into a
+                     GeoTIFF with a color table
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import datetime
+import os
+import re
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+import rasterio
+from rasterio.windows import Window
+
+import georeference  # District contours from the shapefile on the satellite image grid
+import satellite_analysis  # Per-district analysis of the satellite image
+import satellite_metrics  # Stored per-district results of the satellite analysis
+import tiled_raster  # Windowed reading of mosaics too large for memory
+import vegetation_index  # Per-pixel ExG / VARI vegetation indices
+
+# %% --- Settings ---
+
+# Files of a series folder that are read as mosaics
+mosaic_extensions = (".tif", ".tiff", ".jpg", ".jpeg", ".png", ".jp2")
+
+# Date in the name of a mosaic, with or without dashes
+date_pattern = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})")
+
+# Codes of the change map and their colors (RGBA)
+change_codes = {"never_green": 0, "lost": 1, "gained": 2, "stayed_green": 3}
+change_colors = {0: (0, 0, 0, 0),
+                 1: (215, 48, 39, 255),
+                 2: (26, 152, 80, 255),
+                 3: (199, 233, 192, 255)}
+
+
+# %% --- Helper functions and definitions ---
+
+def dated_mosaics(directory):
+    """Return the dated mosaics of a folder, oldest first.
+
+    Returns:
+        list of tuple: (datetime.date, path) of every mosaic whose name
+        holds a date.
+
+    Raises:
+        FileNotFoundError: If the folder holds no dated mosaic.
+    """
+
+    mosaics = []
+
+    for name in os.listdir(directory):
+        match = date_pattern.search(name)
+        if match and name.lower().endswith(mosaic_extensions):
+            mosaics.append((datetime.date(*map(int, match.groups())), os.path.join(directory, name)))
+
+    if not mosaics:
+        raise FileNotFoundError("No mosaic with a date in its name in {}.".format(directory))
+
+    return sorted(mosaics)
+
+
+def district_series(mosaics, districts, index="exg", threshold=0.1, tile_size=None, overlap=0,
+                    min_contour_area=10):
+    """Return the per-district vegetation metrics of every mosaic of a series.
+
+    Arguments:
+        mosaics (list of tuple): (date, path) of every mosaic, as returned by
+            dated_mosaics.
+        districts (geopandas.GeoDataFrame): The districts.
+        index, threshold, tile_size, overlap: As in
+            satellite_analysis.analyze_vegetation.
+        min_contour_area (float): Smaller contours are skipped.
+
+    Returns:
+        pandas.DataFrame: The satellite_metrics columns of every district on
+        every date, with a date column.
+    """
+
+    # Co-registered mosaics share their transform, so usually their contours
+    contours_by_transform = {}
+    frames = []
+
+    for date, path in mosaics:
+        transform = georeference.load_geotransform(path)
+
+        if transform not in contours_by_transform:
+            contours_by_transform[transform] = georeference.district_contours(districts, transform)
+        contours, names = contours_by_transform[transform]
+
+        results = satellite_analysis.analyze_vegetation(path, contours, min_contour_area=min_contour_area,
+                                                        index=index, threshold=threshold, tile_size=tile_size,
+                                                        overlap=overlap, names=names)
+
+        frames.append(satellite_metrics.district_metrics(results, transform).assign(date=pd.Timestamp(date)))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def series_matrix(series, column="green_fraction"):
+    """Return one metric of district_series as a district x date matrix."""
+
+    return series.pivot(index="district_e", columns="date", values=column)
+
+
+def change_map(first_path, last_path, output_path, index="exg", threshold=0.1, tile_size=None, crs=None):
+    """Write the change of the green pixels between two co-registered mosaics.
+
+    Both mosaics are read and the map is written one window at a time.
+
+    Arguments:
+        first_path, last_path (str): The mosaics of the first and last date.
+        output_path (str): The GeoTIFF written, one change_codes value per
+            pixel with the change_colors color table.
+        index (str): The vegetation index, "exg" or "vari".
+        threshold (float): Pixels with a larger index are green.
+        tile_size (int): Side of the windows, the tiled_raster setting if
+            None.
+        crs (str): The coordinate system of the geotransform, such as the
+            districts' "EPSG:4326".
+
+    Returns:
+        dict: Number of pixels of every change code, by name.
+
+    Raises:
+        ValueError: If the mosaics aren't on the same grid.
+    """
+
+    size = tile_size or tiled_raster.tile_size
+    transform = georeference.load_geotransform(first_path)
+
+    with rasterio.open(first_path) as first, rasterio.open(last_path) as last:
+        if (first.width, first.height) != (last.width, last.height) or transform != last.transform:
+            raise ValueError("{} and {} aren't co-registered, their grids differ.".format(first_path, last_path))
+        width, height = first.width, first.height
+
+    profile = {"driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": "uint8",
+               "transform": transform, "crs": crs, "tiled": True, "blockxsize": 256, "blockysize": 256,
+               "compress": "deflate"}
+    counts = np.zeros(len(change_codes), dtype=np.int64)
+
+    with rasterio.open(output_path, "w", **profile) as output:
+        for (core, _, before), (_, _, after) in zip(tiled_raster.read_tiles(first_path, size),
+                                                    tiled_raster.read_tiles(last_path, size)):
+            was_green = vegetation_index.indices[index](before) > threshold
+            is_green = vegetation_index.indices[index](after) > threshold
+
+            # 0 never green, 1 lost, 2 gained, 3 stayed green
+            codes = was_green.astype(np.uint8) + 2 * is_green.astype(np.uint8)
+
+            row, col, window_height, window_width = core
+            output.write(codes, 1, window=Window(col, row, window_width, window_height))
+            counts += np.bincount(codes.ravel(), minlength=len(change_codes))
+
+        output.write_colormap(1, change_colors)
+
+    return {name: int(counts[code]) for name, code in change_codes.items()}
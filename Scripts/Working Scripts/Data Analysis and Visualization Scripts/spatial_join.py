@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module assigns point features, such as the parks and green areas of
+park_location_cleaned.csv, to the district polygon that contains them.
+
+The park scripts used to count the parks of a district from the district_tr
+and district_eng text columns of the CSV, although every row has its
+latitude and longitude. The text is wrong for some rows. Here the districts
+of istanbul_districts.shp are put in a Shapely 2 STRtree once, and every
+point is assigned by one vectorized query of the tree:
+
+    district_tree       the STRtree over the prepared district polygons
+    assign_districts    the district row of every point, one query for the
+                        points inside a district, one nearest query of the
+                        district outlines for the few just outside every
+                        polygon (parks on the coastline)
+    join_districts      a copy of the points with their geometric district
+    label_disagreements the points whose text district isn't the district
+                        their coordinates fall in
+
+The parks with their geometric district are cached by data_loader like the
+other datasets, keyed on the CSV and the shapefile.
+
+Run this file directly to list the parks whose text label disagrees with
+their coordinates, or to time the join on random points around the parks:
+
+    python spatial_join.py [--points 100000 500000]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd  # For general data processing tasks
+import shapely
+
+import data_loader  # Shared, cached reader of the input datasets
+
+# %% --- Settings ---
+
+# Columns of the districts copied to the points, prefixed with geo_
+district_columns = ("district_e", "district_t")
+
+# Points outside every district take the nearest one up to this distance, in
+# the coordinates of the districts (degrees, about 1 km)
+max_nearest_distance = 0.01
+
+
+# %% --- Helper functions and definitions ---
+
+def district_tree(districts):
+    """Return the STRtree of the district polygons, queried by row.
+
+    The polygons of the tree are prepared, so testing a point against a
+    district costs about the logarithm of its vertex count.
+    """
+
+    tree = shapely.STRtree(districts.geometry.values.copy())
+    shapely.prepare(tree.geometries)
+
+    return tree
+
+
+# Helper function: STRtree of the edges of the district outlines, for nearest queries
+def boundary_tree(districts):
+    """Return an STRtree of every edge of the district outlines.
+
+    The distance from a point to a whole polygon walks every vertex of it,
+    the nearest edge in this tree is found by its bounding box first.
+
+    Returns:
+        tuple: (shapely.STRtree, numpy.ndarray), the tree and the district
+        row of every edge.
+    """
+
+    polygons, polygon_rows = shapely.get_parts(districts.geometry.values, return_index=True)
+    coordinates, ring_index = shapely.get_coordinates(shapely.get_exterior_ring(polygons), return_index=True)
+
+    # Consecutive vertices of the same ring
+    same_ring = ring_index[1:] == ring_index[:-1]
+    edges = shapely.linestrings(np.stack([coordinates[:-1][same_ring], coordinates[1:][same_ring]], axis=1))
+
+    return shapely.STRtree(edges), polygon_rows[ring_index[:-1][same_ring]]
+
+
+def assign_districts(longitudes, latitudes, districts, tree=None):
+    """Return the district of every point.
+
+    Arguments:
+        longitudes, latitudes (array-like): The points, in the coordinates of
+            the districts.
+        districts (geopandas.GeoDataFrame): The districts.
+        tree (shapely.STRtree): The district_tree of the districts, built if
+            None.
+
+    Returns:
+        tuple: (rows, inside), the row of the district of every point and
+        whether the point lies in it. Points outside every district get the
+        nearest one within max_nearest_distance, the others -1.
+    """
+
+    tree = tree or district_tree(districts)
+    x = np.asarray(longitudes, dtype=float)
+    y = np.asarray(latitudes, dtype=float)
+    points = shapely.points(x, y)
+
+    # Candidate (point, district) pairs by bounding box, then the exact test
+    # against the prepared polygons for all pairs at once. A point on a
+    # shared border keeps the first of its districts.
+    point_index, district_index = tree.query(points)
+    hits = shapely.intersects_xy(tree.geometries[district_index], x[point_index], y[point_index])
+    matched, first = np.unique(point_index[hits], return_index=True)
+
+    rows = np.full(len(points), -1, dtype=np.int64)
+    rows[matched] = district_index[hits][first]
+
+    inside = rows >= 0
+    outside = np.flatnonzero(~inside)
+
+    if len(outside):
+        edges, edge_rows = boundary_tree(districts)
+        nearest_point, nearest_edge = edges.query_nearest(points[outside], max_distance=max_nearest_distance,
+                                                          all_matches=False)
+        rows[outside[nearest_point]] = edge_rows[nearest_edge]
+
+    return rows, inside
+
+
+def join_districts(points, districts, x="longitude", y="latitude", tree=None):
+    """Return a copy of the points with the columns of their district.
+
+    Arguments:
+        points (pandas.DataFrame): The points, with their coordinates.
+        districts (geopandas.GeoDataFrame): The districts.
+        x, y (str): The coordinate columns of the points.
+        tree (shapely.STRtree): The district_tree of the districts.
+
+    Returns:
+        pandas.DataFrame: The points with a geo_ column for every
+        district_columns, None for the points far from every district, and
+        geo_inside, False for the points that were given the nearest
+        district.
+    """
+
+    rows, inside = assign_districts(points[x], points[y], districts, tree)
+
+    joined = points.copy()
+    for column in district_columns:
+        joined["geo_" + column] = np.where(rows >= 0, districts[column].to_numpy()[rows], None)
+    joined["geo_inside"] = inside
+
+    return joined
+
+
+def label_disagreements(joined, text_column="district_eng", district_column="district_e"):
+    """Return the points whose text district isn't their geometric district.
+
+    Arguments:
+        joined (pandas.DataFrame): As returned by join_districts.
+        text_column (str): The district named by the text of the points.
+        district_column (str): The matching district_columns entry.
+    """
+
+    return joined.loc[joined[text_column] != joined["geo_" + district_column]]
+
+
+def load_park_districts(rebuild=False):
+    """Return the parks and green areas with their geometric district."""
+
+    return data_loader.load_cached("park_districts",
+                                   [data_loader.parks_fp]
+                                   + data_loader.shapefile_parts(data_loader.istanbul_districts_fp),
+                                   lambda: join_districts(data_loader.load_parks(), data_loader.load_districts()),
+                                   rebuild=rebuild)
+
+
+# %% --- Report and benchmark ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the parks whose district label disagrees with their "
+                                                 "coordinates, or time the join on random points.")
+    parser.add_argument("--points", type=int, nargs="+", help="Numbers of random points to time the join on.")
+    arguments = parser.parse_args()
+
+    istanbul_districts = data_loader.load_districts()
+
+    if arguments.points:
+        # Random points spread like the parks, a few hundred meters around them
+        park_coordinates = data_loader.load_parks().loc[:, ["longitude", "latitude"]].to_numpy()
+        generator = np.random.default_rng(0)
+
+        print("{:>10} {:>10} {:>10} {:>10}".format("points", "tree", "join", "outside"))
+
+        for count in arguments.points:
+            sampled = park_coordinates[generator.integers(len(park_coordinates), size=count)]
+            sampled = sampled + generator.normal(scale=0.003, size=sampled.shape)
+
+            start = time.perf_counter()
+            districts_tree = district_tree(istanbul_districts)
+            built = time.perf_counter()
+            _, sampled_inside = assign_districts(sampled[:, 0], sampled[:, 1], istanbul_districts, districts_tree)
+            print("{:>10} {:>9.3f}s {:>9.3f}s {:>10}".format(count, built - start, time.perf_counter() - built,
+                                                          int((~sampled_inside).sum())))
+    else:
+        parks = load_park_districts(rebuild=True)
+        disagreements = label_disagreements(parks)
+
+        print("{} of {} parks lie in another district than their label, {} outside every district."
+              .format(len(disagreements), len(parks), int((~parks["geo_inside"]).sum())))
+
+        with pd.option_context("display.width", 160):
+            print(disagreements.loc[:, ["institution_id", "institution_name", "district_eng", "geo_district_e",
+                                        "geo_inside"]].to_string(index=False))
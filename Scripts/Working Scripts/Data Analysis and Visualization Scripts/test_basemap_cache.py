@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+Tests of basemap_cache against a tile store of fake tiles, without network
+access:
+
+    python -m pytest test_basemap_cache.py
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import os
+
+import mercantile  # For the XYZ tile grid
+import numpy as np
+import pytest
+import xyzservices  # For a provider of fake tiles
+from PIL import Image  # For writing the fake tiles
+
+import basemap_cache  # The module under test
+
+# %% --- Settings ---
+
+# A provider whose tiles only exist in the fake store
+fake_source = xyzservices.TileProvider(name="FakeTiles", url="https://tiles.invalid/{z}/{x}/{y}.png",
+                                       attribution="Fake tiles")
+
+# Two by two tiles over the Bosphorus
+fake_tiles = basemap_cache.tiles_for_bounds(28.95, 40.95, 29.1, 41.1, [11])
+
+
+# %% --- Fixtures ---
+
+# Helper function: One flat color per tile, so the stitching can be checked
+def tile_color(tile):
+    return (tile.x % 256, tile.y % 256, 100, 255)
+
+
+@pytest.fixture
+def tile_store(tmp_path, monkeypatch):
+    """Write the fake tiles to a temporary store and compose into tmp_path."""
+
+    directory = tmp_path / "tiles"
+
+    for tile in fake_tiles:
+        path = basemap_cache.tile_path(fake_source, tile, str(directory))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new("RGBA", (256, 256), tile_color(tile)).save(path, format="PNG")
+
+    monkeypatch.setattr(basemap_cache, "composed_directory", str(tmp_path / "basemaps"))
+    monkeypatch.setattr(basemap_cache, "_composed_basemaps", {})
+
+    return str(directory)
+
+
+# %% --- Tests ---
+
+def test_read_tiles_stitches_the_tiles_at_their_extent(tile_store):
+    mosaic, extent = basemap_cache.read_tiles(fake_tiles, fake_source, tile_store)
+
+    assert len(fake_tiles) == 4
+    assert mosaic.shape == (512, 512, 4)
+
+    x_min = min(tile.x for tile in fake_tiles)
+    y_min = min(tile.y for tile in fake_tiles)
+    for tile in fake_tiles:
+        row, column = (tile.y - y_min) * 256, (tile.x - x_min) * 256
+        assert tuple(mosaic[row + 128, column + 128]) == tile_color(tile)
+
+    top_left = mercantile.xy_bounds(x_min, y_min, 11)
+    bottom_right = mercantile.xy_bounds(x_min + 1, y_min + 1, 11)
+    assert extent == pytest.approx((top_left.left, bottom_right.right, bottom_right.bottom, top_left.top))
+
+
+def test_composed_basemap_keeps_the_tile_extent(tile_store):
+    image, extent = basemap_cache.composed_basemap(fake_source, fake_tiles, "EPSG:3857", tile_store)
+
+    bounds = [mercantile.xy_bounds(tile) for tile in fake_tiles]
+    expected = (min(b.left for b in bounds), max(b.right for b in bounds),
+                min(b.bottom for b in bounds), max(b.top for b in bounds))
+    tile_width = bounds[0].right - bounds[0].left
+
+    assert image.shape[2] == 4
+    assert extent == pytest.approx(expected, abs=tile_width / 256)
+
+    # Served again from memory, then from the .npy file of a fresh process
+    assert basemap_cache.composed_basemap(fake_source, fake_tiles, "EPSG:3857", tile_store)[1] == extent
+    basemap_cache._composed_basemaps.clear()
+    reloaded, reloaded_extent = basemap_cache.composed_basemap(fake_source, fake_tiles, "EPSG:3857", tile_store)
+    assert isinstance(reloaded, np.memmap)
+    assert reloaded_extent == pytest.approx(extent)
+
+
+def test_missing_tile_raises_tile_cache_miss(tile_store):
+    os.remove(basemap_cache.tile_path(fake_source, fake_tiles[-1], tile_store))
+
+    with pytest.raises(basemap_cache.TileCacheMiss, match="1 of 4 basemap tiles"):
+        basemap_cache.composed_basemap(fake_source, fake_tiles, "EPSG:3857", tile_store)
+
+    with pytest.raises(basemap_cache.TileCacheMiss):
+        basemap_cache.read_tiles(fake_tiles, fake_source, tile_store)
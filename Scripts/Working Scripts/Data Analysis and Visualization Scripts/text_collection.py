@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module provides TextCollection, a single matplotlib artist that draws
+many short texts, such as the district names of a map.
+
+One Annotation per label means one artist to lay out, draw and pickle per
+label. A TextCollection holds the anchors, the strings and one shared style
+as arrays. At draw time it measures every string, lays all the boxes out in
+one vectorized pass and draws the texts in one go, inside a single SVG
+group.
+
+With avoid_collisions the texts are taken in order of priority (their order
+in the collection) and a text is left out if its box overlaps a text that
+is already placed. The boxes are computed at draw time, so the selection
+follows the final layout, the dpi of the output and the length of the
+strings of the current locale.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import numpy as np
+from matplotlib import artist
+from matplotlib.font_manager import FontProperties
+from matplotlib.transforms import Bbox
+
+
+# %% --- Helper functions and definitions ---
+
+# Helper function: Shift of the rotated text box for an alignment
+def alignment_shift(low, high, alignment):
+    """Return the shift that aligns boxes spanning low..high on the anchor.
+
+    Arguments:
+        low, high (numpy.ndarray): Extent of the boxes relative to their
+            text origin along one axis.
+        alignment (str): left/bottom, center, right/top or baseline.
+    """
+
+    if alignment in ("left", "bottom"):
+        return -low
+    if alignment in ("right", "top"):
+        return -high
+    if alignment == "center":
+        return -(low + high) / 2
+
+    # baseline: the text origin stays on the anchor
+    return np.zeros_like(low)
+
+
+# %% --- Text collection ---
+
+class TextCollection(artist.Artist):
+    """Many texts with one style, drawn as a single artist.
+
+    Arguments:
+        x, y (array-like): The anchors, in the coordinates of transform
+            (the data coordinates of the axis by default).
+        texts (list of str): One string per anchor.
+        offset (tuple): Shift of every text from its anchor, in points.
+        horizontalalignment (str): left, center or right.
+        verticalalignment (str): bottom, baseline, center or top.
+        rotation (float): Rotation of the texts in degrees.
+        fontsize (float): Font size in points, the rcParams default if None.
+        color: Color of the texts.
+        avoid_collisions (bool): Leave out texts that would overlap a text
+            placed before them.
+        padding (float): Extra space kept around every text when avoiding
+            collisions, in points.
+        **kwargs: Other Artist properties (zorder, alpha, gid, ...).
+    """
+
+    # Drawn above the patches and lines, like Text
+    zorder = 3
+
+    def __init__(self, x, y, texts, offset=(0, 0), horizontalalignment="center", verticalalignment="baseline",
+                 rotation=0, fontsize=None, color="black", avoid_collisions=False, padding=1, **kwargs):
+        super().__init__()
+
+        self._anchors = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+        self._texts = [str(text) for text in texts]
+        self._offset = np.asarray(offset, dtype=float)
+        self._horizontalalignment = horizontalalignment
+        self._verticalalignment = verticalalignment
+        self._rotation = float(rotation)
+        self._fontproperties = FontProperties(size=fontsize)
+        self._color = color
+        self.avoid_collisions = avoid_collisions
+        self.padding = padding
+
+        # Measured string sizes, keyed on (text, renderer type, dpi)
+        self._extents = {}
+
+        self._update_props(kwargs, "{cls.__name__}.set() got an unexpected keyword argument {prop_name!r}")
+
+    def __len__(self):
+        return len(self._texts)
+
+    def get_texts(self):
+        return list(self._texts)
+
+    def set_texts(self, texts):
+        """Replace the strings, one per anchor, for example for another locale."""
+
+        texts = [str(text) for text in texts]
+
+        if len(texts) != len(self._anchors):
+            raise ValueError("Expected {} texts, got {}.".format(len(self._anchors), len(texts)))
+
+        self._texts = texts
+        self.stale = True
+
+    def _measure(self, renderer):
+        """Return the widths, heights and descents of the strings in pixels."""
+
+        extents = np.empty((len(self._texts), 3))
+
+        for index, text in enumerate(self._texts):
+            key = (text, type(renderer).__name__, renderer.dpi)
+            if key not in self._extents:
+                self._extents[key] = renderer.get_text_width_height_descent(text, self._fontproperties,
+                                                                            ismath=False)
+            extents[index] = self._extents[key]
+
+        return extents[:, 0], extents[:, 1], extents[:, 2]
+
+    def layout(self, renderer):
+        """Place the texts for a renderer.
+
+        Returns:
+            tuple: (origins, boxes, shown), the display coordinates of the
+            text origins, the boxes as (x0, y0, x1, y1) rows, and a boolean
+            mask of the texts that are drawn.
+        """
+
+        if not len(self._texts):
+            return np.empty((0, 2)), np.empty((0, 4)), np.zeros(0, dtype=bool)
+
+        widths, heights, descents = self._measure(renderer)
+
+        # Corners of the text boxes around their origin, before rotation
+        corners_x = np.stack([np.zeros_like(widths), widths, widths, np.zeros_like(widths)], axis=1)
+        corners_y = np.stack([-descents, -descents, heights - descents, heights - descents], axis=1)
+
+        angle = np.deg2rad(self._rotation)
+        rotated_x = corners_x * np.cos(angle) - corners_y * np.sin(angle)
+        rotated_y = corners_x * np.sin(angle) + corners_y * np.cos(angle)
+
+        x0, x1 = rotated_x.min(axis=1), rotated_x.max(axis=1)
+        y0, y1 = rotated_y.min(axis=1), rotated_y.max(axis=1)
+
+        shift_x = alignment_shift(x0, x1, self._horizontalalignment)
+        shift_y = alignment_shift(y0, y1, self._verticalalignment)
+
+        origins = (self.get_transform().transform(self._anchors)
+                   + renderer.points_to_pixels(self._offset)
+                   + np.column_stack([shift_x, shift_y]))
+
+        boxes = np.column_stack([x0, y0, x1, y1]) + np.tile(origins, 2)
+
+        shown = np.all(np.isfinite(origins), axis=1)
+
+        if self.avoid_collisions:
+            shown &= self._select(boxes, renderer.points_to_pixels(self.padding))
+
+        return origins, boxes, shown
+
+    @staticmethod
+    def _select(boxes, padding):
+        """Keep the boxes, in order, that don't overlap a box kept before them."""
+
+        padded = boxes + np.array([-padding, -padding, padding, padding])
+        kept = np.zeros(len(boxes), dtype=bool)
+
+        for index, box in enumerate(padded):
+            placed = padded[kept]
+            overlaps = ((placed[:, 0] < box[2]) & (box[0] < placed[:, 2])
+                        & (placed[:, 1] < box[3]) & (box[1] < placed[:, 3]))
+            kept[index] = not overlaps.any()
+
+        return kept
+
+    def get_window_extent(self, renderer=None):
+        if renderer is None:
+            renderer = self.figure._get_renderer()
+
+        origins, boxes, shown = self.layout(renderer)
+
+        if not shown.any():
+            return Bbox.null()
+
+        boxes = boxes[shown]
+
+        return Bbox([[boxes[:, 0].min(), boxes[:, 1].min()], [boxes[:, 2].max(), boxes[:, 3].max()]])
+
+    @artist.allow_rasterization
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+
+        origins, boxes, shown = self.layout(renderer)
+
+        renderer.open_group("textcollection", gid=self.get_gid())
+
+        gc = renderer.new_gc()
+        gc.set_foreground(self._color)
+        gc.set_alpha(self.get_alpha())
+        gc.set_url(self.get_url())
+        self._set_gc_clip(gc)
+
+        # Like Text.draw: renderers with a flipped y axis count from the top
+        if renderer.flipy():
+            origins = origins * [1, -1] + [0, renderer.get_canvas_width_height()[1]]
+
+        for index in np.flatnonzero(shown):
+            renderer.draw_text(gc, origins[index, 0], origins[index, 1], self._texts[index], self._fontproperties,
+                               self._rotation)
+
+        gc.restore()
+        renderer.close_group("textcollection")
+
+        self.stale = False
+
+
+# Helper function: Add a text collection to an axis
+def add_texts(ax, x, y, texts, **kwargs):
+    """Add a TextCollection anchored in the data coordinates of an axis.
+
+    Arguments:
+        ax (matplotlib.axes.Axes): The axis.
+        x, y (array-like): The anchors.
+        texts (list of str): One string per anchor.
+        **kwargs: Passed to TextCollection.
+
+    Returns:
+        TextCollection: The added collection.
+    """
+
+    # Like the texts of ax.text, the collection isn't clipped to the axis
+    kwargs.setdefault("clip_on", False)
+
+    collection = TextCollection(x, y, texts, **kwargs)
+    collection.set_transform(ax.transData)
+
+    return ax.add_artist(collection)
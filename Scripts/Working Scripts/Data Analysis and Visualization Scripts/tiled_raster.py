@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module walks a large satellite mosaic in fixed-size windows and
+accumulates per-district statistics tile by tile, so the peak memory of the
+analysis depends on the tile size and not on the size of the mosaic.
+
+The satellite script used to read the whole image with cv2.imread and make
+two more full copies of it. Here the mosaic is opened with rasterio and only
+one window is read at a time. Every window can be read with an overlap
+around it, so that filters that look at neighbouring pixels give the same
+result at the tile seams as on the whole image; only the core of every tile,
+without the overlap, is counted.
+
+The districts of a tile are rendered into a label image of the size of the
+tile (see satellite_analysis.label_image for the whole-image version), only
+the contours whose bounding box meets the tile are drawn. The per-pixel
+values returned by a processing function are then summed per district with
+bincount into a DistrictAccumulator, whose means are the district
+statistics.
+
+Full-resolution per-pixel outputs, like the mask of the green pixels, are
+written window by window into a tiled GeoTIFF with write_tiles, and images
+meant to be looked at are drawn on a downsampled copy of the mosaic built
+one window at a time. Only the vegetation index mode is tiled, the dominant
+color analysis still needs the whole image in memory.
+
+Run this file directly to compare the whole-image and tiled vegetation
+index on the mosaic, upscaled and written to a temporary GeoTIFF:
+
+    python tiled_raster.py [--scales 1 4 8] [--tile-size 1024]
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import cv2
+import numpy as np
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+
+# %% --- Settings ---
+
+# Side of the square windows the mosaic is read in, in pixels
+tile_size = 1024
+
+# Longest side of the downsampled previews of a mosaic, in pixels
+preview_size = 4096
+
+
+# %% --- Tiled reader ---
+
+def tile_windows(height, width, size=tile_size, overlap=0):
+    """Yield the windows that cover an image of the given size.
+
+    Arguments:
+        height, width (int): Size of the image.
+        size (int): Side of the windows, without the overlap.
+        overlap (int): Pixels read around every window, clipped to the image.
+
+    Yields:
+        tuple: (core, padded, crop), the (row, col, height, width) of the
+        window and of the window with its overlap, and the slices that cut
+        the core out of the padded window.
+    """
+
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            core = (row, col, min(size, height - row), min(size, width - col))
+
+            top, left = max(row - overlap, 0), max(col - overlap, 0)
+            bottom = min(row + core[2] + overlap, height)
+            right = min(col + core[3] + overlap, width)
+            padded = (top, left, bottom - top, right - left)
+
+            crop = (slice(row - top, row - top + core[2]), slice(col - left, col - left + core[3]))
+
+            yield core, padded, crop
+
+
+def read_tiles(path, size=tile_size, overlap=0):
+    """Read a mosaic one window at a time.
+
+    Arguments:
+        path (str): The mosaic, any raster rasterio reads (GeoTIFF, JPEG...).
+        size (int): Side of the windows, without the overlap.
+        overlap (int): Pixels read around every window.
+
+    Yields:
+        tuple: (core, crop, pixels), as in tile_windows, pixels being the
+        padded window as a BGR uint8 image like cv2.imread returns.
+    """
+
+    with warnings.catch_warnings():
+        # A plain image has no geotransform, its pixel grid is all we need
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+
+        with rasterio.open(path) as dataset:
+            for core, padded, crop in tile_windows(dataset.height, dataset.width, size, overlap):
+                top, left, height, width = padded
+                bands = dataset.read([3, 2, 1], window=Window(left, top, width, height))
+
+                yield core, crop, np.ascontiguousarray(bands.transpose(1, 2, 0))
+
+
+# %% --- Tiled writer ---
+
+def write_tiles(path, output_path, process, size=tile_size, overlap=0):
+    """Write a per-pixel output of a mosaic into a GeoTIFF, one window at a time.
+
+    Arguments:
+        path (str): The mosaic.
+        output_path (str): The GeoTIFF written, one uint8 band on the grid
+            and geotransform of the mosaic.
+        process (callable): Takes the BGR pixels of a padded window and
+            returns a uint8 array of the same height and width.
+        size (int): Side of the windows, without the overlap.
+        overlap (int): Pixels read around every window.
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+
+        with rasterio.open(path) as dataset:
+            profile = {"driver": "GTiff", "width": dataset.width, "height": dataset.height, "count": 1,
+                       "dtype": "uint8", "transform": dataset.transform, "crs": dataset.crs, "tiled": True,
+                       "blockxsize": 256, "blockysize": 256, "compress": "deflate"}
+
+        with rasterio.open(output_path, "w", **profile) as output:
+            for core, crop, pixels in read_tiles(path, size, overlap):
+                row, col, height, width = core
+                output.write(np.asarray(process(pixels), dtype=np.uint8)[crop], 1,
+                             window=Window(col, row, width, height))
+
+
+def downsampled(path, max_side=preview_size, size=tile_size):
+    """Return a copy of a mosaic shrunk to at most max_side pixels, read one window at a time.
+
+    Returns:
+        tuple: (image, scale), the BGR uint8 image and the factor from the
+        pixel coordinates of the mosaic to the ones of the image.
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+
+        with rasterio.open(path) as dataset:
+            height, width = dataset.height, dataset.width
+
+    scale = min(1.0, max_side / max(height, width))
+    image = np.zeros((max(round(height * scale), 1), max(round(width * scale), 1), 3), dtype=np.uint8)
+
+    for core, _, pixels in read_tiles(path, size):
+        row, col, window_height, window_width = core
+        top, left = round(row * scale), round(col * scale)
+        bottom, right = round((row + window_height) * scale), round((col + window_width) * scale)
+
+        # Windows thinner than a pixel of the copy are covered by their neighbours
+        if bottom > top and right > left:
+            image[top:bottom, left:right] = cv2.resize(pixels, (right - left, bottom - top),
+                                                       interpolation=cv2.INTER_AREA)
+
+    return image, scale
+
+
+# %% --- Per-tile districts ---
+
+def drawing_order(contours):
+    """Return the contour numbers larger first and the bounding box of every contour.
+
+    Drawing the larger contours first keeps the pixels of nested contours,
+    like satellite_analysis.label_image.
+    """
+
+    order = sorted(range(len(contours)), key=lambda number: -cv2.contourArea(contours[number]))
+
+    return order, [cv2.boundingRect(c) for c in contours]
+
+
+def tile_labels(contours, window, order, boxes):
+    """Render the districts of one window into a label image.
+
+    Arguments:
+        contours (list of numpy.ndarray): The district contours, in image
+            coordinates.
+        window (tuple): (row, col, height, width) of the window.
+        order, boxes: As returned by drawing_order.
+
+    Returns:
+        numpy.ndarray: int32 image of the window, n + 1 inside the n-th
+        contour, 0 outside.
+    """
+
+    row, col, height, width = window
+    labels = np.zeros((height, width), dtype=np.int32)
+
+    for number in order:
+        x, y, w, h = boxes[number]
+
+        # Contours that miss the window leave it untouched
+        if x >= col + width or x + w <= col or y >= row + height or y + h <= row:
+            continue
+
+        cv2.drawContours(labels, contours, number, number + 1, thickness=cv2.FILLED, offset=(-col, -row))
+
+    return labels
+
+
+class DistrictAccumulator:
+    """Running per-district sums of per-pixel values.
+
+    Every call of add counts the pixels of every district and sums the given
+    per-pixel values under their names; means divides the sums by the pixel
+    counts. Label 0 is outside of every district and is dropped.
+    """
+
+    def __init__(self, n_districts):
+        self.size = n_districts + 1
+        self.pixel_count = np.zeros(self.size)
+        self.sums = {}
+
+    def add(self, labels, **values):
+        """Add the pixels of a label image and their values (arrays of the same shape)."""
+
+        flat_labels = labels.ravel()
+        self.pixel_count += np.bincount(flat_labels, minlength=self.size)
+
+        for name, value in values.items():
+            if name not in self.sums:
+                self.sums[name] = np.zeros(self.size)
+            self.sums[name] += np.bincount(flat_labels, weights=np.ravel(value), minlength=self.size)
+
+    def means(self):
+        """Return the pixel count and the mean of every value per district."""
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            statistics = {name: total[1:] / self.pixel_count[1:] for name, total in self.sums.items()}
+
+        return dict(pixel_count=self.pixel_count[1:].astype(np.int64), **statistics)
+
+
+def accumulate_tiles(path, contours, process, size=tile_size, overlap=0):
+    """Compute per-district means of per-pixel values over a mosaic, tile by tile.
+
+    Arguments:
+        path (str): The mosaic.
+        contours (list of numpy.ndarray): The district contours, in the pixel
+            coordinates of the mosaic.
+        process (callable): Takes the BGR pixels of a padded window and
+            returns a dict of per-pixel arrays of the same height and width.
+        size (int): Side of the windows, without the overlap.
+        overlap (int): Pixels read around every window, as much as the
+            neighbourhood process looks at.
+
+    Returns:
+        dict of numpy.ndarray: pixel_count and the mean of every value of
+        process, one row per district.
+    """
+
+    order, boxes = drawing_order(contours)
+    accumulator = DistrictAccumulator(len(contours))
+
+    for core, crop, pixels in read_tiles(path, size, overlap):
+        values = process(pixels)
+        accumulator.add(tile_labels(contours, core, order, boxes),
+                        **{name: value[crop] for name, value in values.items()})
+
+    return accumulator.means()
+
+
+# %% --- Benchmark ---
+
+# Helper function: Seconds and peak traced memory of one call
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, seconds, peak
+
+
+if __name__ == "__main__":
+    import data_loader  # Paths of the satellite image and the district outlines
+    import satellite_analysis  # Whole-image vegetation index, for comparison
+
+    parser = argparse.ArgumentParser(description="Compare the whole-image and tiled vegetation index.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 8],
+                        help="Upscaling factors of the mosaic, to mimic larger mosaics.")
+    parser.add_argument("--tile-size", type=int, default=tile_size, help="Side of the windows.")
+    arguments = parser.parse_args()
+
+    mosaic = cv2.imread(data_loader.satellite_image_fp)
+    outlines = cv2.imread(data_loader.districts_image_fp, 0)
+    district_contours, _ = cv2.findContours(outlines, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+
+    print("{:>5} {:>12} {:>12} {:>12} {:>12} {:>12} {:>14}".format("scale", "pixels", "whole", "tiled",
+                                                                   "whole peak", "tiled peak", "max difference"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in arguments.scales:
+            scaled_path = os.path.join(directory, "mosaic_{}.tif".format(scale))
+            scaled = cv2.resize(mosaic, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+            cv2.imwrite(scaled_path, scaled)
+            shape = scaled.shape
+            del scaled
+
+            scaled_contours = [c * scale for c in district_contours]
+
+            whole, whole_seconds, whole_peak = measure(
+                lambda: satellite_analysis.analyze_vegetation(cv2.imread(scaled_path), scaled_contours,
+                                                              min_contour_area=10 * scale ** 2))
+            tiled, tiled_seconds, tiled_peak = measure(
+                lambda: satellite_analysis.analyze_vegetation(scaled_path, scaled_contours,
+                                                              min_contour_area=10 * scale ** 2,
+                                                              tile_size=arguments.tile_size))
+
+            difference = max(abs(a["green_fraction"] - b["green_fraction"]) for a, b in zip(whole, tiled))
+
+            print("{:>5} {:>12} {:>11.3f}s {:>11.3f}s {:>10.1f}MB {:>10.1f}MB {:>14.2g}".format(
+                scale, shape[0] * shape[1], whole_seconds, tiled_seconds, whole_peak / 2 ** 20,
+                tiled_peak / 2 ** 20, difference))
@@ -13,67 +13,27 @@ from numpy import arange  # Generate bar positions
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes  # Import required toolkit
 import warnings
 
-warnings.filterwarnings("ignore")
-
-
-def auto_canny(image, sigma=0.33):
-    # compute the median of the single channel pixel intensities
-    v = np.median(image)
+import basemap_cache  # Offline basemap tiles for the map figures
+from bar_labels import add_value_labels  # Batched labels on top of the bars
+import data_loader  # Shared, cached reader of the input datasets
+import district_labels  # Cached, collision-aware district name labels
+import figure_export  # Parallel export of the finished figures
+import geometry_lod  # Simplified district geometry per output
+import georeference  # District contours from the shapefile on the satellite image grid
+import green_rate  # Configurable gray average to green rate classification
+import result_cache  # Per-district results cached by the content of their inputs
+import satellite_analysis  # Per-district analysis of the satellite image
+import satellite_config  # Settings of the satellite analysis
+import satellite_metrics  # Stored per-district results of the satellite analysis
+import satellite_timeseries  # Green cover of the districts over a series of dated mosaics
+import tiled_raster  # Windowed reading and writing of mosaics too large for memory
+import vegetation_index  # Per-pixel ExG / VARI vegetation indices
 
-    # apply automatic Canny edge detection using the computed median
-    lower = int(max(0, (1.0 - sigma) * v))
-    upper = int(min(255, (1.0 + sigma) * v))
-    edged = cv2.Canny(image, lower, upper)
-
-    # return the edged image
-    return edged
+warnings.filterwarnings("ignore")
 
 
 # %% --- Helper functions and definitions ---
 
-# Helper function: Add labels to the top of a bar chart.
-def add_value_labels(ax, spacing=5):
-    """Add labels to the end of each bar in a bar chart.
-
-    Arguments:
-        ax (matplotlib.axes.Axes): The matplotlib object containing the axes
-            of the plot to annotate.
-        spacing (int): The distance between the labels and the bars.
-    """
-
-    # For each bar: Place a label
-    for rect in ax.patches:
-        # Get X and Y placement of label from rect.
-        y_value = rect.get_height()
-        x_value = rect.get_x() + rect.get_width() / 2
-
-        # Number of points between bar and label. Change to your liking.
-        space = spacing
-        # Vertical alignment for positive values
-        va = 'bottom'
-
-        # If value of bar is negative: Place label below bar
-        if y_value < 0:
-            # Invert space to place label below
-            space *= -1
-            # Vertically align label at top
-            va = 'top'
-
-        # Use Y value as label and format number with one decimal place
-        label = "{:}".format(y_value)  # Remove .1f if you don't want one decimal place
-
-        # Create annotation
-        ax.annotate(
-            label,  # Use `label` as label
-            (x_value, y_value),  # Place label at end of the bar
-            xytext=(0, space),  # Vertically shift label by `space`
-            textcoords="offset points",  # Interpret `xytext` as offset in points
-            ha='center',  # Horizontally center label
-            va=va,  # Vertically align label differently for  positive and negative values.
-            rotation=90,
-            fontsize=15)  # Rotate label
-
-
 # Helper definitions --- Set dictionaries for fonts
 
 # %% --- Dynamically create a directory named after the file for outputs ---
@@ -123,108 +83,132 @@ font_xticks = {'family': 'sans-serif',
                'size': 16}
 
 complete_output_directory = incomplete_output_directory + filename_final_processed
-kernel = np.ones((3, 3), np.uint8)
-
-# Istanbul parks and green areas services data
-greenIndex_fp = "../../../Data/Non-GIS Data/external/district_income.xlsx"
-greenIndex = pd.read_excel(greenIndex_fp)
 
 # Istanbul geospatial districts data
-istanbul_districts_fp = "../../../Data/GIS data/Processed/istanbul_districts.shp"
-istanbul_districts = gpd.read_file(istanbul_districts_fp, )
-
-satellite_2D_istanbul = cv2.imread('../../../Data/Non-GIS Data/external/satellite-map-of-istanbul.jpg')
-raw_shapefile_districts = cv2.imread('../../../Data/Non-GIS Data/external/yayilim_with_no_name_tr.jpg', 0)
-raw_shapefile_districts_cleaned = cv2.imread('../../../Data/Non-GIS Data/external/districts_cleaned.jpg', 0)
-
-# Istanbul geospatial districts data
-istanbul_districts_fp = "../../../Data/GIS data/Processed/istanbul_districts.shp"
-istanbul_districts = gpd.read_file(istanbul_districts_fp, )
-
-image_clone = satellite_2D_istanbul.copy()
-
-h, w = raw_shapefile_districts.shape
-size = h, w, 1
-empty_mat = np.zeros(size, dtype=np.uint8)
-
-blur = cv2.GaussianBlur(raw_shapefile_districts, (1, 1), 0)
-edges = auto_canny(blur)
-
-edges = cv2.Canny(raw_shapefile_districts, threshold1=100, threshold2=200)
-edges_copy_alt = edges.copy()
-closing = cv2.morphologyEx(edges_copy_alt, cv2.MORPH_CLOSE, kernel)
-
-contours, hierarchy = cv2.findContours(raw_shapefile_districts_cleaned, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-
-font = cv2.FONT_HERSHEY_SIMPLEX
-h, w, _ = satellite_2D_istanbul.shape
-mask = np.zeros((h + 2, w + 2), np.uint8)
-counter = 0
-greenRate = -1
-minContourArea = 10
-image_converted = cv2.cvtColor(satellite_2D_istanbul, cv2.COLOR_BGR2RGB)
-
-for c in contours:
-    contourArea = cv2.contourArea(c)
-    if contourArea > minContourArea:
-        M = cv2.moments(c)
-        cX = int(M["m10"] / M["m00"])
-        cY = int(M["m01"] / M["m00"])
-        x, y, w, h = cv2.boundingRect(c)
-        ROI = image_clone[y:y + h, x:x + w]
-        average = ROI.mean(axis=0).mean(axis=0)
-        pixels = np.float32(ROI.reshape(-1, 3))
-
-        n_colors = 1
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, .1)
-        flags = cv2.KMEANS_RANDOM_CENTERS
-
-        _, labels, palette = cv2.kmeans(pixels, n_colors, None, criteria, 10, flags)
-        _, counts = np.unique(labels, return_counts=True)
-        dominant = palette[np.argmax(counts)]
-        # print('Dominant color: ', dominant)
-        indices = np.argsort(counts)[::-1]
-        gray_avg = (dominant[0] + dominant[1] + dominant[2]) / 3
-        if 0 < gray_avg < 25:
-            greenRate = 9
-        elif 25 <= gray_avg < 50:
-            greenRate = 8
-        elif 50 <= gray_avg < 75:
-            greenRate = 7
-        elif 75 <= gray_avg < 100:
-            greenRate = 6
-        elif 100 <= gray_avg < 125:
-            greenRate = 5
-        elif 125 <= gray_avg < 150:
-            greenRate = 4
-        elif 150 <= gray_avg < 175:
-            greenRate = 3
-        elif 175 <= gray_avg < 200:
-            greenRate = 2
-        elif 200 <= gray_avg < 225:
-            greenRate = 1
-        elif 225 <= gray_avg < 256:
-            greenRate = 0
-        cv2.putText(image_converted, str(greenRate), (cX, cY), font, .3, (0), 1)
-        cv2.putText(satellite_2D_istanbul, str(greenRate), (cX, cY), font, .3, (0), 1)
-        freqs = np.cumsum(np.hstack([[0], counts[indices] / float(counts.sum())]))
-        rows = np.int_(ROI.shape[0] * freqs)
-        dom_patch = np.zeros(shape=ROI.shape, dtype=np.uint8)
-        for i in range(len(rows) - 1):
-            dom_patch[rows[i]:rows[i + 1], :, :] += np.uint8(palette[indices[i]])
-        cv2.imwrite("../../../Data/Non-GIS Data/external/stash/dom_patch" + str(counter) + ".png", dom_patch)
-        cv2.imwrite("../../../Data/Non-GIS Data/external/stash/roi_" + str(counter) + ".png", ROI)
-        counter += 1
-
-cv2.drawContours(image_converted, contours, -1, (0, 0, 255), 0)
-cv2.drawContours(satellite_2D_istanbul, contours, -1, (0, 0, 255), 0)
-cv2.imwrite(complete_output_directory + r"/" + filename_final_processed + "contoursOverlayed.png",
-            satellite_2D_istanbul)
-
-green_area_index_district = greenIndex.loc[:, ['district_eng', 'green_area_index']]
-
-green_area_index_district.rename(columns={"district_eng": "district_e", "green_area_index": "green_area_index"},
-                                 inplace=True)
+istanbul_districts = data_loader.load_districts()
+
+# Which per-district analysis runs and on which contours, from satellite_config.json
+analysis_settings = satellite_config.load_config("analysis")
+analysis_mode = analysis_settings["mode"]
+
+if analysis_settings["reuse_metrics"] and satellite_metrics.list_runs():
+    # Plot the latest stored run without analysing the image again
+    district_metrics = satellite_metrics.load_metrics()
+    metrics_settings = satellite_metrics.load_settings(satellite_metrics.list_runs()[-1])
+elif analysis_mode == "time_series":
+    # Every dated mosaic of the series folder, one at a time and one window at a time
+    vegetation_settings = satellite_config.load_config("vegetation_index")
+    series_settings = satellite_config.load_config("time_series")
+    mosaics = satellite_timeseries.dated_mosaics(os.path.join(data_loader.data_directory,
+                                                              series_settings["directory"]))
+
+    district_series = satellite_timeseries.district_series(mosaics, istanbul_districts,
+                                                           index=vegetation_settings["index"],
+                                                           threshold=vegetation_settings["threshold"],
+                                                           tile_size=vegetation_settings["tile_size"],
+                                                           overlap=vegetation_settings["overlap"])
+    metrics_settings = satellite_config.load_config()
+    satellite_metrics.save_metrics(district_series, metrics_settings, prefix="district_series")
+    satellite_timeseries.series_matrix(district_series).to_csv(
+        complete_output_directory + r"/" + filename_final_processed + "greenFractionByDate.csv")
+
+    # Pixels that became green or stopped being green between the first and the last date
+    satellite_timeseries.change_map(mosaics[0][1], mosaics[-1][1],
+                                    complete_output_directory + r"/" + filename_final_processed + "greenChangeMap.tif",
+                                    vegetation_settings["index"], vegetation_settings["threshold"],
+                                    vegetation_settings["tile_size"], crs=istanbul_districts.crs.to_string())
+
+    # The maps and bars show the latest date
+    latest = district_series["date"] == district_series["date"].max()
+    district_metrics = district_series.loc[latest].drop(columns="date")
+else:
+    satellite_image_path = data_loader.satellite_image_fp
+
+    # The districts of the shapefile laid on the image by its world file, every contour knows its district
+    satellite_transform = georeference.load_geotransform(satellite_image_path)
+    contours, contour_districts = georeference.district_contours(istanbul_districts, satellite_transform)
+
+    minContourArea = 10
+
+    if analysis_mode == "vegetation_index":
+        # Vegetation index of every pixel, read and aggregated per district one window at a time
+        vegetation_settings = satellite_config.load_config("vegetation_index")
+        results = satellite_analysis.analyze_vegetation(satellite_image_path, contours,
+                                                        min_contour_area=minContourArea,
+                                                        names=contour_districts,
+                                                        **vegetation_settings)
+
+        # The green pixels of the same index and threshold, written one window at a time
+        index_function = vegetation_index.indices[vegetation_settings["index"]]
+        window_size = vegetation_settings["tile_size"] or tiled_raster.tile_size
+        tiled_raster.write_tiles(satellite_image_path,
+                                 complete_output_directory + r"/" + filename_final_processed + "greenIndexMask.tif",
+                                 lambda pixels: np.uint8(index_function(pixels) > vegetation_settings["threshold"]) * 255,
+                                 size=window_size)
+
+        # The mosaic is never read whole, the results are drawn on a downsampled copy
+        overlay_image, overlay_scale = tiled_raster.downsampled(satellite_image_path, size=window_size)
+
+        overlay_key, overlay_format = "green_fraction", "{:.0%}"
+        metrics_classification = None
+    else:
+        # The dominant color analysis isn't tiled, it holds the whole image in memory
+        satellite_2D_istanbul = cv2.imread(satellite_image_path)
+
+        # Bin edges and rates of the green rate, from satellite_config.json
+        green_rate_classification = green_rate.load_classification()
+
+        # The debug patches of every district are only written from debug level 1
+        debug_settings = satellite_config.load_config("debug")
+        stash_directory = (os.path.join(data_loader.data_directory, "Non-GIS data", "external", "stash")
+                           if debug_settings["level"] > 0 else None)
+
+        # Districts whose inputs didn't change since an earlier run come from the cache
+        result_cache_directory = result_cache.cache_directory if analysis_settings["cache_results"] else None
+
+        # Analyse the other districts in parallel, the results come back in contour order
+        results = satellite_analysis.analyze_contours(satellite_2D_istanbul, contours,
+                                                      min_contour_area=minContourArea,
+                                                      classification=green_rate_classification,
+                                                      stash_directory=stash_directory,
+                                                      debug_format=debug_settings["format"],
+                                                      names=contour_districts,
+                                                      cache_directory=result_cache_directory)
+
+        # The same classification applied to every pixel
+        green_rate_pixels = green_rate.green_rate_map(satellite_2D_istanbul, *green_rate_classification)
+        cv2.imwrite(complete_output_directory + r"/" + filename_final_processed + "greenRateMap.png",
+                    green_rate.colorize(green_rate_pixels))
+
+        overlay_image, overlay_scale = satellite_2D_istanbul, 1
+
+        overlay_key, overlay_format = "green_rate", "{}"
+        metrics_classification = green_rate_classification
+
+    # Write the results onto the image once every district is done, the analysis no longer reads it
+    overlay_contours = [np.int32(np.round(c * overlay_scale)) for c in contours]
+    overlay_results = [dict(result, center=tuple(int(round(v * overlay_scale)) for v in result["center"]))
+                       for result in results]
+    satellite_analysis.draw_green_rates(overlay_image, overlay_contours, overlay_results, key=overlay_key,
+                                        text_format=overlay_format)
+    cv2.imwrite(complete_output_directory + r"/" + filename_final_processed + "contoursOverlayed.png",
+                overlay_image)
+
+    # One row per district, kept as a new run of the metrics store
+    district_metrics = satellite_metrics.district_metrics(results, satellite_transform, metrics_classification)
+    metrics_settings = satellite_config.load_config()
+    satellite_metrics.save_metrics(district_metrics, metrics_settings)
+
+# Which pixels count as green depends on the mode of the analysis
+if metrics_settings["analysis"]["mode"] == "dominant_color":
+    green_pixel_rule = "green channel above red and blue"
+else:
+    green_pixel_rule = "{} above {}".format(metrics_settings["vegetation_index"]["index"].upper(),
+                                            metrics_settings["vegetation_index"]["threshold"])
+
+# The green area index is the share of green pixels of every district, in percent
+green_area_index_district = district_metrics.loc[:, ["district_e", "green_fraction"]]
+green_area_index_district["green_area_index"] = green_area_index_district.pop("green_fraction") * 100
 
 istanbul_districts = istanbul_districts.merge(green_area_index_district,
                                               on="district_e",
@@ -244,18 +228,19 @@ ax_1 = fig.add_subplot(2, 1, 1)
 
 # --- Plot Figure ---
 
-istanbul_districts.plot(ax=ax_1,
-                        column="green_area_index",
-                        edgecolor="black",
-                        alpha=1,
-                        cmap=cm.BuGn)
+geometry_lod.plot_districts(istanbul_districts,
+                            ax=ax_1,
+                            column="green_area_index",
+                            edgecolor="black",
+                            alpha=1,
+                            cmap=cm.BuGn)
 # YlGnBu -> blue schema
 # --- Set Basemap ---
 
 
-ctx.add_basemap(ax_1, zoom=11,  # 16
-                crs='EPSG:4326',
-                source=ctx.providers.Esri.WorldGrayCanvas)
+basemap_cache.add_basemap(ax_1, zoom=11,  # 16
+                          crs='EPSG:4326',
+                          source=ctx.providers.Esri.WorldGrayCanvas)
 
 # --- Spine and Grid ---
 
@@ -263,29 +248,10 @@ ax_1.set_axis_off()  # Turn off axis
 
 # --- Map Labels ---
 
-# Select districts that you want labels for
-districts_to_label_list = ["Silivri", "Catalca", "Buyukcekmece", "Arnavutkoy", "Eyupsultan", "Sariyer",
-                           "Beykoz", "Sile", "Cekmekoy", "Tuzla", "Pendik", "Maltepe", "Basaksehir", "Bahcelievler",
-                           "Beyoglu"]
-
-districts_to_label_indexes = [31, 5, 16, 3, 20, 33, 13, 1, 17, 37, 30]
-
-# Create a boolean indexing mask checking for those districts
-labels_mask = istanbul_districts.loc[:, "district_e"].isin(districts_to_label_list)
-
-# Pass in the boolean mask to create a dataframe
-districts_to_label = istanbul_districts.loc[labels_mask, ["district_e", "geometry"]]
-
-# Create a representative point within each district polygon to place the label
-districts_to_label["representative_point"] = districts_to_label.geometry.representative_point().geometry.values
-
-# Pass over each row label the repsentative point according to that row's name
-for idx, row in districts_to_label.iterrows():
-    ax_1.annotate(text=row["district_e"], xy=(row["representative_point"].x, row["representative_point"].y),
-                  xytext=(3, 3),  # Adjust the offset as needed
-                  textcoords="offset points",
-                  horizontalalignment='center',
-                  fontsize=10)  # Adjust the font size as needed
+# Names that would overlap the name of a larger district are left out
+district_labels.add_district_labels(ax_1,
+                                    offset=(3, 3),  # Adjust the offset as needed
+                                    fontsize=10)  # Adjust the font size as needed
 
 #                           --- BAR CHART: ---
 
@@ -365,7 +331,7 @@ ax_2.set_xticklabels(labels, rotation=90)
 
 # Setting custom y-axis tick intervals
 start, end = ax_2.get_ylim()
-ax_2.yaxis.set_ticks(np.arange(start, end, 50))
+ax_2.yaxis.set_ticks(np.arange(start, end, 10))
 
 # --- Spine and Grid ---
 
@@ -381,12 +347,12 @@ ax_2.set_xlabel("District",
                 labelpad=18)
 
 # Add y axis label
-ax_2.set_ylabel("Number of parks/green areas",
+ax_2.set_ylabel("Green pixels of the district (%)\n" + green_pixel_rule,
                 fontdict=font_axislabels,
                 labelpad=18)
 
 # Add labels to the top of the bars
-add_value_labels(ax_2)
+add_value_labels(ax_2, label_format="{:.0f}")
 
 # Set xtick font info
 
@@ -400,9 +366,10 @@ plt.tight_layout()
 
 # -------------
 # plt.show()
-export_path = complete_output_directory + r"/" + (filename_final_processed + "_figur_koroplet_ve_bar1.svg")
-plt.savefig(export_path, format="svg", dpi=900, bbox_inches="tight")
 
-# As png
-export_path = complete_output_directory + r"/" + (filename_final_processed + "_figur_koroplet_ve_bar1.png")
-plt.savefig(export_path, format="png", dpi=300, bbox_inches="tight")
+# As svg and png, each with the district geometry detail of its format
+figure_export.submit(fig,
+                     complete_output_directory + r"/" + (filename_final_processed + "_figur_koroplet_ve_bar1"),
+                     [("svg", 900), ("png", 300)])
+figure_export.flush()
+
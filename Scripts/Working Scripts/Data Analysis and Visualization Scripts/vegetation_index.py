@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+------ What's this file? ------
+
+This module computes RGB vegetation indices of the satellite image and
+aggregates them per district.
+
+The green rate of the satellite analysis averages the B, G and R channels
+of the dominant color, which measures brightness rather than vegetation.
+Here a vegetation index is computed for every pixel from its color alone:
+
+    exg:  Excess Green, 2g - r - b on the chromatic coordinates
+          r = R / (R + G + B), g = G / (R + G + B), b = B / (R + G + B)
+    vari: Visible Atmospherically Resistant Index, (G - R) / (G + R - B),
+          clipped to [-1, 1]
+
+A pixel is green when its index is above a threshold. The index mean and
+the green fraction of every district come from bincount passes over the
+district label image (see satellite_analysis.label_image). The image is
+processed in blocks of rows, so the float arrays of the index never hold
+more than one block whatever the size of the mosaic. Mosaics too large to
+be read at once are processed window by window with tiled_raster, through
+index_values.
+
+The index, the threshold and the block size are read from the
+"vegetation_index" section of satellite_config.json.
+
+--------------------------------
+"""
+
+# %% --- Import required packages ---
+
+import numpy as np
+
+import tiled_raster  # Windowed reading and per-district accumulation
+
+
+# %% --- Vegetation indices ---
+
+def excess_green(image):
+    """Return the Excess Green index of every pixel of a BGR image."""
+
+    channels = image.astype(np.float32)
+    total = channels.sum(axis=-1)
+    total[total == 0] = 1  # Black pixels get an index of 0
+
+    blue, green, red = channels[..., 0], channels[..., 1], channels[..., 2]
+
+    return (2 * green - red - blue) / total
+
+
+def vari(image):
+    """Return the VARI index of every pixel of a BGR image, in [-1, 1]."""
+
+    channels = image.astype(np.float32)
+    blue, green, red = channels[..., 0], channels[..., 1], channels[..., 2]
+
+    denominator = green + red - blue
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        index = (green - red) / denominator
+
+    index[denominator == 0] = 0
+
+    return np.clip(index, -1, 1)
+
+
+# The indices by the name used in the configuration
+indices = {"exg": excess_green,
+           "vari": vari}
+
+
+# %% --- Per-district aggregation ---
+
+def index_values(pixels, index="exg", threshold=0.1):
+    """Return the per-pixel index, green mask and channels of some BGR pixels, by statistic name."""
+
+    values = indices[index](pixels)
+
+    return {"index_mean": values,
+            "green_fraction": values > threshold,
+            "mean_blue": pixels[..., 0],
+            "mean_green": pixels[..., 1],
+            "mean_red": pixels[..., 2]}
+
+
+def district_index_statistics(image, labels, n_districts, index="exg", threshold=0.1, block_rows=512):
+    """Return the vegetation index statistics of every district.
+
+    Arguments:
+        image (numpy.ndarray): The BGR satellite image.
+        labels (numpy.ndarray): The label image, n + 1 inside the n-th
+            district and 0 outside.
+        n_districts (int): Number of districts, labels 1..n_districts.
+        index (str): One of indices.
+        threshold (float): Pixels with a larger index are green.
+        block_rows (int): Rows of the image processed at once.
+
+    Returns:
+        dict of numpy.ndarray, one row per district: pixel_count,
+        index_mean, green_fraction and the mean color (mean_blue,
+        mean_green, mean_red).
+    """
+
+    accumulator = tiled_raster.DistrictAccumulator(n_districts)
+
+    for start in range(0, image.shape[0], block_rows):
+        accumulator.add(labels[start:start + block_rows],
+                        **index_values(image[start:start + block_rows], index, threshold))
+
+    return accumulator.means()
+
+
+def green_mask(image, index="exg", threshold=0.1, block_rows=512):
+    """Return the mask of the green pixels of an image, computed in blocks."""
+
+    mask = np.zeros(image.shape[:2], dtype=bool)
+
+    for start in range(0, image.shape[0], block_rows):
+        mask[start:start + block_rows] = indices[index](image[start:start + block_rows]) > threshold
+
+    return mask